@@ -0,0 +1,652 @@
+# Author: Tyler Jordan
+# File: jbench.py
+# Last Modified: 10/18/2026
+# Description: Benchmarks jscan against a simulated fleet of Junos devices, no real devices are touched.
+
+import os
+import re
+import sys
+import json
+import time
+import getopt
+import random
+import shutil
+import hashlib
+import tempfile
+import ipaddress
+import tracemalloc
+import contextlib
+import xml.etree.ElementTree as ET
+
+from unittest import mock
+
+import jscan
+import utility
+import jtransfer
+from jscan import Menu
+from jpool import SessionPool
+from jrack import JRack
+from jmetrics import nearest_rank
+from jcompliance import fleet_compliance
+from prettytable import PrettyTable
+
+# Operations in the order they are run, each one leaves the fleet ready for the next
+OPERATIONS = ['discover', 'refresh', 'oper', 'set', 'stage', 'upgrade', 'reboot']
+MODELS = ['EX4300-48P', 'EX2300-24T', 'QFX5100-48S', 'SRX345']
+SITES = ['DC1', 'DC2', 'BR1', 'BR2']
+IMAGE = 'jinstall-ex-4300-18.4R3.3-signed.tgz'
+
+usage = "jbench.py [-s <sizes>] [-w <workers>] [-o <operations>] [--latency=<seconds>] [--failure-rate=<0-1>] " \
+        "[--install-time=<seconds>] [--reboot-time=<seconds>] [--output-size=<bytes>] [--save=<file>] " \
+        "[--baseline=<file>] [--tolerance=<fraction>] [--bandwidth=<Mbit/s>] [--site-bandwidth=<site>=<Mbit/s>,...] " \
+        "[--sftp] [--rack]"
+
+
+class SimState:
+
+    def __init__(self, ip, number):
+        # What the simulated device is running and whether it is up
+        self.ip = ip
+        self.hostname = "sim-{0:05d}".format(number)
+        self.model = MODELS[number % len(MODELS)]
+        self.site = SITES[number % len(SITES)]
+        self.version = "18.4R2-S3"
+        self.pending = None
+        self.staged = None
+        self.down_until = 0.0
+
+    def reachable(self):
+        return time.time() >= self.down_until
+
+
+class SimFleet:
+    """ Purpose: A fleet of simulated devices on the 198.18.0.0/15 benchmarking network. Every request to a device
+                 waits "latency" seconds (+/- jitter) and fails with probability failure_rate.
+        Parameters:
+            size            -   Number of devices
+            latency         -   Seconds for one round trip to a device
+            jitter          -   Fraction the latency varies by
+            failure_rate    -   Probability that a connection, install, lock or reboot fails
+            install_time    -   Seconds an install (or image copy) takes
+            reboot_time     -   Seconds a device is unreachable after a reboot
+            output_size     -   Bytes of output returned by each operational command
+            seed            -   Random seed, so runs are repeatable
+    """
+
+    def __init__(self, size, latency=0.02, jitter=0.5, failure_rate=0.0, install_time=0.2, reboot_time=0.5,
+                 output_size=4096, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.install_time = install_time
+        self.reboot_time = reboot_time
+        self.output_size = output_size
+        self.random = random.Random(seed)
+        self.devices = {}
+        for number, ip in zip(range(size), ipaddress.ip_network('198.18.0.0/15').hosts()):
+            self.devices[str(ip)] = SimState(str(ip), number)
+
+    def delay(self, seconds=None):
+        seconds = self.latency if seconds is None else seconds
+        time.sleep(seconds * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def fail(self):
+        return self.random.random() < self.failure_rate
+
+    def device(self, ip, **kwargs):
+        # Stand-in for jnpr.junos.Device, used as the session pool's device factory
+        return SimDevice(self, ip)
+
+    def netconf(self, ip, username, password, port):
+        # Stand-in for utility.run(), the ncclient connection used by set_command()
+        self.delay(3 * self.latency)
+        state = self.devices[ip]
+        if not state.reachable() or self.fail():
+            return None
+        return SimNetconf(self, state)
+
+    def ssh_client(self):
+        # Stand-in for paramiko.SSHClient, used by op_commands()
+        return SimSSHClient(self)
+
+
+class SimDevice:
+
+    def __init__(self, fleet, ip):
+        self.fleet = fleet
+        self.ip = ip
+        self.hostname = ip
+        self.state = fleet.devices[ip]
+        self.connected = False
+        self.timeout = 30
+        self.rpc = SimRPC(self)
+
+    def open(self):
+        # SSH and the NETCONF hello take a few round trips
+        self.fleet.delay(3 * self.fleet.latency)
+        if not self.state.reachable() or self.fleet.fail():
+            raise ConnectionError("Simulated connection failure to {0}".format(self.ip))
+        self.connected = True
+        return self
+
+    @property
+    def facts(self):
+        return {'model': self.state.model, 'version': self.state.version, 'hostname': self.state.hostname}
+
+    def close(self):
+        self.connected = False
+
+
+class SimRPC:
+
+    def __init__(self, dev):
+        self.dev = dev
+
+    def get_software_information(self):
+        self.dev.fleet.delay()
+        rsp = ET.Element('software-information')
+        ET.SubElement(rsp, 'host-name').text = self.dev.state.hostname
+        ET.SubElement(rsp, 'product-model').text = self.dev.state.model
+        ET.SubElement(rsp, 'junos-version').text = self.dev.state.version
+        return rsp
+
+    def get_system_uptime_information(self):
+        self.dev.fleet.delay()
+        return ET.Element('system-uptime-information')
+
+    def file_list(self, detail=True, path=None):
+        self.dev.fleet.delay()
+        rsp = ET.Element('directory-list')
+        staged = self.dev.state.staged
+        if staged and path and path.endswith(staged[0]):
+            ET.SubElement(ET.SubElement(rsp, 'file-information'), 'file-size').text = str(staged[2])
+        return rsp
+
+
+class SimSW:
+
+    def __init__(self, dev):
+        # Stand-in for jnpr.junos.utils.sw.SW
+        self.dev = dev
+        self.fleet = dev.fleet
+        self.state = dev.state
+
+    def install(self, package=None, remote_path='/var/tmp', progress=None, validate=False, no_copy=False,
+                checksum=None, checksum_algorithm='md5', timeout=1800, **kwargs):
+        if not no_copy:
+            self.fleet.delay(self.fleet.install_time / 2)
+        if callable(progress):
+            progress(self.dev, "installing software ... please be patient ...")
+        self.fleet.delay(self.fleet.install_time)
+        if self.fleet.fail():
+            return False
+        match = re.search(r'(\d+\.\d+[RXS][\w.\-]*?)(?:-signed|-domestic)?\.tgz$', package)
+        self.state.pending = match.group(1) if match else package
+        return True
+
+    def validate(self, remote_package, issu=False, nssu=False, **kwargs):
+        self.fleet.delay(self.fleet.install_time / 4)
+        return not self.fleet.fail()
+
+    def reboot(self, *args, **kwargs):
+        self.fleet.delay()
+        if self.fleet.fail():
+            raise RuntimeError("Simulated reboot failure")
+        self.state.down_until = time.time() + self.fleet.reboot_time
+        if self.state.pending:
+            self.state.version = self.state.pending
+            self.state.pending = None
+        self.dev.connected = False
+        return "Shutdown NOW!"
+
+    def remote_checksum(self, remote_file, algorithm='md5'):
+        self.fleet.delay()
+        staged = self.state.staged
+        if staged and remote_file.endswith(staged[0]):
+            return staged[1]
+        return None
+
+    def safe_copy(self, package, remote_path='/var/tmp', progress=False, checksum=None, checksum_algorithm='md5',
+                  force_copy=False, **kwargs):
+        self.fleet.delay(self.fleet.install_time / 2)
+        if self.fleet.fail():
+            return False
+        self.state.staged = (os.path.basename(package), checksum, os.path.getsize(package))
+        return True
+
+
+class SimNetconf:
+
+    def __init__(self, fleet, state):
+        # Stand-in for an ncclient manager
+        self.fleet = fleet
+        self.state = state
+
+    def lock(self):
+        self.fleet.delay()
+        if self.fleet.fail():
+            raise RuntimeError("configuration database locked by another user")
+
+    def load_configuration(self, action='set', config=None):
+        self.fleet.delay()
+
+    def commit(self):
+        self.fleet.delay(2 * self.fleet.latency)
+
+    def unlock(self):
+        self.fleet.delay()
+
+    def close_session(self):
+        pass
+
+
+class SimSSHClient:
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.ip = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, ip, port=22, username=None, password=None, **kwargs):
+        self.fleet.delay(3 * self.fleet.latency)
+        if not self.fleet.devices[ip].reachable() or self.fleet.fail():
+            raise ConnectionError("Simulated SSH failure to {0}".format(ip))
+        self.ip = ip
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return SimChannel(self.fleet)
+
+    def open_sftp(self):
+        return SimSFTP(self.fleet, self.fleet.devices[self.ip])
+
+    def close(self):
+        pass
+
+
+class SimSFTP:
+
+    def __init__(self, fleet, state):
+        # Stand-in for paramiko.SFTPClient, used by the transfer scheduler
+        self.fleet = fleet
+        self.state = state
+
+    def open(self, path, mode='r'):
+        self.fleet.delay()
+        return SimSFTPFile(self.fleet, self.state, path)
+
+    def stat(self, path):
+        self.fleet.delay()
+        staged = self.state.staged
+        if staged and path.endswith(staged[0]):
+            return os.stat_result((0, 0, 0, 0, 0, 0, staged[2], 0, 0, 0))
+        raise IOError("No such file: {0}".format(path))
+
+    def close(self):
+        pass
+
+
+class SimSFTPFile:
+
+    def __init__(self, fleet, state, path):
+        # The image is not kept, only its size and checksum, as remote_checksum() reports them. Only copies
+        # written from the start in one go get a checksum.
+        self.fleet = fleet
+        self.state = state
+        self.path = path
+        self.size = 0
+        self.hasher = hashlib.md5()
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+    def seek(self, offset):
+        if offset != self.size:
+            self.hasher = None
+
+    def truncate(self, size):
+        pass
+
+    def check(self, *args):
+        raise IOError("check-file is not supported")
+
+    def prefetch(self, *args):
+        pass
+
+    def read(self, size):
+        return b''
+
+    def write(self, data):
+        self.size += len(data)
+        if self.hasher:
+            self.hasher.update(data)
+
+    def close(self):
+        if self.fleet.fail():
+            raise IOError("Simulated transfer failure")
+        self.state.staged = (os.path.basename(self.path), self.hasher.hexdigest() if self.hasher else None, self.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SimChannel:
+
+    line = b"ge-0/0/0                up    up   inet     10.0.0.1/24\n"
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.remaining = 0
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, command):
+        self.fleet.delay()
+        self.remaining = self.fleet.output_size
+
+    def shutdown_write(self):
+        pass
+
+    def recv(self, size):
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return (SimChannel.line * (size // len(SimChannel.line) + 1))[:size]
+
+    def close(self):
+        pass
+
+
+def timed(func, samples):
+    # Wrap a per-device function so the duration of every call is recorded
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(time.time() - start)
+    return wrapper
+
+
+def run_operation(menu, operation, fleet, samples):
+    # Run one operation over the whole rack through the real jscan code, returns the number of failed devices
+    devices = menu.jrack.devices
+    if operation == 'discover':
+        menu.discover_device = timed(menu.discover_device, samples)
+        added, failed = menu.discover_devices({'ip': ip, 'tar_code': IMAGE, 'site': state.site}
+                                              for ip, state in fleet.devices.items())
+        return len(failed)
+    if operation == 'refresh':
+        menu.refresh_version = timed(menu.refresh_version, samples)
+        return len(menu.run_refresh(devices))
+    if operation == 'oper':
+        menu.oper_device = timed(menu.oper_device, samples)
+        return len(menu.run_oper_commands(['show version', 'show interfaces terse'], Menu.log_dir + "bench_oper.log"))
+    if operation == 'set':
+        with mock.patch.object(jscan, 'set_command', timed(jscan.set_command, samples)):
+            outcomes = menu.run_set_commands(['set system ntp server 192.0.2.1'], Menu.log_dir + "bench_set.log")
+        return len([outcome for outcome in outcomes if outcome['Result'] != 'Committed'])
+    if operation == 'stage':
+        menu.stage_device = timed(menu.stage_device, samples)
+        results = menu.run_staging(devices)
+        return len([result for result in results if result['Result'] == 'Failed'])
+    if operation == 'upgrade':
+        menu.upgrade_device = timed(menu.upgrade_device, samples)
+        statusList = menu.run_upgrades(devices, 'noReboot')
+        return len([statusDict for statusDict in statusList if statusDict['OS_installed'] != 'Y'])
+    if operation == 'reboot':
+        menu.reboot_device = timed(menu.reboot_device, samples)
+        statusList = menu.run_reboots(devices)
+        return len([statusDict for statusDict in statusList if statusDict['Rebooted'] != 'Y'])
+    raise ValueError("Unknown operation: {0}".format(operation))
+
+
+def bench_size(size, operations, workers, fleet_options):
+    """ Purpose: Benchmark the operations on a rack of "size" simulated devices.
+        Returns:
+            Dictionary of operation to its devices, failed, seconds, throughput, p50/p95/p99 (ms) and peak_mb
+    """
+    fleet = SimFleet(size, **fleet_options)
+    Menu.username = 'bench'
+    Menu.password = 'bench'
+    Menu.inventory_db = ''
+    Menu.max_workers = workers
+    Menu.upgrade_workers = workers
+    Menu.lock_backoff = fleet.latency
+    menu = Menu()
+    menu.set_dir_format()
+    Menu.pool = SessionPool(Menu.username, Menu.password, max_sessions=Menu.max_sessions, max_idle=Menu.session_idle)
+    Menu.pool.device_factory = fleet.device
+    menu.start_transfers()
+    if Menu.scheduler:
+        # Simulated transfers fail at close, reconnecting right away keeps the run short
+        Menu.scheduler.retry_delay = fleet.latency
+
+    results = {}
+    # jscan imports PyEZ and paramiko when an operation needs them, so they are patched where they are defined
+    with mock.patch('jnpr.junos.utils.sw.SW', SimSW), mock.patch.object(utility, 'run', fleet.netconf), \
+            mock.patch('paramiko.SSHClient', fleet.ssh_client):
+        for operation in operations:
+            if operation != 'discover' and not menu.jrack.devices:
+                continue
+            samples = []
+            tracemalloc.reset_peak()
+            start = time.time()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                failed = run_operation(menu, operation, fleet, samples)
+            elapsed = time.time() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            samples.sort()
+            results[operation] = {
+                'devices': len(samples),
+                'failed': failed,
+                'seconds': round(elapsed, 3),
+                'throughput': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+                'p50': round(nearest_rank(samples, 0.50) * 1000, 1),
+                'p95': round(nearest_rank(samples, 0.95) * 1000, 1),
+                'p99': round(nearest_rank(samples, 0.99) * 1000, 1),
+                'peak_mb': round(peak / 1048576.0, 2)
+            }
+    Menu.pool.close_all()
+    if Menu.scheduler:
+        Menu.scheduler.close()
+        Menu.scheduler = None
+    menu.jrack.close()
+    return results
+
+
+def bench_rack(size, repeat=5):
+    """ Purpose: Measure the rack itself, without any device operations: the memory each device takes and how long
+                 filtering and grouping "size" devices takes. The device values are built for each device, as they
+                 are when read from the devices, so identical models and versions are separate strings until the
+                 rack interns them.
+        Returns:
+            Dictionary with the bytes per device, the seconds to add the devices (traced) and the best of "repeat"
+            times (ms) to filter a list of devices (scan), to filter the rack (from its index), to group, to count,
+            to sort the stale devices and to report compliance
+    """
+    versions = ['18.4R2-S3', '18.4R3.3', '19.4R3-S9', '20.4R3.8']
+    rack = JRack()
+
+    def rows():
+        for number in range(size):
+            ip = str(ipaddress.ip_address(167772160 + number))
+            yield (ip, "-".join(MODELS[number % len(MODELS)].split("-")), "{0}".format(versions[number % 4]),
+                   "".join(IMAGE), "sim-{0:05d}".format(number), "{0}".format(SITES[number % len(SITES)]))
+
+    # Memory is traced only while the devices are added, tracing would slow down the timings
+    tracemalloc.start()
+    start = time.time()
+    rack.new_devices(rows())
+    load = time.time() - start
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    def best(func):
+        times = []
+        for count in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return round(min(times) * 1000, 2)
+
+    return {
+        'devices': size,
+        'bytes_per_device': int(used / size) if size else 0,
+        'load_seconds': round(load, 3),
+        'scan_ms': best(lambda: rack.filter_devices(rack.devices, model=MODELS[0], curr_code=versions[0])),
+        'filter_ms': best(lambda: rack.filter_devices(model=MODELS[0], curr_code=versions[0])),
+        'group_ms': best(lambda: rack.group_by('model', 'curr_code')),
+        'count_ms': best(lambda: rack.count_by('model', 'curr_code')),
+        'stale_ms': best(lambda: rack.stale_devices(0)),
+        'compliance_ms': best(lambda: fleet_compliance(rack))
+    }
+
+
+def compare(results, baseline, tolerance, min_seconds=0.5):
+    # Returns a message for every operation that is slower, or uses more memory, than the baseline allows. Timings
+    # of operations that took less than min_seconds in the baseline are too noisy to compare.
+    regressions = []
+    for size, operations in results.items():
+        for operation, result in operations.items():
+            base = baseline.get(size, {}).get(operation)
+            if base is None:
+                continue
+            timed = base['seconds'] >= min_seconds
+            if timed and result['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append("{0} x{1}: throughput {2} devices/s, baseline {3}".format(
+                    operation, size, result['throughput'], base['throughput']))
+            if timed and result['p95'] > base['p95'] * (1 + tolerance):
+                regressions.append("{0} x{1}: p95 {2} ms, baseline {3}".format(operation, size, result['p95'],
+                                                                              base['p95']))
+            if result['peak_mb'] > base['peak_mb'] * (1 + tolerance) + 1:
+                regressions.append("{0} x{1}: peak memory {2} MB, baseline {3}".format(
+                    operation, size, result['peak_mb'], base['peak_mb']))
+    return regressions
+
+
+def main(argv):
+    sizes = [10, 100, 1000]
+    workers = 10
+    operations = OPERATIONS
+    fleet_options = {}
+    save_file = None
+    baseline_file = None
+    tolerance = 0.25
+    rack = False
+    try:
+        opts, args = getopt.getopt(argv, "hs:w:o:", ["latency=", "failure-rate=", "install-time=", "reboot-time=",
+                                                      "output-size=", "save=", "baseline=", "tolerance=",
+                                                      "bandwidth=", "site-bandwidth=", "sftp", "rack"])
+        for opt, arg in opts:
+            if opt == '-h':
+                print(usage)
+                return 0
+            elif opt == '-s':
+                sizes = [int(size) for size in arg.split(',')]
+            elif opt == '-w':
+                workers = max(1, int(arg))
+            elif opt == '-o':
+                operations = [operation for operation in OPERATIONS if operation in arg.split(',')]
+            elif opt == '--latency':
+                fleet_options['latency'] = float(arg)
+            elif opt == '--failure-rate':
+                fleet_options['failure_rate'] = float(arg)
+            elif opt == '--install-time':
+                fleet_options['install_time'] = float(arg)
+            elif opt == '--reboot-time':
+                fleet_options['reboot_time'] = float(arg)
+            elif opt == '--output-size':
+                fleet_options['output_size'] = int(arg)
+            elif opt == '--save':
+                save_file = arg
+            elif opt == '--baseline':
+                baseline_file = arg
+            elif opt == '--tolerance':
+                tolerance = float(arg)
+            elif opt == '--sftp':
+                Menu.sftp = True
+            elif opt == '--rack':
+                rack = True
+            elif opt == '--bandwidth':
+                Menu.bandwidth = float(arg)
+            elif opt == '--site-bandwidth':
+                Menu.site_bandwidth = jtransfer.parse_site_rates(arg)
+    except (getopt.GetoptError, ValueError) as err:
+        print("{0}\n{1}".format(err, usage))
+        return 2
+
+    if rack:
+        t = PrettyTable(['Devices', 'Bytes/device', 'Add (s)', 'Scan (ms)', 'Filter (ms)', 'Group (ms)',
+                         'Count (ms)', 'Stale (ms)', 'Compliance (ms)'])
+        for size in sizes:
+            result = bench_rack(size)
+            t.add_row([size, result['bytes_per_device'], result['load_seconds'], result['scan_ms'],
+                       result['filter_ms'], result['group_ms'], result['count_ms'], result['stale_ms'],
+                       result['compliance_ms']])
+        print(t)
+        return 0
+
+    # The menu expects its lists, images and logs directories, so run in a scratch directory
+    home = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="jbench_")
+    for name in ('lists', 'images', 'logs', 'configs'):
+        os.mkdir(os.path.join(workdir, name))
+    with open(os.path.join(workdir, 'images', IMAGE), 'wb') as image:
+        image.write(hashlib.sha256(b'jbench').digest() * 32768)
+
+    results = {}
+    tracemalloc.start()
+    try:
+        os.chdir(workdir)
+        for size in sizes:
+            print("Benchmarking {0} devices...".format(size))
+            results[str(size)] = bench_size(size, operations, workers, fleet_options)
+    finally:
+        tracemalloc.stop()
+        os.chdir(home)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    t = PrettyTable(['Devices', 'Operation', 'Calls', 'Failed', 'Seconds', 'Devices/s', 'p50 (ms)', 'p95 (ms)',
+                     'p99 (ms)', 'Peak (MB)'])
+    for size, operations in results.items():
+        for operation, result in operations.items():
+            t.add_row([size, operation, result['devices'], result['failed'], result['seconds'], result['throughput'],
+                       result['p50'], result['p95'], result['p99'], result['peak_mb']])
+    print(t)
+
+    settings = dict(fleet_options, workers=workers)
+    if Menu.sftp or Menu.bandwidth or Menu.site_bandwidth:
+        settings['sftp'] = True
+        settings['bandwidth'] = Menu.bandwidth
+        settings['site_bandwidth'] = Menu.site_bandwidth
+    if save_file:
+        with open(save_file, 'w') as outfile:
+            json.dump({'settings': settings, 'results': results}, outfile, indent=1, sort_keys=True)
+        print("Results saved to {0}".format(save_file))
+    if baseline_file:
+        with open(baseline_file) as infile:
+            baseline = json.load(infile)
+        if baseline.get('settings') != settings:
+            print("Warning: baseline was recorded with different settings {0}".format(baseline.get('settings')))
+        regressions = compare(results, baseline['results'], tolerance)
+        for regression in regressions:
+            print("REGRESSION: {0}".format(regression))
+        if regressions:
+            return 1
+        print("No regressions against {0}".format(baseline_file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,88 @@
+# Author: Tyler Jordan
+# File: jcompliance.py
+# Last Modified: 10/18/2026
+# Description: Fleet compliance report, the running version of each device against the version of its target image.
+
+import json
+import datetime
+
+from functools import lru_cache
+from jhistory import export_csv
+from jversion import version_key, image_version
+
+# Columns of the report, one row per model and running version
+COMPLIANCE_KEYS = ['Model', 'Version', 'Devices', 'Compliant', 'Behind', 'Ahead', 'Unknown', 'Targets']
+STATES = ['Compliant', 'Behind', 'Ahead', 'Unknown']
+
+
+@lru_cache(maxsize=4096)
+def compliance(curr_code, tar_code):
+    """ Purpose: Compare a running version with the version in a target image name, ie. 18.4R2-S3 against
+                 jinstall-ex-4300-18.4R3.3-signed.tgz is Behind. A version that is the start of the other (18.4R3
+                 and 18.4R3.3) is Compliant. Results are cached, a rack has few distinct pairs.
+        Returns:
+            'Compliant', 'Behind', 'Ahead', or 'Unknown' when there is no target or a version cannot be read
+    """
+    current = version_key(curr_code)
+    target = version_key(image_version(tar_code))
+    if current is None or target is None:
+        return 'Unknown'
+    length = min(len(current), len(target))
+    if current[:length] == target[:length]:
+        return 'Compliant'
+    return 'Behind' if current < target else 'Ahead'
+
+
+def fleet_compliance(rack, devices=None):
+    """ Purpose: Group devices by model and running version and count how many are compliant with, behind or ahead
+                 of their target image. Devices are counted by (model, version, target) first, so each distinct
+                 combination is compared once however many devices share it.
+        Parameters:
+            rack        -   The JRack
+            devices     -   Devices to report on, the whole rack when None
+        Returns:
+            Dictionary with the number of 'Devices', the 'Totals' of each state and the 'Groups' rows (see
+            COMPLIANCE_KEYS) sorted by model and version
+    """
+    groups = {}
+    totals = dict.fromkeys(STATES, 0)
+    devices_counted = 0
+    for (model, curr_code, tar_code), count in rack.count_by('model', 'curr_code', 'tar_code',
+                                                            devices=devices).items():
+        state = compliance(curr_code, tar_code)
+        group = groups.get((model, curr_code))
+        if group is None:
+            group = dict.fromkeys(STATES, 0)
+            group.update({'Model': model, 'Version': curr_code, 'Devices': 0, 'Targets': set()})
+            groups[(model, curr_code)] = group
+        group['Devices'] += count
+        group[state] += count
+        totals[state] += count
+        devices_counted += count
+        target = image_version(tar_code)
+        if target:
+            group['Targets'].add(target)
+
+    rows = []
+    for model, curr_code in sorted(groups, key=group_order):
+        group = groups[(model, curr_code)]
+        group['Targets'] = " ".join(sorted(group['Targets'], key=version_key))
+        rows.append(group)
+    return {'Devices': devices_counted, 'Totals': totals, 'Groups': rows}
+
+
+def group_order(group):
+    # Sort by model then version, versions that cannot be read (ie. EMPTY) last
+    model, curr_code = group
+    key = version_key(curr_code)
+    return str(model), key is None, key or (), str(curr_code)
+
+
+def export_compliance(report, base_file):
+    # Write the report to base_file.csv (the groups) and base_file.json (all of it), returns both paths
+    csv_file = base_file + ".csv"
+    json_file = base_file + ".json"
+    export_csv(report['Groups'], csv_file, COMPLIANCE_KEYS)
+    with open(json_file, 'w') as outfile:
+        json.dump(dict(report, Generated=datetime.datetime.now().isoformat()), outfile, indent=1, sort_keys=True)
+    return csv_file, json_file
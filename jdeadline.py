@@ -0,0 +1,66 @@
+# Author: Tyler Jordan
+# File: jdeadline.py
+# Last Modified: 10/18/2026
+# Description: Time budget of a device operation, checked by the worker doing it and the thread waiting on it.
+
+import time
+import threading
+
+from contextlib import contextmanager
+
+
+class Deadline:
+    """ Purpose: The time one device may take, ie. for an upgrade. The clock starts when the worker starts on the
+                 device, so devices waiting for a free worker do not use their time, and time spent waiting for the
+                 operator (see paused()) is not counted. Once the time is used up, or the device is cancelled,
+                 expired() is True and the worker stops before its next step.
+        Parameters:
+            seconds     -   The budget
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.started = None
+        self.paused_at = None
+        self.paused_seconds = 0.0
+        self.cancelled = threading.Event()
+
+    def start(self):
+        # Start the clock, only the first call counts
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic()
+
+    def elapsed(self):
+        # Seconds counted against the budget so far
+        with self.lock:
+            if self.started is None:
+                return 0.0
+            now = self.paused_at if self.paused_at is not None else time.monotonic()
+            return now - self.started - self.paused_seconds
+
+    def remaining(self):
+        # Seconds left, 0 once the budget is used up or the device is cancelled
+        if self.cancelled.is_set():
+            return 0.0
+        return max(0.0, self.seconds - self.elapsed())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cancel(self):
+        # Stop the worker at its next check, whatever time it has left
+        self.cancelled.set()
+
+    @contextmanager
+    def paused(self):
+        # Stop the clock while waiting for the operator, ie. for the answer to a reboot question
+        with self.lock:
+            self.paused_at = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.paused_seconds += time.monotonic() - self.paused_at
+                self.paused_at = None
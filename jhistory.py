@@ -0,0 +1,236 @@
+# Author: Tyler Jordan
+# File: jhistory.py
+# Last Modified: 10/18/2026
+# Description: History of the upgrade and reboot results of every run.
+
+import os
+import csv
+import json
+import time
+import uuid
+import sqlite3
+import datetime
+import threading
+
+# Columns of the CSV export, the same for upgrade and reboot runs
+STATUS_KEYS = ['Run_ID', 'Operation', 'Date', 'Upgrade_List', 'Upgrade_Start', 'Upgrade_Finish', 'IP', 'Connected',
+               'OS_installed', 'Rebooted', 'IST_Confirm_Loaded', 'IST_Confirm_Rebooted', 'Comments', 'Down_Time',
+               'Up_Time', 'Post_Version']
+
+
+class RunHistory:
+    """ Purpose: Keeps the result of every device in every run. Results are appended to a JSON lines file that is
+                 never rewritten, and a SQLite index of that file (by IP, run ID and date) answers queries without
+                 reading the whole history. Appends are written in batches with one fsync per batch. The index can
+                 always be rebuilt from the file, so it is brought up to date when the history is opened.
+        Parameters:
+            history_dir     -   Directory for history.jsonl and its index, history.db
+            batch_size      -   Results buffered by add() before they are written
+            flush_interval  -   Seconds after which buffered results are written anyway
+    """
+    log_name = "history.jsonl"
+    index_name = "history.db"
+
+    def __init__(self, history_dir, batch_size=500, flush_interval=2.0):
+        if not os.path.exists(history_dir):
+            os.makedirs(history_dir)
+        self.log_file = os.path.join(history_dir, RunHistory.log_name)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.time()
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(history_dir, RunHistory.index_name), check_same_thread=False)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS records (
+                                   seq INTEGER PRIMARY KEY,
+                                   ip TEXT,
+                                   run_id TEXT,
+                                   operation TEXT,
+                                   date TEXT,
+                                   offset INTEGER,
+                                   length INTEGER)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS records_ip ON records (ip)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS records_run_id ON records (run_id)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS records_date ON records (date)")
+            # Most recent result of each device for each operation
+            self.db.execute("""CREATE TABLE IF NOT EXISTS latest (
+                                   ip TEXT,
+                                   operation TEXT,
+                                   seq INTEGER,
+                                   PRIMARY KEY (ip, operation))""")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.log = open(self.log_file, 'ab')
+        self.size = self.repair()
+        self.catch_up()
+
+    def repair(self):
+        # Cut off a half written last line (ie. after a crash) so the next append starts on a new line
+        size = os.path.getsize(self.log_file)
+        if size == 0:
+            return 0
+        with open(self.log_file, 'rb') as infile:
+            infile.seek(size - 1)
+            if infile.read(1) == b'\n':
+                return size
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                infile.seek(start)
+                block = infile.read(end - start)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+        with open(self.log_file, 'r+b') as outfile:
+            outfile.truncate(end)
+        return end
+
+    def catch_up(self):
+        # Index whatever was written to the file after the index was last updated
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'indexed_size'").fetchone()
+        indexed = row[0] if row else 0
+        if indexed > self.size:
+            # The file is not the one that was indexed, start over
+            with self.db:
+                self.db.execute("DELETE FROM records")
+                self.db.execute("DELETE FROM latest")
+            indexed = 0
+        if indexed == self.size:
+            return
+        entries = []
+        with open(self.log_file, 'rb') as infile:
+            infile.seek(indexed)
+            offset = indexed
+            for line in infile:
+                try:
+                    entries.append((json.loads(line.decode('utf-8')), offset, len(line)))
+                except ValueError:
+                    pass
+                offset += len(line)
+        self.index(entries)
+
+    def index(self, entries):
+        # Add (record, offset, length) entries to the index in one transaction
+        with self.db:
+            for record, offset, length in entries:
+                cursor = self.db.execute("INSERT INTO records (ip, run_id, operation, date, offset, length) "
+                                         "VALUES (?, ?, ?, ?, ?, ?)", (record.get('IP'), record.get('Run_ID'),
+                                                                       record.get('Operation'), record.get('Date'),
+                                                                       offset, length))
+                self.db.execute("INSERT OR REPLACE INTO latest (ip, operation, seq) VALUES (?, ?, ?)",
+                                (record.get('IP'), record.get('Operation'), cursor.lastrowid))
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('indexed_size', ?)", (self.size,))
+
+    def new_run_id(self, operation):
+        # Unique, sortable ID for a run, ie. 20261018-143000-upgrade-3fa2
+        return "{0}-{1}-{2}".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S"), operation,
+                                    uuid.uuid4().hex[:4])
+
+    def add(self, run_id, operation, statusDict):
+        # Buffer one device result, written when the batch is full or the flush interval has passed
+        record = dict(statusDict)
+        record['Run_ID'] = run_id
+        record['Operation'] = operation
+        record['Date'] = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            self.pending.append(record)
+            if len(self.pending) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def record_run(self, run_id, operation, statusList):
+        # Save every result of a run, durable when this returns
+        with self.lock:
+            for statusDict in statusList:
+                self.add(run_id, operation, statusDict)
+            self.flush()
+
+    def flush(self):
+        # Write the buffered results with a single fsync, then index them
+        with self.lock:
+            self.last_flush = time.time()
+            if not self.pending:
+                return
+            entries = []
+            data = []
+            offset = self.size
+            for record in self.pending:
+                line = (json.dumps(record, sort_keys=True) + "\n").encode('utf-8')
+                entries.append((record, offset, len(line)))
+                data.append(line)
+                offset += len(line)
+            self.log.write(b"".join(data))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.size = offset
+            self.pending = []
+            self.index(entries)
+
+    def read(self, locations):
+        # Read the records at these (offset, length) locations of the file, in file order
+        records = []
+        with open(self.log_file, 'rb') as infile:
+            for offset, length in sorted(locations):
+                infile.seek(offset)
+                records.append(json.loads(infile.read(length).decode('utf-8')))
+        return records
+
+    def last_outcomes(self, ips, operation):
+        """ Purpose: The most recent result of each of these devices for an operation.
+            Parameters:
+                ips         -   IPs of the devices
+                operation   -   'upgrade' or 'reboot'
+            Returns:
+                Dictionary of IP to the result record, devices without a result are left out
+        """
+        with self.lock:
+            self.flush()
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS query_ips (ip TEXT PRIMARY KEY)")
+            self.db.execute("DELETE FROM query_ips")
+            self.db.executemany("INSERT OR IGNORE INTO query_ips (ip) VALUES (?)", [(ip,) for ip in ips])
+            locations = self.db.execute("SELECT records.offset, records.length FROM query_ips "
+                                        "JOIN latest ON latest.ip = query_ips.ip AND latest.operation = ? "
+                                        "JOIN records ON records.seq = latest.seq", (operation,)).fetchall()
+            self.db.execute("DELETE FROM query_ips")
+        return dict((record['IP'], record) for record in self.read(locations))
+
+    def run_records(self, run_id):
+        # Every result of one run
+        with self.lock:
+            self.flush()
+            locations = self.db.execute("SELECT offset, length FROM records WHERE run_id = ?", (run_id,)).fetchall()
+        return self.read(locations)
+
+    def device_records(self, ip, since=None):
+        # Every result of one device, oldest first, optionally only those on or after an ISO date
+        with self.lock:
+            self.flush()
+            if since:
+                cursor = self.db.execute("SELECT offset, length FROM records WHERE ip = ? AND date >= ?", (ip, since))
+            else:
+                cursor = self.db.execute("SELECT offset, length FROM records WHERE ip = ?", (ip,))
+            locations = cursor.fetchall()
+        return self.read(locations)
+
+    def runs(self, limit=20):
+        # The most recent runs as (run_id, operation, date, devices), newest first
+        with self.lock:
+            self.flush()
+            return self.db.execute("SELECT run_id, operation, MIN(date), COUNT(*) FROM records GROUP BY run_id "
+                                   "ORDER BY MIN(date) DESC, run_id DESC LIMIT ?", (limit,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.log.close()
+            self.db.close()
+
+
+def export_csv(records, csv_file, keys=STATUS_KEYS):
+    # Write result records to a new CSV file, ie. for the IST confirmation workflow
+    with open(csv_file, 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=keys, restval='', extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
@@ -0,0 +1,118 @@
+# Author: Tyler Jordan
+# File: jimage.py
+# Last Modified: 10/18/2026
+# Description: Helpers for the software images kept in the images directory.
+
+import os
+import json
+import hashlib
+import threading
+
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+
+class ChecksumCache:
+    """ Purpose: Remembers the checksums of the images so a multi-gigabyte file is only hashed once. Entries are
+                 keyed by file path and are thrown away when the file size or modification time changes. The
+                 cache is saved as JSON next to the images.
+    """
+    cache_name = ".checksums.json"
+    block_size = 1024 * 1024
+
+    def __init__(self, image_dir):
+        self.cache_file = os.path.join(image_dir, ChecksumCache.cache_name)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.file_locks = {}
+        self.load()
+
+    def load(self):
+        # Read the cache from disk, a missing or unreadable cache is just empty
+        try:
+            with open(self.cache_file, 'r') as infile:
+                self.entries = json.load(infile)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a half written cache
+        tmp_file = self.cache_file + ".tmp"
+        try:
+            with open(tmp_file, 'w') as outfile:
+                json.dump(self.entries, outfile, indent=1, sort_keys=True)
+            os.replace(tmp_file, self.cache_file)
+        except (IOError, OSError) as err:
+            print("Unable to save checksum cache {0} ERROR: {1}".format(self.cache_file, err))
+
+    def get(self, path, algorithm='md5'):
+        """ Purpose: Returns the checksum of a local file, from the cache when the file has not changed.
+            Parameters:
+                path        -   Path of the local file
+                algorithm   -   'md5', 'sha1' or 'sha256'
+        """
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise ValueError("Unknown checksum algorithm: {0}".format(algorithm))
+        return self.cached(path, algorithm, lambda: {algorithm: self.hash_file(path, algorithm)})
+
+    def blocks(self, path, block_size, algorithm='md5'):
+        """ Purpose: Returns the checksums of each block_size block of a local file, so a copy can be checked and
+                     repaired one block at a time. The checksum of the whole file is cached from the same pass.
+            Parameters:
+                path        -   Path of the local file
+                block_size  -   Bytes per block
+                algorithm   -   'md5', 'sha1' or 'sha256'
+        """
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise ValueError("Unknown checksum algorithm: {0}".format(algorithm))
+        return self.cached(path, "{0}/{1}".format(algorithm, block_size),
+                           lambda: self.hash_blocks(path, block_size, algorithm))
+
+    def cached(self, path, name, compute):
+        # Returns the "name" value of a file, computed when the cache does not have it for the current file.
+        # "compute" returns a dictionary of the values to cache, which must include "name".
+        key = os.path.abspath(path)
+        with self.lock:
+            file_lock = self.file_locks.setdefault(key, threading.Lock())
+
+        # Hold the lock for this file while hashing so two workers never hash the same image
+        with file_lock:
+            stat = os.stat(path)
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+                    entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+                    self.entries[key] = entry
+                elif name in entry:
+                    return entry[name]
+
+            values = compute()
+            with self.lock:
+                entry.update(values)
+                self.save()
+            return values[name]
+
+    def invalidate(self, path):
+        # Forget everything known about a file
+        with self.lock:
+            if self.entries.pop(os.path.abspath(path), None) is not None:
+                self.save()
+
+    @classmethod
+    def hash_file(cls, path, algorithm):
+        # Read the file in blocks so memory use does not depend on the image size
+        hasher = hashlib.new(algorithm)
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(cls.block_size), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    @classmethod
+    def hash_blocks(cls, path, block_size, algorithm):
+        # One pass for the checksum of every block and of the whole file
+        hasher = hashlib.new(algorithm)
+        blocks = []
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(block_size), b''):
+                hasher.update(block)
+                blocks.append(hashlib.new(algorithm, block).hexdigest())
+        return {algorithm: hasher.hexdigest(), "{0}/{1}".format(algorithm, block_size): blocks}
@@ -0,0 +1,147 @@
+# Author: Tyler Jordan
+# File: jinventory.py
+# Last Modified: 10/18/2026
+# Description: Streaming reader for device lists (CSV or JSON lines), checking every row as it is read.
+
+import os
+import csv
+import json
+import ipaddress
+
+# Accepted names of each column, CSV headers and JSON keys are matched without regard to case
+COLUMNS = {
+    'ip': ('ip_addr', 'ip', 'address'),
+    'tar_code': ('upgrade_img', 'tar_code', 'image'),
+    'site': ('site',),
+    'model': ('model',)
+}
+
+
+class InventoryReader:
+    """ Purpose: Reads a device list one row at a time, so a list of any size is read in bounded memory. IPs are
+                 normalized (ie. leading or trailing spaces, IPv6 written differently) and rows with an IP seen
+                 before are skipped. Rows without a valid IP, or that cannot be parsed, are counted and written with
+                 their line number to the reject file; the first ones are also kept for display. Iterating gives a
+                 dictionary with the ip, tar_code, site, model and line of each good row.
+        Parameters:
+            list_file       -   CSV file with a header row, or JSON lines when the name ends in .jsonl or .json
+            reject_file     -   Optional CSV file every bad row is written to, with its line number and reason
+            max_errors      -   Number of bad rows kept in "errors" for display
+    """
+
+    def __init__(self, list_file, reject_file=None, max_errors=20):
+        self.list_file = list_file
+        self.reject_file = reject_file
+        self.max_errors = max_errors
+        self.seen = set()
+        self.rows = 0
+        self.duplicates = 0
+        self.bad = 0
+        self.errors = []
+        self.rejects = None
+
+    def __iter__(self):
+        try:
+            if self.list_file.lower().endswith(('.jsonl', '.json')):
+                rows = self.read_jsonl()
+            else:
+                rows = self.read_csv()
+            for line, fields, problem in rows:
+                self.rows += 1
+                if problem:
+                    self.reject(line, problem, fields)
+                    continue
+                target = self.target(line, fields)
+                if target is not None:
+                    yield target
+        finally:
+            if self.rejects is not None:
+                self.rejects[0].close()
+                self.rejects = None
+
+    def read_csv(self):
+        # (line, fields, problem) of each row, the header names are mapped to the COLUMNS
+        with open(self.list_file, 'r', newline='') as infile:
+            reader = csv.reader(infile)
+            header = next(reader, None)
+            if header is None:
+                return
+            names = [column_name(name) for name in header]
+            if 'ip' not in names:
+                raise ValueError("{0} has no IP column (ie. IP_ADDR)".format(self.list_file))
+            for values in reader:
+                if not any(value.strip() for value in values):
+                    continue
+                fields = dict((name, value) for name, value in zip(names, values) if name)
+                problem = ''
+                if len(values) > len(header):
+                    problem = "{0} fields, the header has {1}".format(len(values), len(header))
+                yield reader.line_num, fields, problem
+
+    def read_jsonl(self):
+        # (line, fields, problem) of each line, the keys are mapped to the COLUMNS
+        with open(self.list_file, 'r') as infile:
+            for line, text in enumerate(infile, 1):
+                if not text.strip():
+                    continue
+                try:
+                    entry = json.loads(text)
+                except ValueError as err:
+                    yield line, {'raw': text.strip()}, "Not valid JSON: {0}".format(err)
+                    continue
+                if not isinstance(entry, dict):
+                    yield line, {'raw': text.strip()}, "Not a JSON object"
+                    continue
+                fields = {}
+                for key, value in entry.items():
+                    name = column_name(key)
+                    if name and value is not None:
+                        fields[name] = str(value)
+                yield line, fields, ''
+
+    def target(self, line, fields):
+        # The discovery target of a parsed row, None when the row is rejected or a duplicate
+        value = (fields.get('ip') or '').strip()
+        if not value:
+            self.reject(line, "No IP", fields)
+            return None
+        try:
+            ip = str(ipaddress.ip_address(value))
+        except ValueError:
+            self.reject(line, "Invalid IP: {0}".format(value), fields)
+            return None
+        if ip in self.seen:
+            self.duplicates += 1
+            return None
+        self.seen.add(ip)
+        return {'ip': ip, 'tar_code': (fields.get('tar_code') or '').strip() or None,
+                'site': (fields.get('site') or '').strip(), 'model': (fields.get('model') or '').strip() or None,
+                'line': line}
+
+    def reject(self, line, reason, fields):
+        # Count a bad row, keep the first few and write every one to the reject file
+        self.bad += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, reason))
+        if self.reject_file is None:
+            return
+        if self.rejects is None:
+            outfile = open(self.reject_file, 'w', newline='')
+            writer = csv.writer(outfile)
+            writer.writerow(['LINE', 'REASON', 'ROW'])
+            self.rejects = (outfile, writer)
+        self.rejects[1].writerow([line, reason, json.dumps(fields, sort_keys=True)])
+
+
+def column_name(name):
+    # The COLUMNS key a header or JSON key stands for, None for columns that are not used
+    name = (name or '').strip().lower()
+    for column, names in COLUMNS.items():
+        if name in names:
+            return column
+    return None
+
+
+def reject_file_for(list_file, log_dir):
+    # Where the bad rows of a list are written, ie. logs/upgrade_rejects.csv for lists/upgrade.csv
+    return os.path.join(log_dir, os.path.splitext(os.path.basename(list_file))[0] + "_rejects.csv")
@@ -0,0 +1,134 @@
+# Author: Tyler Jordan
+# File: jjournal.py
+# Last Modified: 10/18/2026
+# Description: Journal of the progress of each device during a bulk upgrade, so an interrupted upgrade can resume.
+
+import os
+import json
+import time
+import datetime
+import threading
+
+# Device states in the order an upgrade goes through them
+STATES = ['pending', 'staged', 'installed', 'rebooted', 'verified']
+FAILED = 'failed'
+
+
+class UpgradeJournal:
+    """ Purpose: Records each device's state (pending, staged, installed, rebooted, verified or failed) as soon as
+                 it changes. Each change is appended as a JSON line and fsync'd before the upgrade moves on, so after
+                 a crash the journal shows exactly how far every device got. A run that finishes is marked done.
+                 States belong to a device and its target image, a device given another image starts over.
+        Parameters:
+            journal_file    -   Path of the journal
+            resume          -   Continue the journal already in journal_file instead of starting a new one. A new
+                                journal moves the old file aside.
+    """
+    file_name = "upgrade.journal"
+
+    def __init__(self, journal_file, resume=False):
+        self.journal_file = journal_file
+        self.devices = {}
+        self.finished = False
+        self.lock = threading.Lock()
+        if resume:
+            self.devices, self.finished = read_journal(journal_file)
+        elif os.path.exists(journal_file):
+            os.replace(journal_file, journal_file + "." + datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+        self.outfile = open(journal_file, 'a')
+        if self.outfile.tell() > 0:
+            # Start on a new line in case the last entry was cut off
+            with open(journal_file, 'rb') as infile:
+                infile.seek(-1, os.SEEK_END)
+                if infile.read(1) != b"\n":
+                    self.outfile.write("\n")
+
+    @classmethod
+    def unfinished(cls, journal_file):
+        # Number of devices left to do in a journal that was not finished, 0 if there is nothing to resume
+        devices, finished = read_journal(journal_file)
+        if finished:
+            return 0
+        return len([entry for entry in devices.values() if entry['state'] not in ('verified', FAILED)])
+
+    def write(self, entry):
+        # Append one entry and make sure it is on disk before returning
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        with self.lock:
+            self.outfile.write(line)
+            self.outfile.flush()
+            os.fsync(self.outfile.fileno())
+
+    def record(self, ip, state, tar_code=None, status=None, comment=''):
+        """ Purpose: Save a device's new state.
+            Parameters:
+                ip          -   IP of the device
+                state       -   One of STATES or 'failed'
+                tar_code    -   Target image, kept from the previous entry when None
+                status      -   Status dictionary of the device, used to report devices skipped on resume
+                comment     -   Why the device failed or anything else worth keeping
+        """
+        with self.lock:
+            previous = self.devices.get(ip, {})
+            entry = {'ip': ip, 'state': state, 'time': time.time(),
+                     'tar_code': tar_code if tar_code is not None else previous.get('tar_code'),
+                     'status': status if status is not None else previous.get('status'), 'comment': comment}
+            self.devices[ip] = entry
+        self.write(entry)
+
+    def start(self, devices):
+        # Add the devices that are not in the journal yet as pending. A device journaled with another target image
+        # starts over, what was done with the other image says nothing about this one.
+        for device in devices:
+            if self.entry(device.ip, device.tar_code) is None:
+                with self.lock:
+                    self.devices.pop(device.ip, None)
+                self.record(device.ip, 'pending', device.tar_code)
+
+    def entry(self, ip, tar_code=None):
+        # The last entry of a device, None if it is not in the journal or was for another image than tar_code
+        entry = self.devices.get(ip)
+        if entry is None or (tar_code is not None and entry.get('tar_code') != tar_code):
+            return None
+        return entry
+
+    def state(self, ip, tar_code=None):
+        # The state of a device (with tar_code, for that image), 'pending' if it is not in the journal
+        entry = self.entry(ip, tar_code)
+        return entry['state'] if entry else 'pending'
+
+    def status(self, ip, tar_code=None):
+        # The status dictionary saved with the device's last state (with tar_code, for that image), or None
+        entry = self.entry(ip, tar_code)
+        return dict(entry['status']) if entry and entry.get('status') else None
+
+    def finish(self):
+        # Mark the journal done, there is nothing left to resume
+        self.write({'finished': True, 'time': time.time()})
+        self.finished = True
+
+    def close(self):
+        with self.lock:
+            self.outfile.close()
+
+
+def read_journal(journal_file):
+    # Replay a journal, returns the last entry of each device and whether the run was finished. A half written
+    # last line (ie. after a crash) is ignored.
+    devices = {}
+    finished = False
+    try:
+        with open(journal_file, 'r') as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('finished'):
+                    finished = True
+                elif 'ip' in entry:
+                    devices[entry['ip']] = entry
+                    finished = False
+    except (IOError, OSError):
+        pass
+    return devices, finished
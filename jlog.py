@@ -0,0 +1,154 @@
+# Author: Tyler Jordan
+# File: jlog.py
+# Last Modified: 10/18/2026
+# Description: Logging for many devices at once. Workers only put records on a queue, a single background
+#              thread formats them and writes the log files.
+
+import os
+import json
+import queue
+import logging
+import logging.handlers
+
+from collections import OrderedDict
+
+# Every jscan log record goes through this logger
+logger = logging.getLogger('jscan')
+logger.addHandler(logging.NullHandler())
+
+listener = None
+
+
+class DeviceAdapter(logging.LoggerAdapter):
+    # Adds the device (and the operation running on it) to every record logged through it
+
+    def process(self, msg, kwargs):
+        extra = dict(self.extra)
+        extra.update(kwargs.get('extra') or {})
+        kwargs['extra'] = extra
+        return msg, kwargs
+
+
+def device_logger(ip, hostname=None, operation=None):
+    """ Purpose: Returns a logger for one device. Each worker should use its own, so log lines are always
+                 attributed to the right device no matter how many workers are running.
+        Parameters:
+            ip          -   IP of the device
+            hostname    -   Host-name of the device, if known
+            operation   -   What is being done to the device (ie. 'upgrade' or 'reboot')
+    """
+    return DeviceAdapter(logger, {'device': ip, 'hostname': hostname or '', 'operation': operation or ''})
+
+
+class TextFormatter(logging.Formatter):
+    # Same layout as the old install and reboot logs, "time:device: message"
+
+    def __init__(self):
+        logging.Formatter.__init__(self, '%(asctime)s:%(device)s: %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'device'):
+            # Work on a copy, the same record is passed to the other handlers
+            record = logging.makeLogRecord(record.__dict__)
+            record.device = record.name
+        return logging.Formatter.format(self, record)
+
+
+class JSONFormatter(logging.Formatter):
+    # One JSON object per line, for loading the logs into other tools
+
+    def format(self, record):
+        entry = OrderedDict()
+        entry['time'] = self.formatTime(record, '%Y-%m-%dT%H:%M:%S')
+        entry['level'] = record.levelname
+        entry['device'] = getattr(record, 'device', None)
+        entry['hostname'] = getattr(record, 'hostname', None)
+        entry['operation'] = getattr(record, 'operation', None)
+        entry['thread'] = record.threadName
+        entry['message'] = record.getMessage()
+        return json.dumps(entry)
+
+
+class DeviceFileHandler(logging.Handler):
+    """ Purpose: Writes each device's records to its own file, <log_dir>/<ip>.log. Only the writer thread uses
+                 it, files are kept open and the least recently used is closed when more than max_open are open.
+    """
+
+    def __init__(self, log_dir, max_open=128):
+        logging.Handler.__init__(self)
+        self.log_dir = log_dir
+        self.max_open = max_open
+        self.files = OrderedDict()
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+    def emit(self, record):
+        device = getattr(record, 'device', None)
+        if not device:
+            return
+        try:
+            stream = self.files.pop(device, None)
+            if stream is None:
+                stream = open(os.path.join(self.log_dir, device + '.log'), 'a')
+                if len(self.files) >= self.max_open:
+                    self.files.popitem(last=False)[1].close()
+            self.files[device] = stream
+            stream.write(self.format(record) + '\n')
+            stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for stream in self.files.values():
+            stream.close()
+        self.files.clear()
+        logging.Handler.close(self)
+
+
+def start_logging(log_file, json_file=None, device_dir=None, level=logging.INFO):
+    """ Purpose: Start the writer thread. Records logged to the 'jscan' logger are queued and written to the
+                 log file, and optionally to a JSON lines file and to a file per device.
+        Parameters:
+            log_file    -   Text log of every device
+            json_file   -   Optional JSON lines log of every device
+            device_dir  -   Optional directory for a log file per device
+            level       -   Lowest level written
+    """
+    global listener
+    stop_logging()
+    handlers = []
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(TextFormatter())
+    handlers.append(handler)
+    if json_file:
+        handler = logging.FileHandler(json_file)
+        handler.setFormatter(JSONFormatter())
+        handlers.append(handler)
+    if device_dir:
+        handler = DeviceFileHandler(device_dir)
+        handler.setFormatter(TextFormatter())
+        handlers.append(handler)
+
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+    # Keep device records out of the root logger and the libraries' own logging
+    logger.propagate = False
+
+
+def stop_logging():
+    # Write out everything still queued and close the log files
+    global listener
+    if listener is None:
+        return
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.NullHandler())
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    listener = None
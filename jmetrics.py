@@ -0,0 +1,163 @@
+# Author: Tyler Jordan
+# File: jmetrics.py
+# Last Modified: 10/18/2026
+# Description: Timing of each phase of the device operations, exported for Prometheus and as JSON.
+
+import os
+import json
+import math
+import time
+import threading
+
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from a quick RPC to a slow install
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def nearest_rank(samples, fraction):
+    # Nearest rank quantile of a sorted list: the smallest sample with at least "fraction" of the samples at or
+    # below it, ie. the 95th of 100 samples for 0.95. The product is rounded first so 0.07 * 100 is rank 7, not 8.
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, math.ceil(round(fraction * len(samples), 9)) - 1))]
+
+
+class Phase:
+
+    def __init__(self):
+        # Durations of one phase of one operation
+        self.samples = []
+        self.failures = 0
+
+    def quantile(self, fraction):
+        # Nearest rank quantile of the recorded durations
+        return nearest_rank(sorted(self.samples), fraction)
+
+
+class Timing:
+
+    def __init__(self):
+        # Handed to the body of a timer, set ok to False when the phase failed without raising
+        self.ok = True
+        self.seconds = 0.0
+
+
+class Metrics:
+    """ Purpose: Collects how long each phase (ie. connect, copy, install, reboot) of each operation takes on each
+                 device. Timers use time.perf_counter(). At the end of a run the durations are written as Prometheus
+                 histograms for the node_exporter textfile collector and as a JSON summary.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.finished = {}
+        self.lock = threading.Lock()
+
+    def observe(self, operation, phase, seconds, ok=True):
+        # Record one duration, "ok" False counts it as a failure of the phase
+        with self.lock:
+            entry = self.phases.get((operation, phase))
+            if entry is None:
+                entry = self.phases[(operation, phase)] = Phase()
+            entry.samples.append(seconds)
+            if not ok:
+                entry.failures += 1
+
+    @contextmanager
+    def timer(self, operation, phase, times=None):
+        """ Purpose: Time the body of a "with" block as one phase. A phase that raises, or that sets ok to False on
+                     the Timing it is given, is recorded as failed.
+            Parameters:
+                operation   -   ie. 'upgrade', 'reboot', 'refresh' or 'set'
+                phase       -   ie. 'connect', 'copy', 'install'
+                times       -   Optional dictionary the duration is also saved in, by phase name
+        """
+        timing = Timing()
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield timing
+            ok = bool(timing.ok)
+        finally:
+            timing.seconds = time.perf_counter() - start
+            self.observe(operation, phase, timing.seconds, ok)
+            if times is not None:
+                times[phase] = round(times.get(phase, 0.0) + timing.seconds, 3)
+
+    def reset(self, operation):
+        # Forget the durations of an operation, called when a new run of it starts
+        with self.lock:
+            for key in [key for key in self.phases if key[0] == operation]:
+                del self.phases[key]
+
+    def summary(self, operation=None):
+        """ Purpose: Statistics of each phase.
+            Returns:
+                Dictionary of operation to phase to count, failures, total, mean, p50, p95, p99 and max seconds
+        """
+        result = {}
+        with self.lock:
+            for (name, phase), entry in sorted(self.phases.items()):
+                if operation is not None and name != operation:
+                    continue
+                count = len(entry.samples)
+                total = sum(entry.samples)
+                result.setdefault(name, {})[phase] = {
+                    'count': count,
+                    'failures': entry.failures,
+                    'total': round(total, 3),
+                    'mean': round(total / count, 3) if count else 0.0,
+                    'p50': round(entry.quantile(0.50), 3),
+                    'p95': round(entry.quantile(0.95), 3),
+                    'p99': round(entry.quantile(0.99), 3),
+                    'max': round(max(entry.samples), 3) if count else 0.0
+                }
+        return result
+
+    def prometheus(self):
+        # The metrics in the Prometheus text exposition format
+        lines = ["# HELP jscan_phase_seconds Time spent in each phase of a jscan device operation.",
+                 "# TYPE jscan_phase_seconds histogram"]
+        failures = []
+        with self.lock:
+            for (operation, phase), entry in sorted(self.phases.items()):
+                labels = 'operation="{0}",phase="{1}"'.format(operation, phase)
+                samples = sorted(entry.samples)
+                index = 0
+                for bound in BUCKETS:
+                    while index < len(samples) and samples[index] <= bound:
+                        index += 1
+                    lines.append('jscan_phase_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, bound, index))
+                lines.append('jscan_phase_seconds_bucket{{{0},le="+Inf"}} {1}'.format(labels, len(samples)))
+                lines.append('jscan_phase_seconds_sum{{{0}}} {1:.6f}'.format(labels, sum(samples)))
+                lines.append('jscan_phase_seconds_count{{{0}}} {1}'.format(labels, len(samples)))
+                failures.append('jscan_phase_failures_total{{{0}}} {1}'.format(labels, entry.failures))
+            finished = sorted(self.finished.items())
+        lines.append("# HELP jscan_phase_failures_total Phases that failed.")
+        lines.append("# TYPE jscan_phase_failures_total counter")
+        lines.extend(failures)
+        lines.append("# HELP jscan_last_run_timestamp_seconds When the last run of each operation finished.")
+        lines.append("# TYPE jscan_last_run_timestamp_seconds gauge")
+        for operation, finished_at in finished:
+            lines.append('jscan_last_run_timestamp_seconds{{operation="{0}"}} {1:.0f}'.format(operation, finished_at))
+        return "\n".join(lines) + "\n"
+
+    def export(self, operation, prom_file, json_file):
+        # Write the Prometheus textfile (every operation) and the JSON summary of this operation
+        with self.lock:
+            self.finished[operation] = time.time()
+        write_atomic(prom_file, self.prometheus())
+        write_atomic(json_file, json.dumps(self.summary(operation), indent=1, sort_keys=True))
+
+
+def write_atomic(path, text):
+    # The textfile collector may read at any time, so never let it see a half written file
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w') as outfile:
+        outfile.write(text)
+    os.replace(tmp_file, path)
+
+
+# Shared by every worker
+metrics = Metrics()
@@ -0,0 +1,202 @@
+# Author: Tyler Jordan
+# File: jpool.py
+# Last Modified: 10/18/2026
+# Description: Pool of open NETCONF sessions, so devices are not reconnected for every operation.
+
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class Session:
+
+    def __init__(self, ip):
+        # A pooled connection to one device, only one worker may use it at a time
+        self.ip = ip
+        self.dev = None
+        self.timeout = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+
+class SessionPool:
+    """ Purpose: Keeps PyEZ Device sessions open between operations, keyed by device IP. Sessions idle longer than
+                 max_idle are closed, and when more than max_sessions are open the least recently used idle session
+                 is closed. A session that has been idle for health_interval is checked with a small RPC before it
+                 is reused and is reopened if the check fails. With max_sessions=0 nothing is kept open, every
+                 release() closes the session.
+    """
+
+    def __init__(self, username, password, max_sessions=100, max_idle=300, health_interval=30, port=830):
+        self.username = username
+        self.password = password
+        self.max_sessions = max_sessions
+        self.max_idle = max_idle
+        self.health_interval = health_interval
+        self.port = port
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        # jnpr.junos.Device, loaded when the first session is opened
+        self.device_factory = None
+
+    def acquire(self, ip, blocking=True):
+        """ Purpose: Returns an open Device for this IP, reusing the pooled session when it is healthy. The caller
+                     has the session to itself until release() is called. Connection errors are raised unchanged.
+                     With blocking=False, None is returned when another worker is using the session.
+        """
+        while True:
+            with self.lock:
+                expired = self.expire()
+                session = self.sessions.get(ip)
+                if session is None:
+                    session = Session(ip)
+                    self.sessions[ip] = session
+                self.sessions.move_to_end(ip)
+            self.close_sessions(expired)
+            if not session.lock.acquire(blocking):
+                return None
+            # The session may have been evicted while waiting for it
+            with self.lock:
+                if self.sessions.get(ip) is session:
+                    break
+            session.lock.release()
+
+        try:
+            if session.dev is not None and not self.healthy(session):
+                self.close_device(session)
+            if session.dev is None:
+                if self.device_factory is None:
+                    from jnpr.junos import Device
+                    self.device_factory = Device
+                dev = self.device_factory(ip, user=self.username, password=self.password, port=self.port,
+                                          gather_facts=False)
+                dev.open()
+                session.dev = dev
+                session.timeout = dev.timeout
+                session.last_used = time.time()
+                with self.lock:
+                    evicted = self.evict()
+                self.close_sessions(evicted)
+        except Exception:
+            with self.lock:
+                if self.sessions.get(ip) is session and session.dev is None:
+                    del self.sessions[ip]
+            session.lock.release()
+            raise
+        return session.dev
+
+    def release(self, ip, discard=False):
+        # Give the session back to the pool, "discard" closes it (ie. the device is rebooting)
+        with self.lock:
+            session = self.sessions.get(ip)
+            if session is None:
+                return
+            if discard or self.max_sessions == 0:
+                del self.sessions[ip]
+        if discard or self.max_sessions == 0:
+            self.close_device(session)
+        elif session.dev is not None:
+            # Undo per-operation changes such as a longer RPC timeout
+            session.dev.timeout = session.timeout
+            session.last_used = time.time()
+        session.lock.release()
+
+    def session(self, ip, discard=False):
+        # Context manager version of acquire() and release()
+        return Lease(self, ip, discard)
+
+    def discard(self, ip):
+        # Close the session for this IP once nobody is using it
+        with self.lock:
+            session = self.sessions.get(ip)
+        if session is not None:
+            with session.lock:
+                with self.lock:
+                    if self.sessions.get(ip) is session:
+                        del self.sessions[ip]
+                self.close_device(session)
+
+    def healthy(self, session):
+        # Checks the session before it is reused
+        if not session.dev.connected:
+            return False
+        if time.time() - session.last_used < self.health_interval:
+            return True
+        try:
+            session.dev.rpc.get_system_uptime_information()
+        except Exception:
+            return False
+        return True
+
+    def expire(self):
+        # Remove the sessions that have been idle too long, called with self.lock held. Closing a session can block
+        # on a dead device, so they are returned (still locked) for close_sessions() once self.lock is released.
+        now = time.time()
+        expired = []
+        for ip, session in list(self.sessions.items()):
+            if session.dev is not None and now - session.last_used > self.max_idle and \
+                    session.lock.acquire(blocking=False):
+                del self.sessions[ip]
+                expired.append(session)
+        return expired
+
+    def evict(self):
+        # Remove the least recently used idle sessions while over the cap, called with self.lock held. They are
+        # returned (still locked) for close_sessions().
+        open_count = len([session for session in self.sessions.values() if session.dev is not None])
+        evicted = []
+        for ip, session in list(self.sessions.items()):
+            if open_count <= self.max_sessions:
+                break
+            if session.dev is not None and session.lock.acquire(blocking=False):
+                del self.sessions[ip]
+                evicted.append(session)
+                open_count -= 1
+        return evicted
+
+    def close_sessions(self, sessions):
+        # Close sessions taken out of the pool by expire(), evict() or close_all(), without holding self.lock
+        for session in sessions:
+            self.close_device(session)
+            session.lock.release()
+
+    def close_device(self, session):
+        # Close the device connection, ignoring errors from an already dead session
+        if session.dev is not None:
+            try:
+                session.dev.close()
+            except Exception:
+                pass
+            session.dev = None
+
+    def close_all(self):
+        # Close every idle session
+        idle = []
+        with self.lock:
+            for ip, session in list(self.sessions.items()):
+                if session.lock.acquire(blocking=False):
+                    del self.sessions[ip]
+                    idle.append(session)
+        self.close_sessions(idle)
+
+    def open_count(self):
+        # Number of sessions currently open
+        with self.lock:
+            return len([session for session in self.sessions.values() if session.dev is not None])
+
+
+class Lease:
+
+    def __init__(self, pool, ip, discard=False):
+        # Borrow a session for the duration of a "with" block
+        self.pool = pool
+        self.ip = ip
+        self.discard = discard
+
+    def __enter__(self):
+        return self.pool.acquire(self.ip)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.release(self.ip, discard=self.discard)
+        return False
@@ -1,46 +1,347 @@
 # Author: Tyler Jordan
 # File: jrack.py
-# Last Modified: 7/28/2016
+# Last Modified: 10/18/2026
 # Description: Classes for a Juniper device container and Juniper devices.
 
+import sys
+import time
 import datetime
+import sqlite3
+import threading
+
+from operator import attrgetter
+from collections import Counter
+
+# Value of a device attribute that has not been set yet
+UNSET = object()
 
 
 class JRack:
 
-    def __init__(self):
+    # Columns saved in the inventory database, in JDevice attribute order
+    db_columns = ['ip', 'hostname', 'model', 'curr_code', 'tar_code', 'staged_code', 'refresh', 'active', 'site']
+
+    def __init__(self, db_file=None):
         # Initialize a rack without any devices
         self.devices = []
+        # Exact match lookup of devices by IP
+        self.index = {}
+        # Devices by value of the interned attributes, see value_index()
+        self.value_indexes = {}
+        self.db = None
+        self.lock = threading.RLock()
+        if db_file:
+            self.open_db(db_file)
+
+    def open_db(self, db_file):
+        # Open (or create) the inventory database and load the devices saved in it
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS devices (
+                                   ip TEXT PRIMARY KEY,
+                                   hostname TEXT,
+                                   model TEXT,
+                                   curr_code TEXT,
+                                   tar_code TEXT,
+                                   staged_code TEXT,
+                                   refresh TEXT,
+                                   active INTEGER,
+                                   site TEXT)""")
+            # Databases created before devices had a site
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(devices)")]
+            if 'site' not in columns:
+                self.db.execute("ALTER TABLE devices ADD COLUMN site TEXT DEFAULT ''")
+            self.db.execute("CREATE INDEX IF NOT EXISTS devices_hostname ON devices (hostname)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS devices_model ON devices (model)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS devices_curr_code ON devices (curr_code)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS devices_site ON devices (site)")
+        self.load()
 
-    def new_device(self, ip, model, curr_code, tar_code, hostname):
+    def load(self):
+        # Replace the devices in memory with the ones saved in the database
+        with self.lock:
+            self.devices = []
+            self.index = {}
+            cursor = self.db.execute("SELECT " + ", ".join(JRack.db_columns) + " FROM devices")
+            for ip, hostname, model, curr_code, tar_code, staged_code, refresh, active, site in cursor:
+                device = JDevice(ip, model, curr_code, tar_code, hostname)
+                device.staged_code = staged_code
+                device.last_refresh = datetime.datetime.fromisoformat(refresh).timestamp()
+                device.active = bool(active)
+                device.site = site or ''
+                self.devices.append(device)
+                self.index[ip] = device
+            JDevice.changed()
+
+    def new_device(self, ip, model, curr_code, tar_code, hostname, site=''):
         # Add a new device to the rack
-        self.devices.append(JDevice(ip, model, curr_code, tar_code, hostname))
+        return self.new_devices([(ip, model, curr_code, tar_code, hostname, site)])[0]
 
-    def __del__(self):
-        # Removes JRack
-        pass
+    def new_devices(self, rows):
+        # Add several devices from (ip, model, curr_code, tar_code, hostname, site) rows, saved to the database in a
+        # single transaction
+        added = []
+        with self.lock:
+            for ip, model, curr_code, tar_code, hostname, site in rows:
+                device = JDevice(ip, model, curr_code, tar_code, hostname)
+                device.site = site or ''
+                if ip in self.index:
+                    self.devices.remove(self.index[ip])
+                self.devices.append(device)
+                self.index[ip] = device
+                added.append(device)
+            # After the rack has the devices, so an index built in between is built again
+            JDevice.changed()
+            self.save_devices(added)
+        return added
+
+    def get_device(self, ip):
+        # Returns the device with exactly this IP, or None
+        return self.index.get(ip)
+
+    def find_devices(self, attr, value):
+        # Returns the devices where "attr" (ip, hostname, model, curr_code or site) equals value
+        if attr not in JRack.db_columns:
+            raise ValueError("Unknown device attribute: {0}".format(attr))
+        if self.db is None:
+            return self.filter_devices(**{attr: value})
+        with self.lock:
+            cursor = self.db.execute("SELECT ip FROM devices WHERE " + attr + " = ?", (value,))
+            return [self.index[ip] for ip, in cursor if ip in self.index]
+
+    def filter_devices(self, devices=None, **criteria):
+        """ Purpose: Devices whose attributes equal all the criteria, ie. filter_devices(model='EX4300-48P',
+                     curr_code='18.4R2-S3'). When the whole rack is filtered on an interned attribute, the devices
+                     with that value are taken from its index and only they are checked against the other criteria.
+                     The rack is not locked while it is filtered.
+            Parameters:
+                devices     -   Devices to filter, the whole rack when None
+                criteria    -   Device attribute names and the value each one must have
+            Returns:
+                List of the matching devices, in rack order
+        """
+        if devices is None:
+            devices = self.devices
+            indexed = [attr for attr in criteria if attr in JDevice.interned]
+            if indexed:
+                criteria = dict(criteria)
+                devices = self.value_index(indexed[0]).get(criteria.pop(indexed[0]), [])
+        # One attribute at a time, the first one usually leaves few devices for the others
+        for attr, value in criteria.items():
+            get = attrgetter(attr)
+            devices = [device for device in devices if get(device) == value]
+        return list(devices)
+
+    def value_index(self, attr):
+        # Devices by value of an interned attribute (model, curr_code, tar_code, staged_code or site). The index is
+        # built on first use and again only after a device value or the rack has changed.
+        changes = JDevice.changes
+        cached = self.value_indexes.get(attr)
+        if cached is None or cached[0] != changes:
+            cached = (changes, self.group_by(attr))
+            self.value_indexes[attr] = cached
+        return cached[1]
+
+    def group_by(self, *attrs, devices=None):
+        """ Purpose: Group devices by one or more attributes, ie. group_by('model', 'curr_code').
+            Parameters:
+                attrs       -   Device attribute names, the key of each group is a tuple of their values when more
+                                than one is given
+                devices     -   Devices to group, the whole rack when None
+            Returns:
+                Dictionary of key to the list of its devices, in rack order
+        """
+        devices = self.devices if devices is None else devices
+        get = attrgetter(*attrs)
+        groups = {}
+        for device in devices:
+            key = get(device)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [device]
+            else:
+                group.append(device)
+        return groups
+
+    def count_by(self, *attrs, devices=None):
+        # Number of devices of each value (or tuple of values) of the attributes, ie. devices per model
+        devices = self.devices if devices is None else devices
+        return Counter(map(attrgetter(*attrs), devices))
+
+    def save_devices(self, devices):
+        # Save new or changed devices to the database in a single transaction
+        if self.db is None or not devices:
+            return
+        rows = []
+        for device in devices:
+            rows.append((device.ip, device.hostname, device.model, device.curr_code, device.tar_code,
+                         device.staged_code, device.refreshed().isoformat(), int(device.active), device.site))
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO devices (" + ", ".join(JRack.db_columns) + ") VALUES (" +
+                                ", ".join("?" * len(JRack.db_columns)) + ")", rows)
+
+    def remove_devices(self, ips):
+        # Remove the devices with these IPs, returns the list of removed devices
+        ips = set(ips)
+        with self.lock:
+            removed = [device for device in self.devices if device.ip in ips]
+            self.devices = [device for device in self.devices if device.ip not in ips]
+            for device in removed:
+                del self.index[device.ip]
+            JDevice.changed()
+            if self.db is not None and removed:
+                with self.db:
+                    self.db.executemany("DELETE FROM devices WHERE ip = ?", [(device.ip,) for device in removed])
+        return removed
+
+    def clear(self):
+        # Remove every device
+        with self.lock:
+            self.devices = []
+            self.index = {}
+            JDevice.changed()
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM devices")
+
+    def stale_devices(self, max_age, devices=None):
+        # Returns the devices (of the rack, or of "devices") not refreshed in the last max_age seconds, oldest first
+        cutoff = time.time() - max_age
+        with self.lock:
+            devices = [device for device in (self.devices if devices is None else devices)
+                       if device.last_refresh <= cutoff]
+        return sorted(devices, key=attrgetter('last_refresh'))
+
+    def close(self):
+        # Close the inventory database
+        if self.db is not None:
+            self.db.close()
+            self.db = None
 
 
 class JDevice:
 
+    # A rack can hold tens of thousands of devices, slots keep each one small
+    __slots__ = ('hostname', 'ip', 'model', 'curr_code', 'tar_code', 'last_refresh', 'active', 'staged_code', 'site')
+    # Values most devices share with others, interned so the rack keeps one copy of each
+    interned = frozenset(['model', 'curr_code', 'tar_code', 'staged_code', 'site'])
+    # Counts changes to the interned values of any device, the racks' value indexes are rebuilt when it moves. The
+    # refresher changes devices on its own thread, so the counter is moved under a lock.
+    changes = 0
+    changes_lock = threading.Lock()
+
     def __init__(self, ip, model, curr_code, tar_code, hostname):
-        # Initialize all elements of device
-        self.hostname = hostname
-        self.ip = ip
-        self.model = model
-        self.curr_code = curr_code
-        self.tar_code = tar_code
-        self.refresh = datetime.datetime.now()
-        self.active = True
-
-    def refresh(self):
-        # Resets the value after a successful scan
-        pass
+        # Initialize all elements of device. The shared values are set directly, the rack moves the change counter
+        # when it adds the device.
+        set_value = object.__setattr__
+        set_value(self, 'hostname', hostname)
+        set_value(self, 'ip', ip)
+        set_value(self, 'model', sys.intern(model) if type(model) is str else model)
+        set_value(self, 'curr_code', sys.intern(curr_code) if type(curr_code) is str else curr_code)
+        set_value(self, 'tar_code', sys.intern(tar_code) if type(tar_code) is str else tar_code)
+        # Time of the last successful read of the device, in seconds since the epoch
+        set_value(self, 'last_refresh', time.time())
+        set_value(self, 'active', True)
+        set_value(self, 'staged_code', None)
+        # Site or WAN link the device is behind, for the transfer bandwidth caps
+        set_value(self, 'site', '')
+
+    def __setattr__(self, name, value):
+        if name not in JDevice.interned:
+            object.__setattr__(self, name, value)
+            return
+        if type(value) is str:
+            value = sys.intern(value)
+        previous = getattr(self, name, UNSET)
+        # The value is written before the counter moves, so an index built in between is built again. Setting the
+        # same value (ie. a refresh finding the same version) leaves the indexes alone.
+        object.__setattr__(self, name, value)
+        if previous is UNSET or previous != value:
+            JDevice.changed()
+
+    @classmethod
+    def changed(cls):
+        # Move the change counter, += is not atomic across threads
+        with cls.changes_lock:
+            cls.changes += 1
+
+    def refresh(self, curr_code=None):
+        # Resets the value after a successful scan, with the running version when it was read
+        if curr_code is not None:
+            self.curr_code = curr_code
+        self.last_refresh = time.time()
+
+    def refreshed(self):
+        # The time of the last refresh as a datetime, for display
+        return datetime.datetime.fromtimestamp(self.last_refresh)
+
+    def age(self):
+        # Seconds since the device information was last refreshed
+        return time.time() - self.last_refresh
+
+    def is_staged(self):
+        # True if the target code has already been copied to the device
+        return self.tar_code is not None and self.staged_code == self.tar_code
 
     def upgrade(self, code_dest):
         # Upgrade a device
         pass
 
-    def __del__(self):
-        # Removes the devices
-        pass
\ No newline at end of file
+
+class RackRefresher(threading.Thread):
+    """ Purpose: Background thread that keeps the rack current. Devices whose last refresh is older than max_age
+                 are refreshed oldest first, at no more than "rate" devices per second.
+        Parameters:
+            rack            -   The JRack to keep current
+            refresh_func    -   Called with a device IP, returns the running version, or None to skip the device
+                                for now (ie. another operation is using it)
+            max_age         -   Seconds after which a device is refreshed again
+            rate            -   Maximum number of devices refreshed per second
+    """
+
+    def __init__(self, rack, refresh_func, max_age=900, rate=1.0):
+        threading.Thread.__init__(self, name="RackRefresher")
+        self.daemon = True
+        self.rack = rack
+        self.refresh_func = refresh_func
+        self.max_age = max_age
+        self.rate = rate
+        self.stop_event = threading.Event()
+        self.refreshed = 0
+        self.errors = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            stale = self.rack.stale_devices(self.max_age)
+            if not stale:
+                # Nothing to do, look again in a little while
+                self.stop_event.wait(min(self.max_age, 30))
+                continue
+            for device in stale:
+                if self.stop_event.is_set():
+                    break
+                started = time.time()
+                try:
+                    self.refresh_device(device)
+                finally:
+                    # Keep to the request rate, whether the device was refreshed, skipped or failed
+                    self.stop_event.wait(max(0.0, 1.0 / self.rate - (time.time() - started)))
+
+    def refresh_device(self, device):
+        # Refresh one device and save it, unless it is skipped or has been removed from the rack in the meantime
+        try:
+            version = self.refresh_func(device.ip)
+        except Exception:
+            self.errors += 1
+            return
+        if version is None:
+            return
+        with self.rack.lock:
+            if self.rack.get_device(device.ip) is not device:
+                return
+            device.refresh(version)
+            self.rack.save_devices([device])
+        self.refreshed += 1
+
+    def stop(self):
+        self.stop_event.set()
@@ -5,21 +5,39 @@
 
 import getopt
 import sys
-import csv
-import logging
+import json
 import datetime
 import pprint
-
-from jnpr.junos import Device
-from jnpr.junos.utils.sw import SW
-from jnpr.junos.exception import *
-from jrack import JRack
+import time
+import queue
+import threading
+import importlib
+
+# When jscan started loading, for --startup-report
+load_started = time.perf_counter()
+
+# PyEZ, ncclient, paramiko and prettytable are imported by the operations that use them, not here, so starting
+# jscan (ie. for -h or a job that fails validation) does not wait for them
+from jrack import JRack, RackRefresher
+from jimage import ChecksumCache
+from jpool import SessionPool
+from jlog import logger, device_logger, start_logging, stop_logging
+from jhistory import RunHistory, STATUS_KEYS, export_csv
+from jmetrics import metrics
+from jjournal import UpgradeJournal, FAILED
+from jdeadline import Deadline
+from jtransfer import TransferScheduler, parse_site_rates, MBIT, TRANSFER_KEYS
+from jinventory import InventoryReader, reject_file_for
+from jselect import Selector, load_selections, save_selection, delete_selection
+from jcompliance import compliance, fleet_compliance, export_compliance, COMPLIANCE_KEYS
+from jversion import image_version
 from utility import *
 from os.path import join
 from getpass import getpass
-from prettytable import PrettyTable
-from ncclient.operations.errors import TimeoutExpiredError
 from sys import stdout
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+load_seconds = time.perf_counter() - load_started
 
 
 class Menu:
@@ -27,6 +45,21 @@ class Menu:
     password = ""
     port = 22
     upgrade_list = ""
+    max_workers = 10
+    # Discovered devices added to the rack (and saved) at a time when loading a device list
+    load_batch = 500
+    lock_retries = 3
+    lock_backoff = 5
+    refresh_age = 0
+    refresh_rate = 1.0
+    watch_port = 830
+    watch_interval = 5
+    watch_timeout = 1800
+    # Seconds a rebooted device may keep answering before it is reported as never having gone down
+    watch_down_grace = 180
+    inventory_db = ""
+    upgrade_workers = 1
+    upgrade_timeout = 3600
 
     list_dir = ""
     image_dir = ""
@@ -35,10 +68,48 @@ class Menu:
     status_log = ""
 
     remote_path = "/var/tmp"
+    checksums = None
+    checksum_algorithm = "md5"
+    pool = None
+    max_sessions = 100
+    session_idle = 300
+    job_file = ""
+    log_file = ""
+    log_json = False
+    device_logs = False
+    history = None
+    metrics_dir = ""
+    resume = False
+    journal = None
+    # Image transfer budget in Mbit/s (0 for none) and caps by site in bytes/second
+    bandwidth = 0.0
+    site_bandwidth = {}
+    scheduler = None
+    # Copy images with the resumable SFTP transfer even without a budget
+    sftp = False
+    # Bulk operations act on the devices matching the selector, or the whole rack when None. The --select text
+    # (a selector or the name of a saved selection) is parsed once the lists directory is known.
+    selection = None
+    select_text = ""
+    selections_file = ""
+
+    # Libraries loaded only when an operation needs them, in the order --startup-report times them
+    lazy_modules = ['prettytable', 'paramiko', 'ncclient.manager', 'jnpr.junos', 'jnpr.junos.utils.sw',
+                    'jnpr.junos.utils.config', 'jwatch']
+
+    # Steps a job file may run, in the order they are listed in the job
+    job_steps = ['load', 'refresh', 'stage', 'upgrade', 'reboot', 'oper', 'set']
+
+    usage = "jscan.py -u <username> [-w <workers>] [-d <inventory.db>] [--upgrade-workers=<workers>] " \
+            "[--upgrade-timeout=<seconds>] [--refresh-age=<seconds>] [--refresh-rate=<devices/second>] " \
+            "[--job=<job file>] [--log-json] [--device-logs] [--metrics-dir=<dir>] [--resume] " \
+            "[--bandwidth=<Mbit/s>] [--site-bandwidth=<site>=<Mbit/s>,...] [--sftp] [--startup-report] " \
+            "[--select=<selector or saved selection>]"
 
     # Display a menu and respond to choices when run.
     def __init__(self):
-        self.jrack = JRack()
+        self.jrack = JRack(Menu.inventory_db or None)
+        self.refresher = None
         self.choices = {
             "1": self.show_devices,
             "2": self.refresh_device,
@@ -50,11 +121,19 @@ class Menu:
             "8": self.set_commands,
             "9": self.pyez_load,
             "10": self.clear_devices,
+            "11": self.stage_images,
+            "12": self.background_refresh,
+            "13": self.run_history,
+            "14": self.select_devices,
+            "15": self.compliance_report,
             "0": self.quit
         }
 
     # The printed menu
     def display_menu(self):
+        if Menu.selection:
+            print("\nSelection: {0} ({1} of {2} devices)".format(Menu.selection, len(self.selected_devices()),
+                                                                len(self.jrack.devices)))
         print ("""
 
 Rack Menu
@@ -69,6 +148,11 @@ Rack Menu
 8. Execute Set Commands
 9. PyEZ Load
 10. Clear Devices
+11. Stage Images
+12. Background Refresh
+13. Run History
+14. Select Devices
+15. Compliance Report
 0. Quit
 """)
 
@@ -88,6 +172,7 @@ Rack Menu
             Menu.log_dir = "./logs/"
             Menu.config_dir = "./configs/"
             Menu.status_log = "./logs/Juniper_Status_Log.csv"
+        Menu.selections_file = Menu.list_dir + "selections.json"
 
         if not exists(Menu.list_dir):
             print("Missing 'lists' directory! Create a directory in jscan directory called 'lists'.")
@@ -99,27 +184,129 @@ Rack Menu
             print("Missing 'logs' directory! Create a directory in jscan directory called 'logs'.")
             return False
 
+        Menu.checksums = ChecksumCache(Menu.image_dir)
         return True
 
     def getargs(self, argv):
         # Interprets and handles the command line arguments
         try:
-            opts, args = getopt.getopt(argv, "hu:", ["user="])
+            opts, args = getopt.getopt(argv, "hu:w:d:", ["user=", "workers=", "db=", "upgrade-workers=", "upgrade-timeout=",
+                                                          "refresh-age=", "refresh-rate=", "job=", "log-json",
+                                                          "device-logs", "metrics-dir=", "resume", "bandwidth=",
+                                                          "site-bandwidth=", "sftp", "startup-report",
+                                                          "select="])
         except getopt.GetoptError:
-            print("jscan.py -u <username>")
+            print(Menu.usage)
             sys.exit(2)
         for opt, arg in opts:
             if opt == '-h':
-                print("jscan.py -u <username>")
+                print(Menu.usage)
                 sys.exit()
             elif opt in ("-u", "--user"):
                 Menu.username = arg
+            elif opt in ("-w", "--workers"):
+                try:
+                    Menu.max_workers = max(1, int(arg))
+                except ValueError:
+                    print("Workers must be a number: {0}".format(arg))
+                    sys.exit(2)
+            elif opt in ("-d", "--db"):
+                Menu.inventory_db = arg
+            elif opt == "--upgrade-workers":
+                try:
+                    Menu.upgrade_workers = max(1, int(arg))
+                except ValueError:
+                    print("Upgrade workers must be a number: {0}".format(arg))
+                    sys.exit(2)
+            elif opt == "--upgrade-timeout":
+                try:
+                    Menu.upgrade_timeout = max(1, int(arg))
+                except ValueError:
+                    print("Upgrade timeout must be a number of seconds: {0}".format(arg))
+                    sys.exit(2)
+            elif opt == "--refresh-age":
+                try:
+                    Menu.refresh_age = max(0, int(arg))
+                except ValueError:
+                    print("Refresh age must be a number of seconds: {0}".format(arg))
+                    sys.exit(2)
+            elif opt == "--refresh-rate":
+                try:
+                    Menu.refresh_rate = float(arg)
+                    if Menu.refresh_rate <= 0:
+                        raise ValueError
+                except ValueError:
+                    print("Refresh rate must be a positive number of devices per second: {0}".format(arg))
+                    sys.exit(2)
+            elif opt == "--job":
+                Menu.job_file = arg
+            elif opt == "--log-json":
+                Menu.log_json = True
+            elif opt == "--device-logs":
+                Menu.device_logs = True
+            elif opt == "--metrics-dir":
+                Menu.metrics_dir = arg
+            elif opt == "--resume":
+                Menu.resume = True
+            elif opt == "--startup-report":
+                sys.exit(self.startup_report())
+            elif opt == "--sftp":
+                Menu.sftp = True
+            elif opt == "--select":
+                Menu.select_text = arg
+            elif opt == "--bandwidth":
+                try:
+                    Menu.bandwidth = max(0.0, float(arg))
+                except ValueError:
+                    print("Bandwidth must be a number of Mbit/s: {0}".format(arg))
+                    sys.exit(2)
+            elif opt == "--site-bandwidth":
+                try:
+                    Menu.site_bandwidth = parse_site_rates(arg)
+                except ValueError as err:
+                    print(err)
+                    sys.exit(2)
+
+    def startup_report(self):
+        """ Purpose: Show how long jscan took to load and how long each lazily loaded library takes to import, in
+                     the order an operation would load them (each time excludes what the ones before it loaded).
+                     A library that was already loaded at startup means an eager import crept back in.
+            Returns:
+                Exit code: 0, or 1 when a lazy library was loaded at startup
+        """
+        eager = [name for name in Menu.lazy_modules if name in sys.modules]
+        rows = []
+        for name in Menu.lazy_modules:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+                loaded = 'at startup' if name in eager else 'on first use'
+            except ImportError:
+                loaded = 'not installed'
+            rows.append((name, (time.perf_counter() - start) * 1000, loaded))
+
+        print("jscan loaded in {0:.1f} ms".format(load_seconds * 1000))
+        print("{0:<28}{1:>12}  {2}".format('Library', 'Import (ms)', 'Loaded'))
+        for name, ms, loaded in rows:
+            print("{0:<28}{1:>12.1f}  {2}".format(name, ms, loaded))
+        print("Saved at startup: {0:.1f} ms".format(sum(ms for name, ms, loaded in rows if loaded == 'on first use')))
+        if eager:
+            print("Loaded at startup, should be lazy: {0}".format(", ".join(eager)))
+            return 1
+        return 0
 
     def run(self):
         # Determine the os and set directory paths accordingly
         if Menu.set_dir_format(self):
+            if Menu.select_text and not self.use_selection(Menu.select_text):
+                sys.exit(2)
             # Securely get the user's password
             Menu.password=getpass(prompt="\nEnter your password: ")
+            # Sessions opened by any operation are kept for the next one
+            Menu.pool = SessionPool(Menu.username, Menu.password, max_sessions=Menu.max_sessions,
+                                    max_idle=Menu.session_idle)
+            self.start_log()
+            self.start_transfers()
 
             # Display the menu and respond to choices
             while True:
@@ -134,114 +321,530 @@ Rack Menu
             print("Please fix issues and run again.")
             sys.exit(0)
 
+    def load_job(self, job_file):
+        # Read a job file, YAML when the name ends in .yaml or .yml, otherwise JSON
+        with open(job_file, 'r') as infile:
+            if job_file.lower().endswith(('.yaml', '.yml')):
+                # Only needed for YAML jobs, so it is not a requirement for interactive use
+                import yaml
+                job = yaml.safe_load(infile)
+            else:
+                job = json.load(infile)
+        if not isinstance(job, dict):
+            raise ValueError("Job file must contain a mapping of settings")
+        return job
+
+    def run_job(self, job_file):
+        """ Purpose: Run the steps of a job file without any prompts, so jscan can be run from cron or a scheduler.
+                     Settings in the job override the command line. Steps run in the order they are listed and
+                     every step runs even when an earlier one had device failures.
+            Parameters:
+                job_file    -   Path of the YAML or JSON job file
+            Returns:
+                Exit code: 0 if every device succeeded, 1 if any device failed, 2 if the job could not be run
+        """
+        try:
+            job = self.load_job(job_file)
+        except ImportError:
+            print("YAML job files need PyYAML installed (pip install pyyaml), or use a JSON job file")
+            return 2
+        except (IOError, OSError, ValueError) as err:
+            print("Unable to read job file {0} ERROR: {1}".format(job_file, err))
+            return 2
+
+        # Check the whole job before anything is run
+        steps = job.get('steps', [])
+        unknown = [step for step in steps if step not in Menu.job_steps]
+        if not steps or unknown:
+            print("Job steps must be a list of: {0}".format(", ".join(Menu.job_steps)))
+            return 2
+        reboot = job.get('reboot', 'noReboot')
+        if reboot not in ('doReboot', 'noReboot'):
+            print("Job reboot must be doReboot or noReboot, there is nobody to ask")
+            return 2
+        if 'load' in steps and not job.get('list'):
+            print("The load step needs a device list")
+            return 2
+        if 'oper' in steps and not job.get('oper_commands'):
+            print("The oper step needs oper_commands")
+            return 2
+        if 'set' in steps and not (job.get('set_commands') or job.get('set_file')):
+            print("The set step needs set_commands or a set_file")
+            return 2
+
+        try:
+            Menu.username = job.get('username', Menu.username)
+            Menu.password = job.get('password') or os.environ.get(job.get('password_env', 'JSCAN_PASSWORD'), '')
+            Menu.max_workers = max(1, int(job.get('workers', Menu.max_workers)))
+            Menu.upgrade_workers = max(1, int(job.get('upgrade_workers', Menu.upgrade_workers)))
+            Menu.upgrade_timeout = max(1, int(job.get('upgrade_timeout', Menu.upgrade_timeout)))
+            Menu.refresh_age = max(0, int(job.get('refresh_age', Menu.refresh_age)))
+            Menu.bandwidth = max(0.0, float(job.get('bandwidth', Menu.bandwidth)))
+            if job.get('site_bandwidth'):
+                Menu.site_bandwidth = parse_site_rates(job['site_bandwidth'])
+        except (TypeError, ValueError) as err:
+            print("Invalid number in job file: {0}".format(err))
+            return 2
+        if not Menu.username or not Menu.password:
+            print("Job needs a username and a password, ie. in the {0} environment variable".format(
+                job.get('password_env', 'JSCAN_PASSWORD')))
+            return 2
+
+        if not self.set_dir_format():
+            return 2
+        select_text = job.get('select', Menu.select_text)
+        if select_text and not self.use_selection(select_text):
+            return 2
+        if job.get('log_dir'):
+            Menu.log_dir = join(job['log_dir'], '')
+        if job.get('status_log'):
+            Menu.status_log = job['status_log']
+        Menu.log_json = job.get('log_json', Menu.log_json)
+        Menu.device_logs = job.get('device_logs', Menu.device_logs)
+        Menu.metrics_dir = job.get('metrics_dir', Menu.metrics_dir)
+        Menu.resume = job.get('resume', Menu.resume)
+        Menu.sftp = job.get('sftp', Menu.sftp)
+        self.start_log()
+        if job.get('inventory'):
+            self.jrack.close()
+            self.jrack = JRack(job['inventory'])
+        Menu.pool = SessionPool(Menu.username, Menu.password, max_sessions=Menu.max_sessions,
+                                max_idle=Menu.session_idle)
+        self.start_transfers()
+
+        summary = []
+        date_time = datetime.datetime.now().strftime("%Y%m%d-%H%M")
+        try:
+            for step in steps:
+                print("\n\n==================== Job step: {0} ====================".format(step))
+                start = time.time()
+                devices = len(self.jrack.devices)
+                failed = getattr(self, 'job_' + step)(job, reboot, date_time)
+                if step == 'load':
+                    devices = len(self.jrack.devices) - devices + len(failed)
+                else:
+                    devices = len(self.selected_devices())
+                summary.append([step, devices, len(failed), round(time.time() - start, 1)])
+                for ip in failed:
+                    self.do_log('{0} step failed'.format(step), level='error', log=device_logger(ip, operation=step))
+        finally:
+            Menu.pool.close_all()
+            if Menu.scheduler:
+                Menu.scheduler.close()
+            self.jrack.close()
+            Menu.history.close()
+            stop_logging()
+            close_logs()
+
+        print("\n\n---------------")
+        print("Job Summary")
+        print("---------------")
+        t = PrettyTable(['Step', 'Devices', 'Failed', 'Seconds'])
+        for row in summary:
+            t.add_row(row)
+        print(t)
+        return 1 if [row for row in summary if row[2]] else 0
+
+    def job_load(self, job, reboot, date_time):
+        # Discover the devices in the job's list, a bare file name is looked up in the lists directory
+        list_file = job['list']
+        if not exists(list_file):
+            list_file = Menu.list_dir + list_file
+        Menu.upgrade_list = os.path.basename(list_file)
+        return self.load_list(list_file)
+
+    def job_refresh(self, job, reboot, date_time):
+        devices = self.selected_devices()
+        if Menu.refresh_age:
+            devices = self.jrack.stale_devices(Menu.refresh_age, devices)
+        return self.run_refresh(devices)
+
+    def job_stage(self, job, reboot, date_time):
+        # Devices without a valid target image are failures, not questions
+        selected = self.selected_devices()
+        devices = self.verify_images(selected, ask=False)
+        skipped = self.left_out(selected, devices)
+        results = self.run_staging(devices)
+        return skipped + [result['IP'] for result in results if result['Result'] == 'Failed']
+
+    def job_upgrade(self, job, reboot, date_time):
+        selected = self.selected_devices()
+        devices = self.verify_images(selected, ask=False)
+        skipped = self.left_out(selected, devices)
+        statusList = self.run_upgrades(devices, reboot, Menu.resume)
+        return skipped + self.job_results(job, statusList, self.report_upgrades, reboot)
+
+    def job_reboot(self, job, reboot, date_time):
+        statusList = self.run_reboots(self.selected_devices())
+        return self.job_results(job, statusList, self.report_reboots, 'doReboot')
+
+    def left_out(self, selected, devices):
+        # IPs of the selected devices that are not in "devices"
+        ips = set(device.ip for device in devices)
+        return [device.ip for device in selected if device.ip not in ips]
+
+    def job_results(self, job, statusList, report, reboot):
+        # Track the reboots if the job asks for it and report, returns the IPs that did not finish as expected
+        if job.get('watch_reboots', True):
+            self.track_reboots(statusList)
+        report(statusList)
+        failed = []
+        for statusDict in statusList:
+            if statusDict['Connected'] != 'Y' or statusDict.get('OS_installed') == 'N' or \
+                    (reboot == 'doReboot' and statusDict['Rebooted'] != 'Y') or \
+                    statusDict.get('Up_Time') == 'Not up' or statusDict.get('Down_Time') == 'Never went down':
+                failed.append(statusDict['IP'])
+        return failed
+
+    def job_oper(self, job, reboot, date_time):
+        log_file = job.get('oper_log') or Menu.log_dir + "oper_cmd_" + date_time + ".log"
+        return self.run_oper_commands(job['oper_commands'], log_file, job.get('keep_device_files', False), date_time)
+
+    def job_set(self, job, reboot, date_time):
+        command_list = job.get('set_commands')
+        if not command_list:
+            set_file = job['set_file']
+            if not exists(set_file):
+                set_file = Menu.config_dir + set_file
+            with open(set_file) as f:
+                command_list = f.read().splitlines()
+        log_file = job.get('set_log') or Menu.log_dir + "set_cmd_" + date_time + ".log"
+        outcomes = self.run_set_commands(command_list, log_file)
+        return [outcome['IP'] for outcome in outcomes if outcome['Result'] != 'Committed']
+
     def show_devices(self):
-        # View all the devices in list
-        devices = self.jrack.devices
-        t = PrettyTable(['IP', 'Model', 'Current Code', 'Target Code', 'Host', 'Last Updated'])
+        # View all the selected devices
+        devices = self.selected_devices()
+        stale = 0
+        t = PrettyTable(['IP', 'Model', 'Current Code', 'Target Code', 'Compliance', 'Host', 'Site', 'Last Updated',
+                         'Age'])
         for device in devices:
-            t.add_row([device.ip, device.model, device.curr_code, device.tar_code, device.hostname, device.refresh])
+            age = device.age()
+            # Devices older than the refresh age are flagged
+            flag = ''
+            if Menu.refresh_age and age >= Menu.refresh_age:
+                flag = ' *'
+                stale += 1
+            t.add_row([device.ip, device.model, device.curr_code, device.tar_code,
+                       compliance(device.curr_code, device.tar_code), device.hostname, device.site,
+                       device.refreshed().strftime("%Y-%m-%d %H:%M:%S"), str(datetime.timedelta(seconds=int(age))) + flag])
         print(t)
+        if Menu.refresh_age:
+            print("* {0} of {1} devices not refreshed in the last {2} seconds".format(stale, len(devices),
+                                                                                    Menu.refresh_age))
+        if self.refresher:
+            print("Background refresh running: {0} refreshed, {1} errors".format(self.refresher.refreshed,
+                                                                               self.refresher.errors))
 
     def add_device(self, ip=None, tar_code=None):
-        dot = "."
-        # Add devices to the list
+        # Add a single device to the list
         if not ip:
             ip = input("Enter an ip: ")						# Change this to "input" when using Python 3
-        new_device = True
-        ''' Make sure this device is not already in the list.'''
-        print("Adding host {0} ".format(ip),)
-        for device in self.jrack.devices:
-            if ip in device.ip:
-                print("Host: {0} ({1}) already loaded.".format(device.hostname, ip))
-                new_device = False
-                break
-        ''' Do this if this is a new device.'''
-        print(dot, end='')
-        if new_device:
-            dev = Device(ip, user=Menu.username, password=Menu.password)
-            attribList = ['model', 'version', 'hostname']
+        print("Adding host {0} ".format(ip))
+        if self.is_loaded(ip):
+            return
+        self.add_discovered(self.discover_device(ip, tar_code))
+
+    def is_loaded(self, ip):
+        # Make sure this device is not already in the list
+        device = self.jrack.get_device(ip)
+        if device:
+            print("Host: {0} ({1}) already loaded.".format(device.hostname, ip))
+            return True
+        return False
+
+    def discover_device(self, ip, tar_code=None, site='', model=None):
+        """ Purpose: Connect to a device and collect the facts needed for the rack. This runs inside a worker
+                     thread, so it does not touch the rack; the result is handed back to add_discovered().
+            Parameters:
+                ip          -   String containing the IP of the device
+                tar_code    -   Target image for the device, or None
+                site        -   Site of the device from the device list, or ''
+                model       -   Model from the device list, used when the device does not report one
+            Returns:
+                Dictionary with the device 'facts' (or None) and an 'error' message on failure
+        """
+        from jnpr.junos.exception import ConnectRefusedError
+        result = {'ip': ip, 'tar_code': tar_code, 'site': site, 'facts': None, 'netconf_enabled': False, 'error': ''}
+        attribList = ['model', 'version', 'hostname']
+        try:
             try:
-                print(dot, end='')
-                dev.open()
-                print(dot, end='')
+                with metrics.timer('discover', 'connect'):
+                    dev = Menu.pool.acquire(ip)
             except ConnectRefusedError:
-                print("\nIssue connecting with NETCONF. Trying to enable NETCONF...")
-                if enable_netconf(ip, Menu.username, Menu.password, Menu.port):
-                    try:
-                        dev.open()
-                    except Exception as err:
-                        print("\nUnable to open connection to: {0} ERROR: {1}".format(ip, err))
-                        return
-                    else:
-                        print("Continuing with add...")
-                        for key in attribList:
-                            if key not in dev.facts:
-                                print("Missing attribute '{1}', skipping {0}".format(ip, key))
-                                dev.facts[key] = 'EMPTY'
-                                #dev.close()
-                                #return
-                        self.jrack.new_device(ip, dev.facts['model'], dev.facts['version'], tar_code, dev.facts['hostname'])
-                        print(" {0} ({1}) has been added.".format(ip, dev.facts['hostname']))
-            except Exception as err:
-                print("Unable to open connection to: {0} ERROR: {1}".format(ip, err))
-                return
-            else:
-                #print dev.facts
+                # NETCONF is not enabled, enable it and try one more time
+                if not enable_netconf(ip, Menu.username, Menu.password, Menu.port):
+                    result['error'] = "Unable to enable NETCONF"
+                    return result
+                result['netconf_enabled'] = True
+                dev = Menu.pool.acquire(ip)
+        except Exception as err:
+            result['error'] = "Unable to open connection: {0}".format(err)
+            return result
+
+        # The session stays open in the pool for the operations that follow
+        try:
+            facts = {}
+            with metrics.timer('discover', 'facts'):
                 for key in attribList:
-                    if key not in dev.facts:
-                        print("Missing attribute '{1}', skipping {0}".format(ip, key))
-                        # dev.close()
-                        return
-                self.jrack.new_device(ip, dev.facts['model'], dev.facts['version'], tar_code, dev.facts['hostname'])
-                print(" {0} ({1}) has been added.".format(ip, dev.facts['hostname']))
+                    if key in dev.facts:
+                        facts[key] = dev.facts[key]
+                    elif key == 'model' and model:
+                        facts[key] = model
+                    elif result['netconf_enabled']:
+                        facts[key] = 'EMPTY'
+                    else:
+                        result['error'] = "Missing attribute '{0}'".format(key)
+                        break
+                else:
+                    result['facts'] = facts
+        except Exception as err:
+            result['error'] = "Unable to collect facts: {0}".format(err)
+            Menu.pool.release(ip, discard=True)
+        else:
+            Menu.pool.release(ip)
+        return result
+
+    def add_discovered(self, result):
+        # Add a device returned by discover_device() to the rack, returns True if it was added
+        row = self.discovered_row(result)
+        if row is None:
+            return False
+        self.jrack.new_device(*row)
+        return True
+
+    def discovered_row(self, result):
+        # The rack row (ip, model, curr_code, tar_code, hostname, site) of a discovered device, None if it failed
+        ip = result['ip']
+        if result['facts'] is None:
+            print("Unable to add {0} ERROR: {1}".format(ip, result['error']))
+            return None
+        facts = result['facts']
+        if result['netconf_enabled']:
+            print("Enabled NETCONF on {0}".format(ip))
+        print(" {0} ({1}) has been added.".format(ip, facts['hostname']))
+        return ip, facts['model'], facts['version'], result['tar_code'], facts['hostname'], result.get('site', '')
+
+    def discover_devices(self, targets):
+        """ Purpose: Discover many devices through a bounded pool of worker threads. Targets are taken from the
+                     iterable only as workers free up, so a device list can be read while it is discovered, and the
+                     devices found are added to the rack (and saved) in batches of Menu.load_batch. A summary with
+                     timing is displayed at the end.
+            Parameters:
+                targets     -   Iterable of dictionaries with the 'ip' and optionally the 'tar_code', 'site' and
+                                'model' of each device
+            Returns:
+                The IPs added and the IPs that failed
+        """
+        added = []
+        failed = []
+        rows = []
+        submitted = 0
+        metrics.reset('discover')
+        start = time.time()
+
+        def collect(futures):
+            # Queue the devices found for the rack, and add them once a batch is full
+            for future in futures:
                 try:
-                    dev.close()
-                except TimeoutExpiredError:
-                    print("Timed out closing connection")
+                    result = future.result()
+                except Exception as err:
+                    print("Discovery worker failed ERROR: {0}".format(err))
+                    continue
+                row = self.discovered_row(result)
+                if row is None:
+                    failed.append(result['ip'])
+                else:
+                    rows.append(row)
+            if len(rows) >= Menu.load_batch:
+                added.extend(device.ip for device in self.jrack.new_devices(rows))
+                del rows[:]
+
+        with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+            pending = set()
+            for target in targets:
+                pending.add(executor.submit(self.discover_device, target['ip'], target.get('tar_code'),
+                                            target.get('site', ''), target.get('model')))
+                submitted += 1
+                # Only a few targets per worker are queued, the rest of the list is not read yet
+                if len(pending) >= Menu.max_workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(as_completed(pending))
+        if rows:
+            added.extend(device.ip for device in self.jrack.new_devices(rows))
+        elapsed = time.time() - start
+
+        print("\n\n---------------")
+        print("Discovery Summary")
+        print("---------------")
+        print("Added: {0}".format(len(added)))
+        print("Failed: {0}".format(len(failed)))
+        for myfailed in failed:
+            print("\t{0}".format(myfailed))
+        print("Workers: {0}".format(Menu.max_workers))
+        print("Elapsed: {0:.1f} seconds".format(elapsed))
+        if elapsed > 0:
+            print("Throughput: {0:.2f} devices/second".format(submitted / elapsed))
+        print("-----------------")
+        self.export_metrics('discover')
+        return added, failed
 
     def load_devices(self):
         # Load from a list of devices
         filelist = getFileList(Menu.list_dir)
         if filelist:
             Menu.upgrade_list = getOptionAnswer("Choose an upgrade file", filelist)
-            with open(join(Menu.list_dir,Menu.upgrade_list), 'r') as infile:
-                reader = csv.DictReader(infile)
-                print("\n\n----------------------")
-                print("Scanning Upgrade CSV")
-                print("----------------------\n")
-                for row in reader:
-                    if row['IP_ADDR'] and not row['UPGRADE_IMG']:
-                        self.add_device(row['IP_ADDR'])
-                    elif row['UPGRADE_IMG']:
-                        self.add_device(row['IP_ADDR'], row['UPGRADE_IMG'])
-                    else:
-                        print("- Blank Row -")
+            self.load_list(join(Menu.list_dir, Menu.upgrade_list))
         else:
             print("No files present in 'lists' directory.")
 
+    def load_list(self, list_file):
+        # Discover the devices in a device list (CSV or JSON lines) that are not loaded yet, returns the IPs that could
+        # not be added. The list is read while the devices are discovered, so a list of any size loads in bounded
+        # memory. Rows that cannot be used are displayed with their line number and written to the reject file.
+        reader = InventoryReader(list_file, reject_file_for(list_file, Menu.log_dir))
+        loaded = 0
+
+        def targets():
+            nonlocal loaded
+            for target in reader:
+                if self.jrack.get_device(target['ip']):
+                    loaded += 1
+                else:
+                    yield target
+
+        print("\n\n----------------------")
+        print("Scanning Device List")
+        print("----------------------\n")
+        print("Discovering the devices in {0} ({1} workers)...".format(list_file, Menu.max_workers))
+        try:
+            added, failed = self.discover_devices(targets())
+        except (IOError, OSError, ValueError) as err:
+            print("Unable to read {0} ERROR: {1}".format(list_file, err))
+            return []
+
+        print("\n---------------")
+        print("List Summary")
+        print("---------------")
+        print("Rows: {0}".format(reader.rows))
+        print("Duplicate IPs: {0}".format(reader.duplicates))
+        print("Already Loaded: {0}".format(loaded))
+        print("Bad Rows: {0}".format(reader.bad))
+        for line, reason in reader.errors:
+            print("\tLine {0}: {1}".format(line, reason))
+        if reader.bad > len(reader.errors):
+            print("\t... {0} more".format(reader.bad - len(reader.errors)))
+        if reader.bad:
+            print("Bad rows written to: {0}".format(reader.reject_file))
+        print("-----------------")
+        return failed
+
     def refresh_device(self):
-        # Loop through devices and update code and date/time
-        changes = False
+        # Read the running version of every device, several at a time, and update code and date/time. When a
+        # refresh age is set, only the devices not refreshed within that many seconds are read.
+        devices = self.selected_devices()
+        if Menu.refresh_age:
+            selected = len(devices)
+            devices = self.jrack.stale_devices(Menu.refresh_age, devices)
+            print("{0} of {1} devices not refreshed in the last {2} seconds".format(len(devices), selected,
+                                                                                  Menu.refresh_age))
+        self.run_refresh(devices)
+
+    def run_refresh(self, devices):
+        # Refresh these devices, several at a time, returns the IPs that could not be refreshed
+        metrics.reset('refresh')
         print("Please be patient")
-        for device in self.jrack.devices:
-            print(dot, end='')
-            dev = Device(device.ip, user=Menu.username, password=Menu.password)
-            try:
-                dev.open()
-            except Exception as err:
-                print("Error opening {0}: {1}".format(device.ip, err))
-            else:
-                if device.curr_code != dev.facts['version']:
+        results = []
+        failed = []
+        changed = []
+        changes = False
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+            futures = {}
+            for device in devices:
+                futures[executor.submit(self.refresh_version, device.ip)] = device
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    version, connect_time, rpc_time = future.result()
+                except Exception as err:
+                    print("Error refreshing {0}: {1}".format(device.ip, err))
+                    results.append([device.ip, device.hostname, 'ERROR', '-', '-'])
+                    failed.append(device.ip)
+                    continue
+                results.append([device.ip, device.hostname, version, int(connect_time * 1000), int(rpc_time * 1000)])
+                device.refresh()
+                changed.append(device)
+                if device.curr_code != version:
                     old_code = device.curr_code
-                    device.curr_code = dev.facts['version']
-                    device.refresh = datetime.datetime.now()
+                    device.curr_code = version
                     # Print the changed device
                     print("{0} changed from {1} to {2}".format(device.ip, old_code, device.curr_code))
                     changes = True
+        elapsed = time.time() - start
+        self.jrack.save_devices(changed)
 
+        t = PrettyTable(['IP', 'Host', 'Version', 'Connect (ms)', 'RPC (ms)'])
+        for row in results:
+            t.add_row(row)
+        print(t)
         # Display a message if no changes were detected
         if not changes:
             print("\nNo changes!")
+        print("Refreshed {0} of {1} devices in {2:.1f} seconds".format(len(changed), len(devices), elapsed))
+        self.export_metrics('refresh')
+        return failed
+
+    def refresh_version(self, ip, blocking=True):
+        """ Purpose: Read the running version of one device with a single RPC, no facts are gathered. A pooled
+                     session is used when there is one.
+            Parameters:
+                blocking    -   When False, None is returned right away if another operation is using the device
+            Returns:
+                Tuple of the version, the seconds spent getting a session and the seconds spent on the RPC
+        """
+        start = time.perf_counter()
+        try:
+            dev = Menu.pool.acquire(ip, blocking)
+        except Exception:
+            metrics.observe('refresh', 'connect', time.perf_counter() - start, False)
+            raise
+        if dev is None:
+            return None
+        connected = time.perf_counter()
+        metrics.observe('refresh', 'connect', connected - start)
+        try:
+            version = get_junos_version(dev)
+        except Exception:
+            Menu.pool.release(ip, discard=True)
+            metrics.observe('refresh', 'rpc', time.perf_counter() - connected, False)
+            raise
+        Menu.pool.release(ip)
+        done = time.perf_counter()
+        metrics.observe('refresh', 'rpc', done - connected)
+        return version, connected - start, done - connected
+
+    def background_refresh(self):
+        # Start or stop the thread that keeps the rack current while other options are used
+        if self.refresher:
+            self.refresher.stop()
+            print("Background refresh stopped after refreshing {0} devices.".format(self.refresher.refreshed))
+            self.refresher = None
+            return
+        max_age = Menu.refresh_age or 900
+
+        def version(ip):
+            # Skip devices that another operation is using, they are picked up on a later pass
+            result = self.refresh_version(ip, blocking=False)
+            if result is None:
+                return None
+            return result[0]
+
+        self.refresher = RackRefresher(self.jrack, version, max_age=max_age, rate=Menu.refresh_rate)
+        self.refresher.start()
+        print("Background refresh started: devices older than {0} seconds, {1} devices/second at most.".format(
+            max_age, Menu.refresh_rate))
 
     def oper_commands(self):
         # Provide selection for sending a single command or multiple commands from a file
@@ -255,37 +858,57 @@ Rack Menu
 
         # Check if user wants to print output to a file
         log_file = None
+        keep_device_files = False
+        date_time = datetime.datetime.now().strftime("%Y%m%d-%H%M")
         if getTFAnswer('\nPrint output to a file'):
-            log_file = Menu.log_dir + "oper_cmd_" + datetime.datetime.now().strftime("%Y%m%d-%H%M") + ".log"
+            log_file = Menu.log_dir + "oper_cmd_" + date_time + ".log"
             print('Information logged in {0}'.format(log_file))
+            keep_device_files = getTFAnswer('Also keep a separate file for each device')
+
+        self.run_oper_commands(command_list, log_file, keep_device_files, date_time)
+
+    def run_oper_commands(self, command_list, log_file=None, keep_device_files=False, date_time=None):
+        # Run operational commands on every device, returns the IPs where they could not be run
+        with log_scope(log_file):
+            if date_time is None:
+                date_time = datetime.datetime.now().strftime("%Y%m%d-%H%M")
+            failed = []
+            screen_and_log(('User: {0}\n').format(Menu.username), log_file)
+            # Run all the commands on each device over one connection, several devices at a time. Each device streams
+            # its output to its own file as it arrives. Output is displayed in rack order, each device as soon as it
+            # and the devices before it have finished.
+            devices = self.selected_devices()
+            with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+                futures = [executor.submit(self.oper_device, device, command_list, date_time) for device in devices]
+                for device, future in zip(devices, futures):
+                    try:
+                        device_file = future.result()
+                    except Exception as err:
+                        print("Error running op_command on {0}({1}) ERROR: {2}".format(device.hostname, device.ip, err))
+                        failed.append(device.ip)
+                        continue
+                    try:
+                        copy_to_screen_and_log(device_file, log_file)
+                    except Exception as err:
+                        print("Problem writing output of {0} ERROR: {1}".format(device.ip, err))
+                    if keep_device_files:
+                        print("Output of {0} written to {1}".format(device.ip, device_file))
+                    else:
+                        os.remove(device_file)
+            screen_and_log(("\n" + "*" * 30 + " Commands Completed " + "*" * 30 + "\n"), log_file)
+            if log_file:
+                print("Output Written To: {0}".format(log_file))
+            return failed
 
-
-        output = ""
-        screen_and_log(('User: {0}\n').format(Menu.username), log_file)
-        # Loop over commands and devices
-        for command in command_list:
-            for device in self.jrack.devices:
-                try:
-                    results = op_command(device.ip, device.hostname, command, Menu.username, Menu.password)
-                except Exception as err:
-                    print("Error running op_command on {0}({1}) ERROR: {2}".format(device.hostname, device.ip, err))
-                else:
-                    screen_and_log(results, log_file)
-                    # Append output to a variable, we'll save when done with output
-                    if log_file:
-                        output += results
-        screen_and_log(("\n" + "*" * 30 + " Commands Completed " + "*" * 30 + "\n"), log_file)
-
-        # Check if a file was requested, if so print output to file
-        if log_file:
+    def oper_device(self, device, command_list, date_time):
+        # Run the commands on one device, streaming the output to a file in the logs directory
+        device_file = Menu.log_dir + "oper_cmd_" + date_time + "_" + device.ip + ".log"
+        with open(device_file, 'w') as out:
             try:
-                f = open(log_file, 'w')
+                op_commands(device.ip, device.hostname, command_list, Menu.username, Menu.password, out=out)
             except Exception as err:
-                print("Problem writing to file {0} ERROR: {1}".format(log_file, err))
-            else:
-                f.write(output)
-                print("Output Written To: {0}".format(log_file))
-            f.close()
+                out.write("Error running op_command on {0}({1}) ERROR: {2}\n".format(device.hostname, device.ip, err))
+        return device_file
 
     def set_commands(self):
         # Provide option for using a file to supply configuration commands
@@ -310,19 +933,51 @@ Rack Menu
         # Create log file for operation
         log_file = Menu.log_dir + "set_cmd_" + datetime.datetime.now().strftime("%Y%m%d-%H%M") + ".log"
         print('\nInformation logged in {0}'.format(log_file))
-        screen_and_log(('User: {0}\n').format(Menu.username), log_file)
-        screen_and_log("*" * 50 + " COMMANDS " + "*" * 50 + '\n', log_file)
-        for command in command_list:
-            screen_and_log((" -> {0}\n".format(command)), log_file)
-
-        # Loop over all devices in the rack
-        screen_and_log("*" * 50 + " START LOAD " + "*" * 50 + '\n', log_file)
-        for device in self.jrack.devices:
-            try:
-                set_command(device.ip, Menu.username, Menu.password, Menu.port, log_file, command_list)
-            except Exception as err:
-                print("Problem changing configuration ERROR: {0}".format(err))
-        screen_and_log("*" * 50 + " END LOAD " + "*" * 50 + '\n', log_file)
+        self.run_set_commands(command_list, log_file)
+
+    def run_set_commands(self, command_list, log_file):
+        # Load and commit set commands on every device, returns the outcome of each device
+        with log_scope(log_file):
+            metrics.reset('set')
+            screen_and_log(('User: {0}\n').format(Menu.username), log_file)
+            screen_and_log("*" * 50 + " COMMANDS " + "*" * 50 + '\n', log_file)
+            for command in command_list:
+                screen_and_log((" -> {0}\n".format(command)), log_file)
+
+            # Push to all devices in the rack, several at a time. The hostname is taken from the rack.
+            screen_and_log("*" * 50 + " START LOAD " + "*" * 50 + '\n', log_file)
+            outcomes = []
+            devices = self.selected_devices()
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+                futures = {}
+                for device in devices:
+                    future = executor.submit(set_command, device.ip, Menu.username, Menu.password, Menu.port, log_file,
+                                             command_list, device.hostname, Menu.lock_retries, Menu.lock_backoff,
+                                             Menu.max_workers == 1)
+                    futures[future] = device
+                for future in as_completed(futures):
+                    device = futures[future]
+                    try:
+                        outcomes.append(future.result())
+                    except Exception as err:
+                        print("Problem changing configuration ERROR: {0}".format(err))
+                        outcomes.append({'IP': device.ip, 'Host': device.hostname, 'Result': 'Failed', 'Attempts': 0,
+                                         'Seconds': 0.0, 'Comments': str(err)})
+            screen_and_log("*" * 50 + " END LOAD " + "*" * 50 + '\n', log_file)
+
+            # Outcome for each device, in rack order
+            order = dict((device.ip, index) for index, device in enumerate(devices))
+            t = PrettyTable(['IP', 'Host', 'Result', 'Lock Attempts', 'Seconds', 'Comments'])
+            for outcome in sorted(outcomes, key=lambda outcome: order[outcome['IP']]):
+                t.add_row([outcome['IP'], outcome['Host'], outcome['Result'], outcome['Attempts'], outcome['Seconds'],
+                           outcome['Comments']])
+            screen_and_log(str(t) + '\n', log_file)
+            committed = len([outcome for outcome in outcomes if outcome['Result'] == 'Committed'])
+            screen_and_log("Committed: {0} | Failed: {1} | Elapsed: {2:.1f} seconds\n".format(
+                committed, len(outcomes) - committed, time.time() - start), log_file)
+            self.export_metrics('set')
+            return outcomes
 
     def clear_devices(self):
         # Loop through devices and delete object instance
@@ -341,7 +996,7 @@ Rack Menu
             ip_del_list = []
             myip = getOptionAnswer("Select a device to delete", ip_list)
             if myip == 'ALL DEVICES':
-                self.jrack.devices = []
+                self.jrack.clear()
                 return
             elif myip == 'MULTI SELECT':
                 ip_list.pop(0)
@@ -352,13 +1007,8 @@ Rack Menu
 
             # Delete the devices in the list
             if ip_del_list:
-                for del_dev in ip_del_list:
-                    #print "Searching for {0}".format(del_dev)
-                    for i, dev in enumerate(self.jrack.devices):
-                        #print "i: {0} | dev: {1}".format(i, dev.ip)
-                        if del_dev == dev.ip:
-                            del self.jrack.devices[i]
-                            print("Deleted {0}".format(dev.ip))
+                for dev in self.jrack.remove_devices(ip_del_list):
+                    print("Deleted {0}".format(dev.ip))
             else:
                 print("No devices selected.")
 
@@ -419,27 +1069,27 @@ Rack Menu
         # Create log file
         log_file = Menu.log_dir + "pyez_load_" + datetime.datetime.now().strftime("%Y%m%d-%H%M") + ".log"
         print('\nInformation logged in {0}'.format(log_file))
-        screen_and_log(("User: {0}").format(Menu.username), log_file)
+        with log_scope(log_file):
+            screen_and_log(("User: {0}").format(Menu.username), log_file)
 
-        # Display the commands provided
-        screen_and_log("\n" + "*" * 50 + " COMMANDS " + "*" * 50 + "\n", log_file)
-        try:
-            myfile = open(config_file, 'r')
-        except Exception as err:
-            print("Failure opening {0} | ERROR: {1}".format(config_file, err))
-        else:
-            for line in myfile.readlines():
-                screen_and_log((" -> {0}".format(line)), log_file)
-            myfile.close()
+            # Display the commands provided
+            screen_and_log("\n" + "*" * 50 + " COMMANDS " + "*" * 50 + "\n", log_file)
+            try:
+                myfile = open(config_file, 'r')
+            except Exception as err:
+                print("Failure opening {0} | ERROR: {1}".format(config_file, err))
+            else:
+                for line in myfile.readlines():
+                    screen_and_log((" -> {0}".format(line)), log_file)
+                myfile.close()
 
-        # Loop over the devices
-        screen_and_log("\n" + "*" * 50 + " START LOAD " + "*" * 50 + "\n", log_file)
-        for device in self.jrack.devices:
-            results = load_with_pyez(merge_opt, overwrite_opt, format_opt, config_file, log_file, device.ip, device.hostname, Menu.username, Menu.password)
-        screen_and_log("*" * 50 + " END LOAD " + "*" * 50 + "\n", log_file)
+            # Loop over the devices
+            screen_and_log("\n" + "*" * 50 + " START LOAD " + "*" * 50 + "\n", log_file)
+            for device in self.selected_devices():
+                results = load_with_pyez(merge_opt, overwrite_opt, format_opt, config_file, log_file, device.ip, device.hostname, Menu.username, Menu.password, Menu.pool)
+            screen_and_log("*" * 50 + " END LOAD " + "*" * 50 + "\n", log_file)
 
-    def upgrade_device(self, ip, hostname, tar_code, reboot="askReboot"):
-        # Upgrade single device
+    def upgrade_status(self, ip):
         # Status dictionary for post-upgrade reporting
         statusDict = {}
         if Menu.upgrade_list == '':
@@ -455,29 +1105,50 @@ Rack Menu
         statusDict['IST_Confirm_Loaded'] = ''
         statusDict['IST_Confirm_Rebooted'] = ''
         statusDict['Comments'] = ''
+        statusDict['Down_Time'] = ''
+        statusDict['Up_Time'] = ''
+        statusDict['Post_Version'] = ''
+        return statusDict
 
-        # Start Logging
-        now = datetime.datetime.now()
-        date_time = now.strftime("%Y-%m-%d-%H%M")
-        install_log = Menu.log_dir + "juniper-install-LOG_" + date_time + "_" + Menu.username + ".log"
-        logging.basicConfig(filename=install_log, level=logging.INFO, format='%(asctime)s:%(name)s: %(message)s')
-        logging.getLogger().name = ip
-        print('Information logged in {0}'.format(install_log))
+    def upgrade_device(self, ip, hostname, tar_code, reboot="askReboot", ask=getYNAnswer, staged=False,
+                       installed=False, deadline=None):
+        # Upgrade single device, "ask" is used to answer the reboot question when reboot is "askReboot",
+        # "staged" installs the copy already pushed by Stage Images without transferring the image and
+        # "installed" only reboots a device whose install finished before an interrupted upgrade. The device
+        # stops before its next step once "deadline" (Menu.upgrade_timeout when None) has run out.
+        statusDict = self.upgrade_status(ip)
+        if deadline is None:
+            deadline = Deadline(Menu.upgrade_timeout)
+        deadline.start()
+
+        def timed_out():
+            # True once the device has used its time, the step it was about to start is not done
+            if not deadline.expired():
+                return False
+            statusDict['Comments'] = 'Timed out after {0} seconds'.format(deadline.seconds)
+            return True
+
+        # Every line logged by this worker is attributed to this device
+        log = device_logger(ip, hostname, 'upgrade')
+        print('Information logged in {0}'.format(Menu.log_file))
+        # Seconds spent in each phase, kept with the results in the run history
+        phases = statusDict['Phases'] = {}
+        start = time.perf_counter()
 
         # Upgrade Information
-        self.do_log("Device: {0} ({1})".format(hostname, ip))
-        self.do_log("JunOS: {0}".format(tar_code))
+        self.do_log("Device: {0} ({1})".format(hostname, ip), log=log)
+        self.do_log("JunOS: {0}".format(tar_code), log=log)
 
         # Verify package exists before starting upgrade process
         fullpathfile = Menu.image_dir + tar_code
         if os.path.isfile(fullpathfile):
-            dev = Device(ip, user=Menu.username, password=Menu.password)
-            self.do_log('\n')
-            self.do_log('------------------------- Opening connection to: {0} -------------------------\n'.format(ip))
-            self.do_log('User: {0}'.format(Menu.username))
-            # Try to open a connection to the device
+            self.do_log('\n', log=log)
+            self.do_log('------------------------- Opening connection to: {0} -------------------------\n'.format(ip), log=log)
+            self.do_log('User: {0}'.format(Menu.username), log=log)
+            # Try to open a connection to the device, or reuse the pooled one
             try:
-                dev.open()
+                with metrics.timer('upgrade', 'connect', phases):
+                    dev = Menu.pool.acquire(ip)
             # If there is an error when opening the connection, display error and exit upgrade process
             except Exception as err:
                 sys.stderr.write('Cannot connect to device {0} : {1}'.format(ip, err))
@@ -487,60 +1158,116 @@ Rack Menu
                 statusDict['Connected'] = 'Y'
                 # Increase the default RPC timeout to accommodate install operations
                 dev.timeout = 600
-                # Create an instance of SW
-                sw = SW(dev)
+                # The session is dropped from the pool if anything goes wrong or the device reboots
+                discard = True
                 try:
+                    # Create an instance of SW
+                    from jnpr.junos.utils.sw import SW
+                    sw = SW(dev)
                     # Logging...
-                    self.do_log('Starting the software upgrade process: {0}'.format(tar_code))
+                    self.do_log('Starting the software upgrade process: {0}'.format(tar_code), log=log)
                     now = datetime.datetime.now()
                     statusDict['Upgrade_Start'] = now.strftime("%Y-%m-%d %H:%M")
-                    self.do_log('Timestamp: {0}'.format(statusDict['Upgrade_Start']))
-
-                    # Actual Upgrade Function
-                    ok = sw.install(package=fullpathfile, remote_path=Menu.remote_path, progress=True, validate=True)
-                    # Failed install method...
-                    # ok = sw.install(package=fullPathFile, remote_path=Menu.remote_path, progress=self.update_progress, validate=True)
+                    self.do_log('Timestamp: {0}'.format(statusDict['Upgrade_Start']), log=log)
+
+                    # Actual Upgrade Function, copy, validate and install are done one at a time so each is timed
+                    remote_package = Menu.remote_path + "/" + tar_code
+                    if timed_out():
+                        ok = False
+                    elif installed:
+                        self.do_log('Already installed before the upgrade was interrupted: {0}'.format(tar_code),
+                                    log=log)
+                        ok = True
+                    elif staged:
+                        self.do_log('Installing staged image: {0}'.format(remote_package), log=log)
+                        ok = True
+                    else:
+                        with metrics.timer('upgrade', 'checksum', phases):
+                            checksum = self.image_checksum(fullpathfile)
+                        transfer = {}
+                        with metrics.timer('upgrade', 'copy', phases) as timing:
+                            ok = timing.ok = self.push_image(sw, ip, fullpathfile, checksum, log, stats=transfer)
+                        if transfer:
+                            statusDict['Transfer'] = transfer
+                        if not ok:
+                            self.do_log('Unable to copy {0} to the device'.format(tar_code), level='error', log=log)
+                        else:
+                            self.journal_record(ip, 'staged', deadline=deadline)
+                    if ok and not installed and timed_out():
+                        ok = False
+                    if ok and not installed:
+                        with metrics.timer('upgrade', 'validate', phases) as timing:
+                            ok = timing.ok = sw.validate(remote_package)
+                        if not ok:
+                            self.do_log('Package validation failed: {0}'.format(remote_package), level='error',
+                                        log=log)
+                    if ok and not installed and timed_out():
+                        ok = False
+                    if ok and not installed:
+                        # The install may only take the time the device has left
+                        with metrics.timer('upgrade', 'install', phases) as timing:
+                            ok = timing.ok = sw.install(package=fullpathfile, remote_path=Menu.remote_path,
+                                                        progress=self.progress(log), validate=False, no_copy=True,
+                                                        timeout=max(1, int(deadline.remaining())))
                 except Exception as err:
                     msg = 'Unable to install software, {0}'.format(err)
-                    self.do_log(msg, level='error')
+                    self.do_log(msg, level='error', log=log)
+                    # An install cut short by the deadline is reported as timed out
+                    timed_out()
                 else:
+                    discard = False
                     if ok is True:
                         # Logging...
                         statusDict['OS_installed'] = 'Y'
-                        self.do_log('Software installation complete.')
+                        self.do_log('Software installation complete.', log=log)
                         now = datetime.datetime.now()
                         statusDict['Upgrade_Finish'] = now.strftime("%Y-%m-%d %H:%M")
-                        self.do_log('Timestamp: {0}'.format(statusDict['Upgrade_Finish']))
-                        # Check rebooting status...
+                        self.do_log('Timestamp: {0}'.format(statusDict['Upgrade_Finish']), log=log)
+                        self.journal_record(ip, 'installed', statusDict, deadline=deadline)
+                        # Check rebooting status, the time waiting for the answer is not counted
                         if reboot == "askReboot":
-                            answer = getYNAnswer('Would you like to reboot')
+                            with deadline.paused():
+                                answer = ask('Would you like to reboot {0} ({1})'.format(hostname, ip))
                             if answer == 'y':
                                 reboot = "doReboot"
                             else:
                                 reboot = "noReboot"
-                        if reboot == "doReboot":
-                            rsp = sw.reboot()
+                        if reboot == "doReboot" and timed_out():
+                            self.do_log('{0}, reboot NOT performed.'.format(statusDict['Comments']), level='error',
+                                        log=log)
+                        elif reboot == "doReboot":
+                            discard = True
+                            statusDict['Reboot_Time'] = time.time()
+                            with metrics.timer('upgrade', 'reboot', phases):
+                                rsp = sw.reboot()
                             statusDict['Rebooted'] = 'Y'
-                            self.do_log('Upgrade pending reboot cycle, please be patient.')
-                            self.do_log(rsp)
-                            # Open a command terminal to monitor device connectivity
-                            # os.system("start cmd /c ping -t " + ip)
+                            self.journal_record(ip, 'rebooted', statusDict, deadline=deadline)
+                            self.do_log('Upgrade pending reboot cycle, please be patient.', log=log)
+                            self.do_log(rsp, log=log)
+                            # Device connectivity is monitored by track_reboots()
                         elif reboot == "noReboot":
-                            self.do_log('Reboot NOT performed. System must be rebooted to complete upgrade.')
+                            self.do_log('Reboot NOT performed. System must be rebooted to complete upgrade.', log=log)
+                finally:
+                    # Return the session to the pool, it is closed if the device went down
+                    Menu.pool.release(ip, discard=discard)
 
-                # End the NETCONF session and close the connection
-                dev.close()
-                self.do_log('\n')
-                self.do_log('------------------------- Closed connection to: {0} -------------------------\n'.format(ip))
+                self.do_log('\n', log=log)
+                self.do_log('------------------------- Closed connection to: {0} -------------------------\n'.format(ip), log=log)
         else:
-            msg = 'Software package does not exist: {0}. '.format(fullpathfile)
-            sys.exit(msg + '\nExiting program')
+            msg = 'Software package does not exist: {0}'.format(fullpathfile)
+            self.do_log(msg, level='error', log=log)
+            statusDict['Comments'] = msg
+
+        if statusDict['OS_installed'] != 'Y':
+            self.journal_record(ip, FAILED, statusDict, statusDict['Comments'] or 'Install did not complete',
+                                deadline)
+        metrics.observe('upgrade', 'total', time.perf_counter() - start, statusDict['OS_installed'] == 'Y')
 
         return statusDict
 
     def bulk_upgrade(self):
-        # Upgrade the devices that are currently loaded
-        devices = self.jrack.devices
+        # Upgrade the selected devices
+        devices = self.selected_devices()
 
         # List for all status dictionaries for each device
         statusList = []
@@ -555,75 +1282,437 @@ Rack Menu
         elif answer == "3": reboot = "askReboot"
 
         # Get target codes if necessary and verify those that are already defined
+        self.verify_images(devices)
+
+        # An upgrade that was interrupted can continue where it stopped
+        remaining = UpgradeJournal.unfinished(Menu.log_dir + UpgradeJournal.file_name)
+        resume = False
+        if remaining:
+            resume = Menu.resume or getTFAnswer("An interrupted upgrade has {0} devices left, resume it".format(
+                remaining))
+
+        print("\n\n----------------------")
+        print("Upgrade Specifications")
+        print("----------------------")
+        t = PrettyTable(['IP', 'Model', 'Current Code', 'Target Code', 'Staged', 'Reboot'])
+        for device in devices:
+            t.add_row([device.ip, device.model, device.curr_code, device.tar_code, device.is_staged(), reboot])
+        print(t)
+        print("Concurrent upgrades: {0} | Timeout per device: {1} seconds".format(Menu.upgrade_workers,
+                                                                                Menu.upgrade_timeout))
+        if resume:
+            print("Resuming the interrupted upgrade, finished devices are skipped")
+        # Last confirmation before entering loop
+        verified = getYNAnswer("Please Verify the information above. Continue")
+
+        # Upgrade Loop
+        # verified = 'y'
+        if verified == 'y':
+            statusList = self.run_upgrades(devices, reboot, resume)
+
+            # Follow the rebooted devices until they are back
+            self.ask_track_reboots(statusList)
+            self.report_upgrades(statusList)
+        else:
+            print("Aborted Upgrade! Returning to Main Menu.")
+
+    def run_upgrades(self, devices, reboot, resume=False):
+        # Upgrade the devices, several at a time when Menu.upgrade_workers allows it, returns the status list.
+        # Each device's progress is journaled, with "resume" the devices that got far enough are skipped.
+        metrics.reset('upgrade')
+        if Menu.scheduler:
+            Menu.scheduler.reset()
+        Menu.journal = UpgradeJournal(Menu.log_dir + UpgradeJournal.file_name, resume)
+        Menu.journal.start(devices)
+        statusList = []
+        todo = []
+        for device in devices:
+            state = Menu.journal.state(device.ip, device.tar_code)
+            statusDict = Menu.journal.status(device.ip, device.tar_code)
+            if statusDict and (state in ('verified', 'rebooted') or (state == 'installed' and reboot == 'noReboot')):
+                print("{0} is already {1}, skipping".format(device.ip, state))
+                # The reboot happened before the interruption, there is nothing left to watch
+                statusDict.pop('Reboot_Time', None)
+                statusList.append(statusDict)
+            else:
+                todo.append(device)
+        # Devices that rebooted before the interruption only need their version checked
+        self.verify_upgrades([statusDict for statusDict in statusList
+                              if Menu.journal.state(statusDict['IP']) == 'rebooted'])
+
+        if Menu.upgrade_workers > 1:
+            return statusList + self.parallel_upgrade(todo, reboot)
+        # Loop over all devices in list
+        for device in todo:
+            statusDict = self.upgrade_device(device.ip, device.hostname, device.tar_code, reboot,
+                                             **self.upgrade_flags(device))
+            # Add status results to list
+            statusList.append(statusDict)
+        return statusList
+
+    def upgrade_flags(self, device):
+        # What upgrade_device() can skip for this device: the copy when the image is staged, the install when the
+        # journal shows it was done with the same image before an interruption
+        state = Menu.journal.state(device.ip, device.tar_code) if Menu.journal else 'pending'
+        return {'staged': device.is_staged() or state == 'staged', 'installed': state == 'installed'}
+
+    def journal_record(self, ip, state, statusDict=None, comment='', deadline=None):
+        # Save a device's upgrade state, when an upgrade is being journaled. Nothing is saved once the device's
+        # deadline has run out, the journal keeps the last step it finished in time.
+        if Menu.journal is not None and (deadline is None or not deadline.expired()):
+            Menu.journal.record(ip, state, status=statusDict, comment=comment)
+
+    def journal_verified(self, statusDict):
+        # An upgraded device is verified once it runs the version of its target image after its reboot, the
+        # versions are compared as Junos versions
+        if Menu.journal is None:
+            return
+        ip = statusDict['IP']
+        tar_code = Menu.journal.devices.get(ip, {}).get('tar_code') or ''
+        version = statusDict['Post_Version']
+        if compliance(version, tar_code) == 'Compliant':
+            self.journal_record(ip, 'verified', statusDict)
+        else:
+            self.journal_record(ip, FAILED, statusDict, 'Running {0} after the reboot, the target is {1}'.format(
+                version, image_version(tar_code) or tar_code))
+
+    def verify_upgrades(self, statusList):
+        # Read the running version of devices already rebooted, and mark them verified (or failed)
+        if not statusList:
+            return
+        with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+            futures = dict((executor.submit(self.refresh_version, statusDict['IP']), statusDict)
+                           for statusDict in statusList)
+            for future in as_completed(futures):
+                statusDict = futures[future]
+                try:
+                    statusDict['Post_Version'] = future.result()[0]
+                except Exception as err:
+                    print("Unable to read the version of {0} ERROR: {1}".format(statusDict['IP'], err))
+                    continue
+                self.journal_verified(statusDict)
+
+    def report_upgrades(self, statusList):
+        # Save the upgrade results to the status log and display a summary, returns the tabulated results
+        '''
+        # StatusList Test
+        statusList = [
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 09:25',  'Upgrade_Finish': '7/26/2016 09:39', 'IP': '10.10.10.1', 'Connected': 'Y', 'OS_installed': 'Y', 'Rebooted': 'Y'},
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 09:40',  'Upgrade_Finish': '7/26/2016 09:54', 'IP': '10.10.10.2', 'Connected': 'Y', 'OS_installed': 'Y', 'Rebooted': 'N'},
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 09:55',  'Upgrade_Finish': '7/26/2016 10:10', 'IP': '10.10.10.3', 'Connected': 'Y', 'OS_installed': 'N', 'Rebooted': 'N'},
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 10:15',  'Upgrade_Finish': '7/26/2016 10:25', 'IP': '10.10.10.4', 'Connected': 'N', 'OS_installed': 'N', 'Rebooted': 'N'}
+        ]
+        '''
+        # Save to the run history and the status CSV
+        self.save_run('upgrade', statusList)
+
+        # Tabulate and Print Results
+        resultsDict = tabulateUpgradeResults(statusList)
+        print("\n\n---------------")
+        print("Process Summary")
+        print("---------------")
+        print("Successful (rebooted): {0}".format(len(resultsDict['success_rebooted'])))
+        print("Successful (not rebooted): {0}".format(len(resultsDict['success_not_rebooted'])))
+        print("Unable to connect: {0}".format(len(resultsDict['connect_fails'])))
+        for myfailed in resultsDict['connect_fails']:
+            print("\t{0}".format(myfailed))
+        print("Software install failed: {0}".format(len(resultsDict['software_install_fails'])))
+        for myfailed in resultsDict['software_install_fails']:
+            print("\t{0}".format(myfailed))
+        print("\nTOTAL DEVICES: {0}".format(resultsDict['total_devices']))
+        print("---------------")
+        self.report_transfers()
+        self.export_metrics('upgrade')
+        # Every device got as far as it will in this run, there is nothing left to resume
+        if Menu.journal is not None:
+            Menu.journal.finish()
+            Menu.journal.close()
+            Menu.journal = None
+        return resultsDict
+
+    def verify_images(self, devices, ask=True):
+        # Get target codes if necessary and verify those that are already defined. Without "ask", devices
+        # without a valid image are left out. Returns the devices with a valid image.
         print("\n\n--------------------")
         print("Verifying Images")
         print("--------------------\n")
+        valid = []
+        # Each image is looked for once, however many devices use it
+        found = {}
+
+        def image_found(tar_code):
+            if tar_code not in found:
+                found[tar_code] = isfile(Menu.image_dir + tar_code)
+            return found[tar_code]
+
         for device in devices:
             if device.tar_code == None:
                 # No code defined, ask for one...
                 print("{0} does not have an image, please select one...".format(device.ip))
-                device.tar_code = getCode(device, Menu.image_dir)
+                if ask:
+                    device.tar_code = getCode(device, Menu.image_dir)
             else:
                 # Make sure file exists. If not, ask for one...
-                if not isfile(Menu.image_dir + device.tar_code):
+                if not image_found(device.tar_code):
                     print("Unable to find file: {0} ".format(device.tar_code))
-                    device.tar_code = getCode(device, Menu.image_dir)
+                    if ask:
+                        device.tar_code = getCode(device, Menu.image_dir)
                 else:
                     print("{0} has a valid image".format(device.ip))
-
-        print("\n\n----------------------")
-        print("Upgrade Specifications")
-        print("----------------------")
-        t = PrettyTable(['IP', 'Model', 'Current Code', 'Target Code', 'Reboot'])
-        for device in devices:
-            t.add_row([device.ip, device.model, device.curr_code, device.tar_code, reboot])
+            if device.tar_code and image_found(device.tar_code):
+                valid.append(device)
+        self.jrack.save_devices(devices)
+        return valid
+
+    def stage_device(self, ip, hostname, tar_code, checksum):
+        """ Purpose: Push a device's target image to Menu.remote_path ahead of the upgrade. The copy is skipped
+                     when a file with the same size and checksum is already on the device.
+            Parameters:
+                ip          -   String containing the IP of the device
+                hostname    -   The device host-name for output purposes
+                tar_code    -   Image file name in Menu.image_dir
+                checksum    -   Local checksum of the image, using Menu.checksum_algorithm
+            Returns:
+                Dictionary with the 'Result' ('Staged', 'Already Staged' or 'Failed') and 'Comments'
+        """
+        result = {'IP': ip, 'Host': hostname, 'Image': tar_code, 'Result': 'Failed', 'Comments': ''}
+        fullpathfile = Menu.image_dir + tar_code
+        remote_file = Menu.remote_path + "/" + tar_code
+        try:
+            with metrics.timer('stage', 'connect'):
+                dev = Menu.pool.acquire(ip)
+        except Exception as err:
+            result['Comments'] = 'Cannot connect to device: {0}'.format(err)
+            return result
+        dev.timeout = 600
+        discard = False
+        try:
+            from jnpr.junos.utils.sw import SW
+            sw = SW(dev)
+            # Only compute the remote checksum when the sizes match, it is much slower than the size check
+            with metrics.timer('stage', 'check'):
+                staged = remote_file_size(dev, remote_file) == os.path.getsize(fullpathfile) and \
+                    sw.remote_checksum(remote_file, algorithm=Menu.checksum_algorithm) == checksum
+            if staged:
+                result['Result'] = 'Already Staged'
+            else:
+                transfer = {}
+                with metrics.timer('stage', 'copy') as timing:
+                    timing.ok = self.push_image(sw, ip, fullpathfile, checksum, device_logger(ip, hostname, 'stage'),
+                                                force_copy=True, stats=transfer)
+                if transfer:
+                    result['Transfer'] = transfer
+                if timing.ok:
+                    result['Result'] = 'Staged'
+                else:
+                    result['Comments'] = 'Copy or checksum verification failed'
+        except Exception as err:
+            result['Comments'] = 'Unable to stage image: {0}'.format(err)
+            discard = True
+        finally:
+            Menu.pool.release(ip, discard=discard)
+        return result
+
+    def push_image(self, sw, ip, fullpathfile, checksum, log, force_copy=False, stats=None):
+        # Copy an image to Menu.remote_path and verify its checksum, returns True when the device has it. With the
+        # transfer scheduler the copy is resumable and throttled to the budget, and its statistics are added to
+        # "stats". Otherwise PyEZ copies it at full speed.
+        if Menu.scheduler is None:
+            return sw.safe_copy(fullpathfile, remote_path=Menu.remote_path, progress=self.progress(log),
+                                checksum=checksum, checksum_algorithm=Menu.checksum_algorithm, force_copy=force_copy)
+        remote_file = Menu.remote_path + "/" + os.path.basename(fullpathfile)
+        if not force_copy and sw.remote_checksum(remote_file, algorithm=Menu.checksum_algorithm) == checksum:
+            self.do_log('Image already on the device: {0}'.format(remote_file), log=log)
+            return True
+        device = self.jrack.get_device(ip)
+        blocks = Menu.checksums.blocks(fullpathfile, Menu.scheduler.block_size, Menu.checksum_algorithm)
+        transfer = Menu.scheduler.push(ip, device.site if device else '', fullpathfile, remote_file, Menu.username,
+                                       Menu.password, checksum=checksum, blocks=blocks,
+                                       algorithm=Menu.checksum_algorithm,
+                                       remote_checksum=lambda: sw.remote_checksum(remote_file,
+                                                                                  algorithm=Menu.checksum_algorithm),
+                                       progress=lambda message: self.do_log(message, log=log))
+        self.do_log('Sent {0:.1f} MB in {1:.1f} seconds, {2:.2f} Mbit/s ({3:.1f} seconds waiting for '
+                    'bandwidth)'.format(transfer.sent / 1048576.0, transfer.seconds(), transfer.throughput(),
+                                        transfer.waited), log=log)
+        if transfer.resumed or transfer.repaired or transfer.attempts > 1:
+            self.do_log('Resumed after {0} bytes, {1} connections, {2} blocks repaired'.format(
+                transfer.resumed, transfer.attempts, transfer.repaired), log=log)
+        if stats is not None:
+            stats.update(transfer.stats())
+        if not transfer.ok:
+            self.do_log(transfer.error, level='error', log=log)
+        return transfer.ok
+
+    def image_checksum(self, fullpathfile):
+        # Checksum of a local image, with the transfer scheduler the block checksums are computed in the same pass
+        if Menu.scheduler is not None:
+            Menu.checksums.blocks(fullpathfile, Menu.scheduler.block_size, Menu.checksum_algorithm)
+        return Menu.checksums.get(fullpathfile, Menu.checksum_algorithm)
+
+    def start_transfers(self):
+        # Copy images through the transfer scheduler when a global or site limit is set, or SFTP is asked for
+        if Menu.sftp or Menu.bandwidth or Menu.site_bandwidth:
+            Menu.scheduler = TransferScheduler(Menu.bandwidth * MBIT, Menu.site_bandwidth)
+
+    def report_transfers(self):
+        # Show the effective throughput of the image copies of the last run, by site
+        if Menu.scheduler is None:
+            return
+        summary = Menu.scheduler.summary()
+        if not summary:
+            return
+        print("\nImage transfers (budget: {0}):".format("{0} Mbit/s".format(Menu.bandwidth) if Menu.bandwidth
+                                                     else "none"))
+        t = PrettyTable(['Site', 'Devices', 'Failed', 'MB', 'Seconds', 'Mbit/s', 'Cap (Mbit/s)'])
+        for site in sorted(site for site in summary if site != 'TOTAL') + ['TOTAL']:
+            stats = summary[site]
+            cap = Menu.site_bandwidth.get(site, Menu.site_bandwidth.get('*')) if site != 'TOTAL' else None
+            t.add_row([site, stats['devices'], stats['failed'], round(stats['bytes'] / 1048576.0, 1),
+                       stats['seconds'], stats['mbps'], round(cap / MBIT, 2) if cap else '-'])
         print(t)
-        # Last confirmation before entering loop
-        verified = getYNAnswer("Please Verify the information above. Continue")
 
-        # Upgrade Loop
-        # verified = 'y'
-        if verified == 'y':
+        # Every transfer is recorded, the ones that had to resume, were repaired or failed are shown
+        records = [transfer.stats() for transfer in Menu.scheduler.transfers.values()]
+        troubled = [record for record in records
+                    if record['Attempts'] > 1 or record['Resumed'] or record['Repaired_Blocks'] or
+                    record['Verified'] != 'Y']
+        if troubled:
+            t = PrettyTable(['IP', 'Site', 'Resumed (MB)', 'Connections', 'Repaired Blocks', 'Verified', 'Mbit/s',
+                             'Error'])
+            for record in troubled:
+                t.add_row([record['IP'], record['Site'], round(record['Resumed'] / 1048576.0, 1),
+                           record['Attempts'], record['Repaired_Blocks'], record['Verified'], record['Mbps'],
+                           record['Error']])
+            print(t)
+        transfer_log = listDictCSV(records, Menu.log_dir + "transfers.csv", TRANSFER_KEYS)
+        print("Transfer statistics written to {0}".format(transfer_log))
+
+    def stage_images(self):
+        # Copy the target images to the devices in parallel, so the upgrade does not have to transfer them
+        self.run_staging(self.verify_images(self.selected_devices()))
+
+    def run_staging(self, devices):
+        # Stage the target image of each device, returns the result of each device
+        if not devices:
+            print("No devices with a target image to stage.")
+            return []
+
+        metrics.reset('stage')
+        if Menu.scheduler:
+            Menu.scheduler.reset()
+        # Look up each image checksum once instead of once per device
+        checksums = {}
+        for tar_code in self.jrack.group_by('tar_code', devices=devices):
+            print("Checksum of {0}...".format(tar_code))
+            checksums[tar_code] = self.image_checksum(Menu.image_dir + tar_code)
 
-            # Loop over all devices in list
+        print("\n\n--------------------")
+        print("Staging Images")
+        print("--------------------\n")
+        results = []
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+            futures = {}
             for device in devices:
-                statusDict = self.upgrade_device(device.ip, device.hostname, device.tar_code, reboot)
-                # Add status results to list
+                future = executor.submit(self.stage_device, device.ip, device.hostname, device.tar_code,
+                                         checksums[device.tar_code])
+                futures[future] = device
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    result = future.result()
+                except Exception as err:
+                    result = {'IP': device.ip, 'Host': device.hostname, 'Image': device.tar_code, 'Result': 'Failed',
+                              'Comments': 'Staging worker failed: {0}'.format(err)}
+                if result['Result'] != 'Failed':
+                    device.staged_code = device.tar_code
+                print("{0}: {1} {2}".format(device.ip, result['Result'], result['Comments']))
+                results.append(result)
+        elapsed = time.time() - start
+        self.jrack.save_devices(devices)
+
+        t = PrettyTable(['IP', 'Host', 'Image', 'Result', 'Comments'])
+        for result in results:
+            t.add_row([result['IP'], result['Host'], result['Image'], result['Result'], result['Comments']])
+        print(t)
+        print("Elapsed: {0:.1f} seconds".format(elapsed))
+        self.report_transfers()
+        self.export_metrics('stage')
+        return results
+
+    def parallel_upgrade(self, devices, reboot):
+        """ Purpose: Upgrade several devices at the same time, up to Menu.upgrade_workers. Reboot questions from
+                     the workers are queued and answered here, one at a time, while the other devices keep
+                     installing. A device running longer than Menu.upgrade_timeout (not counting the time its reboot
+                     question waits) stops before its next step and is reported as timed out. Every worker has
+                     stopped when this returns, so nothing is done to a device or journaled after the report.
+            Parameters:
+                devices     -   List of JDevice objects to upgrade
+                reboot      -   Reboot preference: "doReboot", "noReboot" or "askReboot"
+            Returns:
+                List of status dictionaries, one per device
+        """
+        statusList = []
+        prompts = queue.Queue()
+        deadlines = {}
+
+        def ask(question):
+            # Hand the question to the main thread and wait for the answer
+            request = {'question': question, 'answer': 'n', 'event': threading.Event()}
+            prompts.put(request)
+            if not request['event'].wait(Menu.upgrade_timeout):
+                self.do_log('No answer for "{0}", not rebooting.'.format(question))
+            return request['answer']
+
+        def worker(device):
+            return self.upgrade_device(device.ip, device.hostname, device.tar_code, reboot, ask,
+                                       deadline=deadlines[device.ip], **self.upgrade_flags(device))
+
+        executor = ThreadPoolExecutor(max_workers=Menu.upgrade_workers)
+        pending = {}
+        for device in devices:
+            deadlines[device.ip] = Deadline(Menu.upgrade_timeout)
+            pending[executor.submit(worker, device)] = device
+
+        while pending:
+            # Answer one queued reboot question, this also paces the loop
+            try:
+                request = prompts.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            else:
+                request['answer'] = getYNAnswer(request['question'])
+                request['event'].set()
+
+            # Collect the finished devices
+            for future in [f for f in pending if f.done()]:
+                device = pending.pop(future)
+                try:
+                    statusDict = future.result()
+                except Exception as err:
+                    statusDict = self.upgrade_status(device.ip)
+                    statusDict['Comments'] = 'Upgrade worker failed: {0}'.format(err)
+                    self.do_log(statusDict['Comments'], level='error', log=device_logger(device.ip, device.hostname,
+                                                                                         'upgrade'))
                 statusList.append(statusDict)
-            '''
-            # StatusList Test
-            statusList = [
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 09:25',  'Upgrade_Finish': '7/26/2016 09:39', 'IP': '10.10.10.1', 'Connected': 'Y', 'OS_installed': 'Y', 'Rebooted': 'Y'},
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 09:40',  'Upgrade_Finish': '7/26/2016 09:54', 'IP': '10.10.10.2', 'Connected': 'Y', 'OS_installed': 'Y', 'Rebooted': 'N'},
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 09:55',  'Upgrade_Finish': '7/26/2016 10:10', 'IP': '10.10.10.3', 'Connected': 'Y', 'OS_installed': 'N', 'Rebooted': 'N'},
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '7/26/2016 10:15',  'Upgrade_Finish': '7/26/2016 10:25', 'IP': '10.10.10.4', 'Connected': 'N', 'OS_installed': 'N', 'Rebooted': 'N'}
-            ]
-            '''
-            # Create CSV
-            keys = ['Upgrade_List', 'Upgrade_Start', 'Upgrade_Finish', 'IP', 'Connected', 'OS_installed', 'Rebooted']
-            listDictCSV(statusList, Menu.status_log, keys)
-
-            # Tabulate and Print Results
-            resultsDict = tabulateUpgradeResults(statusList)
-            print("\n\n---------------")
-            print("Process Summary")
-            print("---------------")
-            print("Successful (rebooted): {0}".format(len(resultsDict['success_rebooted'])))
-            print("Successful (not rebooted): {0}".format(len(resultsDict['success_not_rebooted'])))
-            print("Unable to connect: {0}".format(len(resultsDict['connect_fails'])))
-            for myfailed in resultsDict['connect_fails']:
-                print("\t{0}".format(myfailed))
-            print("Software install failed: {0}".format(len(resultsDict['software_install_fails'])))
-            for myfailed in resultsDict['software_install_fails']:
-                print("\t{0}".format(myfailed))
-            print("\nTOTAL DEVICES: {0}".format(resultsDict['total_devices']))
-            print("---------------")
-        else:
-            print("Aborted Upgrade! Returning to Main Menu.")
+                print("Finished {0} ({1}/{2})".format(device.ip, len(statusList), len(devices)))
+
+            # Devices past their timeout are cancelled, their workers stop before the next step and are collected
+            # above like the others
+            for device in pending.values():
+                deadline = deadlines[device.ip]
+                if deadline.expired() and not deadline.cancelled.is_set():
+                    deadline.cancel()
+                    self.do_log('Timed out after {0} seconds, stopping after the current step'.format(
+                        Menu.upgrade_timeout), level='error', log=device_logger(device.ip, device.hostname, 'upgrade'))
+
+        executor.shutdown()
+        return statusList
 
     def bulk_reboot(self):
         # Reboots the selected devices
-        devices = self.jrack.devices
+        devices = self.selected_devices()
 
         # List for all status dictionaries for each device
         statusList = []
@@ -642,51 +1731,134 @@ Rack Menu
         # Upgrade Loop
         # verified = 'y'
         if verified == 'y':
-            # Loop over all devices in list
-            print("\n\n--------------------")
-            print("Rebooting Devices")
-            print("--------------------\n")
-            for device in devices:
+            statusList = self.run_reboots(devices)
+
+            # Follow the rebooted devices until they are back
+            self.ask_track_reboots(statusList)
+            self.report_reboots(statusList)
+        else:
+            print("Aborted Upgrade! Returning to Main Menu.")
+
+    def run_reboots(self, devices):
+        # Reboot the devices, several at a time, returns the status list in rack order
+        metrics.reset('reboot')
+        statusList = []
+        print("\n\n--------------------")
+        print("Rebooting Devices")
+        print("--------------------\n")
+        with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+            futures = [executor.submit(self.reboot_device, device.ip, device.hostname) for device in devices]
+            for future in futures:
                 try:
-                    statusDict = self.reboot_device(device.ip, device.hostname)
+                    statusDict = future.result()
                 except Exception as err:
                     msg = 'Reboot function failed, {0}'.format(err)
                     self.do_log(msg, level='error')
                 else:
                     # Add status results to list
                     statusList.append(statusDict)
-                    # Open a command terminal to monitor device connectivity
-                    # os.system("start cmd /c ping -t " + device.ip)
-            '''
-            # Test Dictionary List
-            statusList = [
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.1', 'Connected': 'Y', 'OS_installed': '-', 'Rebooted': 'Y', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''},
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.2', 'Connected': 'Y', 'OS_installed': '-', 'Rebooted': 'Y', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''},
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.3', 'Connected': 'Y', 'OS_installed': '-', 'Rebooted': 'N', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''},
-                {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.4', 'Connected': 'N', 'OS_installed': '-', 'Rebooted': 'N', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''}
-            ]
-            '''
-            # Create CSV
-            keys = [ 'Upgrade_List', 'Upgrade_Start', 'Upgrade_Finish', 'IP', 'Connected', 'OS_installed', 'Rebooted', 'IST_Confirm_Loaded', 'IST_Confirm_Rebooted', 'Comments' ]
-            listDictCSV(statusList, Menu.status_log, keys)
-
-            # Tabulate and Print Results
-            resultsDict = tabulateRebootResults(statusList)
-            print("\n\n---------------")
-            print("Process Summary")
-            print("---------------")
-            print("Rebooted: {0}".format(len(resultsDict['rebooted'])))
-            print("Reboot Failed: {0}".format(len(resultsDict['not_rebooted'])))
-            for myfailed in resultsDict['not_rebooted']:
-                print("\t{0}".format(myfailed))
-            print("Unable to connect: {0}".format(len(resultsDict['connect_fails'])))
-            for myfailed in resultsDict['connect_fails']:
-                print("\t{0}".format(myfailed))
-
-            print("\nTOTAL DEVICES: {0}").format(resultsDict['total_devices'])
-            print("---------------")
+        return statusList
+
+    def report_reboots(self, statusList):
+        # Save the reboot results to the status log and display a summary, returns the tabulated results
+        '''
+        # Test Dictionary List
+        statusList = [
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.1', 'Connected': 'Y', 'OS_installed': '-', 'Rebooted': 'Y', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''},
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.2', 'Connected': 'Y', 'OS_installed': '-', 'Rebooted': 'Y', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''},
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.3', 'Connected': 'Y', 'OS_installed': '-', 'Rebooted': 'N', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''},
+            {'Upgrade_List': 'Juniper-Upgrade_aabcct3.csv', 'Upgrade_Start': '-',  'Upgrade_Finish': '-', 'IP': '10.10.10.4', 'Connected': 'N', 'OS_installed': '-', 'Rebooted': 'N', 'IST_Confirm_Loaded': '', 'IST_Confirm_Rebooted': '', 'Comments': ''}
+        ]
+        '''
+        # Save to the run history and the status CSV
+        self.save_run('reboot', statusList)
+
+        # Tabulate and Print Results
+        resultsDict = tabulateRebootResults(statusList)
+        print("\n\n---------------")
+        print("Process Summary")
+        print("---------------")
+        print("Rebooted: {0}".format(len(resultsDict['rebooted'])))
+        print("Reboot Failed: {0}".format(len(resultsDict['not_rebooted'])))
+        for myfailed in resultsDict['not_rebooted']:
+            print("\t{0}".format(myfailed))
+        print("Unable to connect: {0}".format(len(resultsDict['connect_fails'])))
+        for myfailed in resultsDict['connect_fails']:
+            print("\t{0}".format(myfailed))
+
+        print("\nTOTAL DEVICES: {0}".format(resultsDict['total_devices']))
+        print("---------------")
+        self.export_metrics('reboot')
+        return resultsDict
+
+    def save_run(self, operation, statusList):
+        # Record the results of a run in the history, and append them to the status CSV for IST confirmation
+        run_id = Menu.history.new_run_id(operation)
+        Menu.history.record_run(run_id, operation, statusList)
+        listDictCSV(Menu.history.run_records(run_id), Menu.status_log, STATUS_KEYS)
+        print("Run ID: {0}".format(run_id))
+        return run_id
+
+    def compliance_report(self):
+        # Compare the running version of the selected devices with the version of their target image, by model and
+        # version, and optionally export the report to CSV and JSON
+        start = time.time()
+        report = fleet_compliance(self.jrack, self.selected_devices())
+        elapsed = time.time() - start
+
+        print("\n\n---------------")
+        print("Compliance Report")
+        print("---------------")
+        t = PrettyTable(COMPLIANCE_KEYS)
+        for group in report['Groups']:
+            t.add_row([group[key] for key in COMPLIANCE_KEYS])
+        print(t)
+        totals = report['Totals']
+        for state in ('Compliant', 'Behind', 'Ahead', 'Unknown'):
+            share = 100.0 * totals[state] / report['Devices'] if report['Devices'] else 0.0
+            print("{0}: {1} ({2:.1f}%)".format(state, totals[state], share))
+        print("Devices: {0} ({1:.0f} ms)".format(report['Devices'], elapsed * 1000))
+        print("-----------------")
+        if report['Devices'] and getTFAnswer('Export the report'):
+            base_file = Menu.log_dir + "compliance_" + datetime.datetime.now().strftime("%Y%m%d-%H%M")
+            for report_file in export_compliance(report, base_file):
+                print("Report written to: {0}".format(report_file))
+
+    def run_history(self):
+        # Query the results of earlier runs
+        myoptions = ['Last upgrade result of the loaded devices', 'Last reboot result of the loaded devices',
+                     'Results of a run']
+        answer = getOptionAnswerIndex("Which results would you like to see", myoptions)
+        start = time.time()
+        if answer in ("1", "2"):
+            operation = 'upgrade' if answer == "1" else 'reboot'
+            ips = [device.ip for device in self.jrack.devices]
+            outcomes = Menu.history.last_outcomes(ips, operation)
+            records = [outcomes[ip] for ip in ips if ip in outcomes]
+            name = "last_" + operation
+            print("{0} of {1} devices have an {2} result ({3:.0f} ms)".format(len(records), len(ips), operation,
+                                                                              (time.time() - start) * 1000))
         else:
-            print("Aborted Upgrade! Returning to Main Menu.")
+            runs = Menu.history.runs()
+            if not runs:
+                print("No runs recorded yet.")
+                return
+            myoptions = ["{0} ({1} devices)".format(run_id, devices) for run_id, operation, date, devices in runs]
+            run_id = runs[int(getOptionAnswerIndex("Choose a run", myoptions)) - 1][0]
+            records = Menu.history.run_records(run_id)
+            name = run_id
+
+        t = PrettyTable(['IP', 'Run ID', 'Date', 'Connected', 'Installed', 'Rebooted', 'Up After', 'Post Version',
+                         'Comments'])
+        for record in records:
+            t.add_row([record['IP'], record['Run_ID'], record['Date'], record['Connected'], record['OS_installed'],
+                       record['Rebooted'], record.get('Up_Time', ''), record.get('Post_Version', ''),
+                       record['Comments']])
+        print(t)
+        if records and getTFAnswer('Export these results to CSV'):
+            csv_file = Menu.log_dir + "history_" + name + ".csv"
+            export_csv(records, csv_file)
+            print("Results written to {0}".format(csv_file))
 
     def reboot_device(self, ip, hostname):
         # Reboots a device
@@ -705,29 +1877,28 @@ Rack Menu
         statusDict['IST_Confirm_Loaded'] = '-'
         statusDict['IST_Confirm_Rebooted'] = ''
         statusDict['Comments'] = ''
+        statusDict['Down_Time'] = ''
+        statusDict['Up_Time'] = ''
+        statusDict['Post_Version'] = ''
 
-        # Start the logging
-        now = datetime.datetime.now()
-        date_time = now.strftime("%Y-%m-%d-%H%M")
-        reboot_log = Menu.log_dir + "juniper-reboot-LOG_" + date_time + "_" + Menu.username + ".log"
-        logging.basicConfig(filename=reboot_log, level=logging.INFO, format='%(asctime)s:%(name)s: %(message)s')
-        logging.getLogger().name = ip
-        print('Information logged in {0}'.format(reboot_log))
+        # Every line logged by this worker is attributed to this device
+        log = device_logger(ip, hostname, 'reboot')
+        print('Information logged in {0}'.format(Menu.log_file))
+        phases = statusDict['Phases'] = {}
 
         # Display basic information
-        self.do_log("Device: {0} ({1})".format(hostname, ip))
+        self.do_log("Device: {0} ({1})".format(hostname, ip), log=log)
         now = datetime.datetime.now()
         formattime = now.strftime("%Y-%m-%d %H:%M")
-        self.do_log("Timestamp: {0}".format(formattime))
+        self.do_log("Timestamp: {0}".format(formattime), log=log)
 
-        # Verify package exists before starting upgrade process
-        dev = Device(ip, user=Menu.username, password=Menu.password)
-        # Try to open a connection to the device
+        # Try to open a connection to the device, or reuse the pooled one
         try:
-            self.do_log('\n')
-            self.do_log('------------------------- Opening connection to: {0} -------------------------\n'.format(ip))
-            self.do_log('User: {0}'.format(Menu.username))
-            dev.open()
+            self.do_log('\n', log=log)
+            self.do_log('------------------------- Opening connection to: {0} -------------------------\n'.format(ip), log=log)
+            self.do_log('User: {0}'.format(Menu.username), log=log)
+            with metrics.timer('reboot', 'connect', phases):
+                dev = Menu.pool.acquire(ip)
         # If there is an error when opening the connection, display error and exit upgrade process
         except Exception as err:
             sys.stderr.write('Cannot connect to device: {0}\n'.format(err))
@@ -737,46 +1908,237 @@ Rack Menu
 
             # Increase the default RPC timeout to accommodate install operations
             dev.timeout = 600
-            # Create an instance of SW
-            sw = SW(dev)
 
             # Logging
             now = datetime.datetime.now()
             statusDict['Upgrade_Start'] = now.strftime("%Y-%m-%d %H:%M")
-            self.do_log('Timestamp: {0}'.format(statusDict['Upgrade_Start']))
-            self.do_log('Beginning reboot cycle, please be patient.')
+            self.do_log('Timestamp: {0}'.format(statusDict['Upgrade_Start']), log=log)
+            self.do_log('Beginning reboot cycle, please be patient.', log=log)
 
             # Attempt to reboot
             try:
-                rsp = sw.reboot()
-                self.do_log(rsp)
+                # Create an instance of SW
+                from jnpr.junos.utils.sw import SW
+                sw = SW(dev)
+                statusDict['Reboot_Time'] = time.time()
+                with metrics.timer('reboot', 'reboot', phases):
+                    rsp = sw.reboot()
+                self.do_log(rsp, log=log)
             except Exception as err:
                 msg = 'Unable to reboot system, {0}'.format(err)
-                self.do_log(msg, level='error')
+                self.do_log(msg, level='error', log=log)
             else:
                 # Record reboot
                 statusDict['Rebooted'] = 'Y'
 
-            # End the NETCONF session and close the connection
-            dev.close()
-            self.do_log('\n')
-            self.do_log('------------------------- Closed connection to: {0} -------------------------\n'.format(ip))
+            # The device is going down, so the session is closed instead of going back to the pool
+            Menu.pool.release(ip, discard=True)
+            self.do_log('\n', log=log)
+            self.do_log('------------------------- Closed connection to: {0} -------------------------\n'.format(ip), log=log)
 
         return statusDict
 
-    def do_log(self, msg, level='info'):
-        getattr(logging, level)(msg)
+    def ask_track_reboots(self, statusList):
+        # Offer to follow the rebooted devices until they are back
+        if [statusDict for statusDict in statusList if statusDict['Rebooted'] == 'Y'] and \
+                getTFAnswer('Monitor the rebooted devices until they are back up'):
+            self.track_reboots(statusList)
+
+    def track_reboots(self, statusList):
+        """ Purpose: Probe every rebooted device at the same time until it has gone down and come back up, then
+                     read the version it is running. The times and version are added to each status dictionary.
+            Parameters:
+                statusList  -   Status dictionaries from upgrade_device() or reboot_device()
+        """
+        targets = {}
+        # Reboot times are timed as phases of the operation that rebooted the device
+        operations = {}
+        for statusDict in statusList:
+            if statusDict['Rebooted'] == 'Y' and 'Reboot_Time' in statusDict:
+                targets[statusDict['IP']] = statusDict['Reboot_Time']
+                operations[statusDict['IP']] = 'reboot' if statusDict['OS_installed'] == '-' else 'upgrade'
+
+        if not targets:
+            return
+
+        print("\n\n--------------------")
+        print("Monitoring Reboots")
+        print("--------------------\n")
+        print("Waiting up to {0} seconds for {1} devices to return...".format(Menu.watch_timeout, len(targets)))
+
+        def progress(done, total):
+            print("{0}/{1} devices finished".format(done, total))
+
+        # asyncio is only loaded when there are reboots to watch
+        from jwatch import watch_reboots
+        results = watch_reboots(targets, port=Menu.watch_port, interval=Menu.watch_interval,
+                                down_grace=Menu.watch_down_grace, up_timeout=Menu.watch_timeout, progress=progress)
+
+        # Read the running version of the devices that came back
+        versions = {}
+        with ThreadPoolExecutor(max_workers=Menu.max_workers) as executor:
+            futures = {}
+            for ip, result in results.items():
+                if result['up'] is not None or result['never_down']:
+                    futures[executor.submit(self.post_reboot_version, ip, operations[ip])] = ip
+            for future in as_completed(futures):
+                try:
+                    versions[futures[future]] = future.result()
+                except Exception as err:
+                    self.do_log('Unable to read version after reboot, {0}'.format(err), level='error',
+                                log=device_logger(futures[future], operation='reboot'))
+
+        changed = []
+        for statusDict in statusList:
+            ip = statusDict['IP']
+            if ip not in results:
+                continue
+            result = results[ip]
+            if result['never_down']:
+                # Still answering, there is no time to report for coming back
+                statusDict['Down_Time'] = 'Never went down'
+                statusDict['Up_Time'] = ''
+            else:
+                statusDict['Down_Time'] = '-' if result['down'] is None else int(result['down'])
+                statusDict['Up_Time'] = 'Not up' if result['up'] is None else int(result['up'])
+                if result['down'] is not None:
+                    metrics.observe(operations[ip], 'down', result['down'])
+                metrics.observe(operations[ip], 'up', result['up'] or Menu.watch_timeout, result['up'] is not None)
+            statusDict['Post_Version'] = versions.get(ip, '')
+            device = self.jrack.get_device(ip)
+            if ip in versions and operations[ip] == 'upgrade':
+                self.journal_verified(statusDict)
+            if device and ip in versions:
+                device.refresh(versions[ip])
+                changed.append(device)
+            if result['never_down']:
+                print("{0}: never went down, running {1}".format(ip, statusDict['Post_Version'] or '?'))
+            else:
+                print("{0}: down after {1}s, up after {2}s, running {3}".format(ip, statusDict['Down_Time'],
+                                                                              statusDict['Up_Time'],
+                                                                              statusDict['Post_Version'] or '?'))
+        self.jrack.save_devices(changed)
+
+    def post_reboot_version(self, ip, operation='reboot', attempts=6, delay=20):
+        # NETCONF may take a little longer than the port to be ready after a reboot, so try a few times
+        with metrics.timer(operation, 'verify'):
+            for attempt in range(attempts):
+                try:
+                    return self.refresh_version(ip)[0]
+                except Exception:
+                    if attempt == attempts - 1:
+                        raise
+                    time.sleep(delay)
+
+    def export_metrics(self, operation):
+        # Write the phase timings of a run for Prometheus and as JSON, and show where the time went
+        metrics_dir = Menu.metrics_dir or Menu.log_dir
+        date_time = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        json_file = join(metrics_dir, "metrics_" + operation + "_" + date_time + ".json")
+        try:
+            metrics.export(operation, join(metrics_dir, "jscan.prom"), json_file)
+        except (IOError, OSError) as err:
+            print("Unable to write metrics ERROR: {0}".format(err))
+            json_file = None
+        phases = metrics.summary(operation).get(operation, {})
+        if not phases:
+            return
+        print("\nTime by phase ({0}):".format(operation))
+        t = PrettyTable(['Phase', 'Devices', 'Failed', 'Total (s)', 'Mean (s)', 'p50 (s)', 'p95 (s)', 'Max (s)'])
+        for phase, stats in sorted(phases.items(), key=lambda item: -item[1]['total']):
+            t.add_row([phase, stats['count'], stats['failures'], stats['total'], stats['mean'], stats['p50'],
+                       stats['p95'], stats['max']])
+        print(t)
+        if json_file:
+            print("Metrics written to {0}".format(json_file))
+
+    def do_log(self, msg, level='info', log=None):
+        # Queue the message for the log writer, "log" is the device logger of the worker calling
+        getattr(log or logger, level)(msg)
         print("--> " + msg)
 
-    def update_progress(self, report):
-        # log the progress of the installing process
-        print("--> " + report)
-        self.do_log(report)
+    def progress(self, log):
+        # Returns a PyEZ progress function that logs the install progress against the device
+        def update_progress(dev, report):
+            self.do_log(report, log=log)
+        return update_progress
+
+    def start_log(self):
+        # Start the log writer, one log file (plus the optional JSON and per-device logs) for the whole session
+        date_time = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
+        Menu.log_file = Menu.log_dir + "juniper-LOG_" + date_time + "_" + Menu.username + ".log"
+        json_file = Menu.log_file[:-len(".log")] + ".jsonl" if Menu.log_json else None
+        device_dir = join(Menu.log_dir, "devices") if Menu.device_logs else None
+        start_logging(Menu.log_file, json_file, device_dir)
+        # Results of every upgrade and reboot run
+        Menu.history = RunHistory(join(Menu.log_dir, "history"))
+
+    def selected_devices(self):
+        # The devices bulk operations act on: those matching the selection, or the whole rack
+        if Menu.selection is None:
+            return self.jrack.devices
+        return Menu.selection.select(self.jrack)
+
+    def use_selection(self, text):
+        # Select the devices matching a selector, or a saved selection by name. Returns False if it is not valid.
+        expression = load_selections(Menu.selections_file).get(text, text)
+        try:
+            Menu.selection = Selector(expression)
+        except ValueError as err:
+            print("Invalid selection '{0}' ERROR: {1}".format(expression, err))
+            return False
+        return True
+
+    def select_devices(self):
+        # Choose the devices the bulk operations act on with a selector, ie. "model~EX4300 and version<18.4 and
+        # site=DC2", or a saved selection. Selections can be saved for later runs and job files.
+        saved = load_selections(Menu.selections_file)
+        if Menu.selection:
+            print("Current selection: {0}".format(Menu.selection))
+        if saved:
+            t = PrettyTable(['Name', 'Selector'])
+            for name in sorted(saved):
+                t.add_row([name, saved[name]])
+            print(t)
+        print("Fields: ip, host, model, version, target, staged, site, age. Operators: = != ~ !~ < <= > >=")
+        text = input("Enter a selector or saved selection (blank for all devices, -name to delete): ").strip()
+        if not text:
+            Menu.selection = None
+            print("All {0} devices selected".format(len(self.jrack.devices)))
+            return
+        if text.startswith('-') and text[1:] in saved:
+            delete_selection(Menu.selections_file, text[1:])
+            print("Deleted selection {0}".format(text[1:]))
+            return
+        if not self.use_selection(text):
+            return
+        start = time.time()
+        devices = self.selected_devices()
+        print("{0} of {1} devices selected ({2:.1f} ms)".format(len(devices), len(self.jrack.devices),
+                                                               (time.time() - start) * 1000))
+        if text not in saved and getTFAnswer("Save this selection"):
+            name = input("Selection name: ").strip()
+            if name:
+                save_selection(Menu.selections_file, name, text)
+                print("Saved as {0}, use it here or with --select={0}".format(name))
 
     def quit(self):
+        if self.refresher:
+            self.refresher.stop()
+        if Menu.pool:
+            Menu.pool.close_all()
+        if Menu.scheduler:
+            Menu.scheduler.close()
+        self.jrack.close()
+        if Menu.history:
+            Menu.history.close()
+        stop_logging()
+        close_logs()
         print("Thank you for using JRack. Juniper Your Network!")
         sys.exit(0)
 
 if __name__ == "__main__":
     Menu().getargs(sys.argv[1:])
+    if Menu.job_file:
+        sys.exit(Menu().run_job(Menu.job_file))
     Menu().run()
\ No newline at end of file
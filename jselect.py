@@ -0,0 +1,313 @@
+# Author: Tyler Jordan
+# File: jselect.py
+# Last Modified: 10/18/2026
+# Description: Selector expressions for choosing a subset of the rack, ie. "model~EX4300 and version<18.4 and site=DC2".
+
+import os
+import re
+import json
+import time
+import socket
+import ipaddress
+
+from jrack import JDevice
+from jversion import version_key, image_version
+
+# Names usable in a selector and the device attribute each one reads
+FIELDS = {
+    'ip': 'ip',
+    'host': 'hostname',
+    'hostname': 'hostname',
+    'model': 'model',
+    'version': 'curr_code',
+    'code': 'curr_code',
+    'target': 'tar_code',
+    'image': 'tar_code',
+    'staged': 'staged_code',
+    'site': 'site',
+    'age': 'age'
+}
+# Fields compared as Junos versions by <, <=, > and >=, the target image by the version in its file name
+VERSION_FIELDS = {'curr_code': version_key, 'tar_code': lambda tar_code: version_key(image_version(tar_code)),
+                  'staged_code': lambda tar_code: version_key(image_version(tar_code))}
+OPERATORS = ['=', '!=', '~', '!~', '<', '<=', '>', '>=']
+KEYWORDS = ['and', 'or', 'not']
+TOKEN = re.compile(r'\s*(?:(?P<paren>[()])|(?P<op>!=|!~|<=|>=|==|=|~|<|>)|"(?P<quoted>[^"]*)"|\'(?P<single>[^\']*)\''
+                   r'|(?P<word>[^\s()=!~<>"\']+))')
+# Age values can be given in minutes, hours or days, ie. age>2h
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Selector:
+    """ Purpose: A parsed selector expression. Terms are "<field><operator><value>" and can be combined with
+                 and, or, not and parentheses, ie. "model~EX4300 and (version<18.4 or site=DC2)".
+                    =   equal, case is ignored. A version equals every release it is the start of (version=18.4
+                        is any 18.4 release), an ip can be a subnet (ip=10.1.0.0/16) and "" matches no value.
+                    !=  not equal
+                    ~   matches the regular expression (case is ignored), !~ does not match it
+                    <, <=, >, >=    versions are compared as Junos versions (the target and staged images by the
+                        version in their file name), ages as seconds (or with a unit: 30m, 2h, 7d) and ips as
+                        addresses
+                 Fields are ip, host, model, version, target, staged, site and age (seconds since the refresh).
+                 Model, version, target, staged and site are read from the rack's value indexes, so each distinct
+                 value is tested once however many devices have it.
+        Parameters:
+            expression  -   The selector text, raises ValueError when it cannot be parsed
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+        if not self.tokens:
+            raise ValueError("Empty selector")
+        self.tree = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError("Unexpected '{0}' in selector".format(self.tokens[self.position][1]))
+        del self.tokens
+
+    def __str__(self):
+        return self.expression
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == ('word', 'or'):
+            self.take()
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == ('word', 'and'):
+            self.take()
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        kind, text = self.peek()
+        if (kind, text) == ('word', 'not'):
+            self.take()
+            return ('not', self.parse_not())
+        if (kind, text) == ('paren', '('):
+            self.take()
+            node = self.parse_or()
+            if self.take() != ('paren', ')'):
+                raise ValueError("Missing ')' in selector")
+            return node
+        return self.parse_term()
+
+    def parse_term(self):
+        kind, name = self.take()
+        if kind != 'word' or name in KEYWORDS:
+            raise ValueError("Expected a field name, found '{0}'".format(name or 'the end'))
+        attr = FIELDS.get(name.lower())
+        if attr is None:
+            raise ValueError("Unknown field '{0}', use one of: {1}".format(name, ", ".join(sorted(FIELDS))))
+        kind, op = self.take()
+        if kind != 'op':
+            raise ValueError("Expected an operator after '{0}', one of: {1}".format(name, " ".join(OPERATORS)))
+        if op == '==':
+            op = '='
+        kind, value = self.take()
+        if kind not in ('word', 'quoted'):
+            raise ValueError("Expected a value after '{0}{1}'".format(name, op))
+        return ('term', attr, op, value, term_test(attr, op, value))
+
+    def select(self, rack):
+        # The rack devices matching the selector, in rack order
+        matched = self.evaluate(self.tree, rack)
+        if len(matched) == len(rack.devices):
+            return list(rack.devices)
+        return [device for device in rack.devices if device in matched]
+
+    def evaluate(self, node, rack):
+        # The set of rack devices matching a node of the parsed selector
+        if node[0] == 'and':
+            left = self.evaluate(node[1], rack)
+            if not left:
+                return left
+            return left & self.evaluate(node[2], rack)
+        if node[0] == 'or':
+            return self.evaluate(node[1], rack) | self.evaluate(node[2], rack)
+        if node[0] == 'not':
+            return set(rack.devices) - self.evaluate(node[1], rack)
+        attr, test = node[1], node[4]
+        if attr in JDevice.interned:
+            matched = set()
+            for value, devices in rack.value_index(attr).items():
+                if test(value):
+                    matched.update(devices)
+            return matched
+        if attr == 'age':
+            now = time.time()
+            return set(device for device in rack.devices if test(now - device.last_refresh))
+        return set(device for device in rack.devices if test(getattr(device, attr)))
+
+
+def tokenize(expression):
+    # (kind, text) of each token: paren, op, quoted or word. Keywords are lower case words.
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError("Cannot read selector at '{0}'".format(expression[position:]))
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'single':
+            kind = 'quoted'
+        elif kind == 'word' and text.lower() in KEYWORDS:
+            text = text.lower()
+        tokens.append((kind, text))
+    return tokens
+
+
+def term_test(attr, op, value):
+    # A function telling whether an attribute value matches "op value", the value is parsed once here
+    negate = op in ('!=', '!~')
+    if op in ('=', '!='):
+        test = equals_test(attr, value)
+    elif op in ('~', '!~'):
+        try:
+            pattern = re.compile(value, re.IGNORECASE)
+        except re.error as err:
+            raise ValueError("Bad regular expression '{0}': {1}".format(value, err))
+        test = lambda current: current is not None and pattern.search(str(current)) is not None
+    else:
+        test = order_test(attr, op, value)
+    if negate:
+        return lambda current: not test(current)
+    return test
+
+
+def equals_test(attr, value):
+    if value == '':
+        return lambda current: not current
+    if attr == 'ip' and '/' in value:
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            raise ValueError("Bad subnet '{0}'".format(value))
+        wanted = (network.version, int(network.network_address), int(network.netmask))
+        return lambda current: in_network(current, wanted)
+    if attr == 'age':
+        seconds = age_seconds(value)
+        return lambda current: int(current) == seconds
+    value = value.lower()
+    if attr in VERSION_FIELDS and version_key(value) is not None:
+        # A version equals every release it is the start of, ie. 18.4 equals 18.4R2-S3
+        wanted = version_key(value)
+        key = VERSION_FIELDS[attr]
+
+        def test(current):
+            if (key(current) or ())[:len(wanted)] == wanted:
+                return True
+            return current is not None and current.lower() == value
+        return test
+    return lambda current: current is not None and str(current).lower() == value
+
+
+def order_test(attr, op, value):
+    # <, <=, > and >= for versions, ages, ips and otherwise strings
+    if attr in VERSION_FIELDS:
+        wanted = version_key(value)
+        if wanted is None:
+            raise ValueError("'{0}' is not a Junos version (ie. 18.4R2-S3)".format(value))
+        key = VERSION_FIELDS[attr]
+    elif attr == 'age':
+        wanted = age_seconds(value)
+        key = float
+    elif attr == 'ip':
+        wanted = ip_key(value)
+        if wanted is None:
+            raise ValueError("Bad ip '{0}'".format(value))
+        key = ip_key
+    else:
+        wanted = value.lower()
+        key = lambda current: None if current is None else str(current).lower()
+    compare = {'<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+               '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}[op]
+
+    def test(current):
+        current = key(current)
+        if current is None:
+            return False
+        return compare(current, wanted)
+    return test
+
+
+def ip_key(ip):
+    # (4 or 6, address as an integer) of an ip, or None. inet_pton is much faster than ipaddress for whole racks.
+    for version, family in ((4, socket.AF_INET), (6, socket.AF_INET6)):
+        try:
+            return version, int.from_bytes(socket.inet_pton(family, ip), 'big')
+        except (OSError, TypeError, ValueError):
+            continue
+    return None
+
+
+def in_network(ip, network):
+    # True if an ip is in the (version, network address, netmask) network
+    address = ip_key(ip)
+    return address is not None and address[0] == network[0] and address[1] & network[2] == network[1]
+
+
+def age_seconds(value):
+    # Seconds in an age value, ie. 90, 30m, 2h or 7d
+    value = value.strip().lower()
+    unit = AGE_UNITS.get(value[-1:])
+    try:
+        if unit:
+            return int(float(value[:-1]) * unit)
+        return int(float(value))
+    except ValueError:
+        raise ValueError("Bad age '{0}', use seconds or a number with s, m, h or d".format(value))
+
+
+def load_selections(selections_file):
+    # The saved selections, name to selector expression
+    try:
+        with open(selections_file, 'r') as infile:
+            selections = json.load(infile)
+    except (IOError, OSError, ValueError):
+        return {}
+    return selections if isinstance(selections, dict) else {}
+
+
+def save_selection(selections_file, name, expression):
+    # Save (or replace) a named selection, after checking that it parses
+    Selector(expression)
+    selections = load_selections(selections_file)
+    selections[name] = expression
+    write_selections(selections_file, selections)
+    return selections
+
+
+def delete_selection(selections_file, name):
+    # Remove a named selection, returns True if it was saved
+    selections = load_selections(selections_file)
+    if name not in selections:
+        return False
+    del selections[name]
+    write_selections(selections_file, selections)
+    return True
+
+
+def write_selections(selections_file, selections):
+    # Replace the selections file in one step, so it is never left half written
+    temp_file = selections_file + ".tmp"
+    with open(temp_file, 'w') as outfile:
+        json.dump(selections, outfile, indent=1, sort_keys=True)
+    os.replace(temp_file, selections_file)
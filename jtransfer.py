@@ -0,0 +1,415 @@
+# Author: Tyler Jordan
+# File: jtransfer.py
+# Last Modified: 10/18/2026
+# Description: Image transfers to the devices over SFTP, sharing a global and a per-site bandwidth budget.
+
+import os
+import time
+import hashlib
+import datetime
+import threading
+
+from binascii import hexlify
+
+# Bytes per second in one Mbit/s
+MBIT = 125000
+
+# Columns of the transfer statistics CSV
+TRANSFER_KEYS = ['Date', 'IP', 'Site', 'Size', 'Sent', 'Resumed', 'Attempts', 'Repaired_Blocks', 'Verified',
+                 'Seconds', 'Waited', 'Mbps', 'Error']
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        # "rate" bytes per second, saved up to "burst" bytes (a quarter second worth by default). A rate of 0 is
+        # unlimited.
+        self.rate = float(rate or 0)
+        self.burst = float(burst or self.rate / 4)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, amount):
+        # Seconds until "amount" bytes may be sent, 0 when they may be sent now. A chunk larger than the burst only
+        # needs a full bucket, the bucket then goes below zero and pays it back before the next chunk.
+        if not self.rate:
+            return 0.0
+        needed = min(amount, self.burst) - self.tokens
+        return needed / self.rate if needed > 0 else 0.0
+
+    def take(self, amount):
+        if self.rate:
+            self.tokens -= amount
+
+
+class Waiter:
+
+    def __init__(self, site, amount):
+        # A transfer waiting for permission to send one chunk
+        self.site = site
+        self.amount = amount
+        self.granted = threading.Event()
+
+
+class Transfer:
+
+    def __init__(self, ip, site, size):
+        # Progress and statistics of one image transfer
+        self.ip = ip
+        self.site = site
+        self.size = size
+        # Bytes sent, counting those sent again, and bytes already on the device when the transfer started
+        self.sent = 0
+        self.resumed = None
+        self.attempts = 0
+        self.repaired = 0
+        self.verified = False
+        self.waited = 0.0
+        self.start = time.time()
+        self.finish = None
+        self.ok = False
+        self.error = ''
+
+    def seconds(self):
+        return (self.finish or time.time()) - self.start
+
+    def throughput(self):
+        # Effective Mbit/s, including the time spent waiting for bandwidth
+        seconds = self.seconds()
+        return self.sent / MBIT / seconds if seconds > 0 else 0.0
+
+    def stats(self):
+        # The statistics recorded for the device, with the TRANSFER_KEYS
+        return {'Date': datetime.datetime.fromtimestamp(self.start).isoformat(timespec='seconds'), 'IP': self.ip,
+                'Site': self.site, 'Size': self.size, 'Sent': self.sent, 'Resumed': self.resumed or 0,
+                'Attempts': self.attempts, 'Repaired_Blocks': self.repaired, 'Verified': 'Y' if self.verified else 'N',
+                'Seconds': round(self.seconds(), 1), 'Waited': round(self.waited, 1),
+                'Mbps': round(self.throughput(), 2), 'Error': self.error}
+
+
+class TransferScheduler:
+    """ Purpose: Shares a bandwidth budget between the image transfers running at the same time. Each transfer asks
+                 for every chunk before sending it, and a dispatcher thread hands the chunks out in the order they
+                 were asked for, so the active transfers take turns and get equal shares. A transfer whose site is
+                 over its cap is passed over until the site has bandwidth again, so the other sites use what it
+                 cannot.
+
+                 A transfer that is cut off resumes from the size of the partial file on the device, on a new
+                 connection. The copy is checked block by block against the block checksums of the image and as a
+                 whole, and only the blocks that are missing or wrong are sent again.
+        Parameters:
+            total_rate      -   Bytes per second for all transfers together, 0 for no limit
+            site_rates      -   Dictionary of site to bytes per second, '*' is the cap of every site not listed
+            chunk_size      -   Bytes sent per request
+            block_size      -   Bytes per checksum block, the unit that is verified and sent again
+            attempts        -   Connections tried per transfer, and rounds of repairs after a bad checksum
+            retry_delay     -   Seconds to wait before reconnecting
+    """
+
+    def __init__(self, total_rate=0, site_rates=None, chunk_size=256 * 1024, block_size=8 * 1024 * 1024, attempts=5,
+                 retry_delay=10):
+        self.total = TokenBucket(total_rate)
+        self.site_rates = dict(site_rates or {})
+        self.sites = {}
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.waiting = []
+        self.transfers = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.dispatcher = None
+        self.stopped = False
+
+    def site_bucket(self, site):
+        # The bucket of a site, created the first time the site transfers anything
+        bucket = self.sites.get(site)
+        if bucket is None:
+            bucket = self.sites[site] = TokenBucket(self.site_rates.get(site, self.site_rates.get('*', 0)))
+        return bucket
+
+    def acquire(self, site, amount):
+        # Block until "amount" bytes may be sent to a device at this site, returns the seconds waited
+        start = time.monotonic()
+        waiter = Waiter(site, amount)
+        with self.lock:
+            if self.dispatcher is None:
+                self.dispatcher = threading.Thread(target=self.dispatch_loop, name="TransferScheduler")
+                self.dispatcher.daemon = True
+                self.dispatcher.start()
+            self.waiting.append(waiter)
+            self.wakeup.notify()
+        waiter.granted.wait()
+        return time.monotonic() - start
+
+    def dispatch_loop(self):
+        # Grant chunks as bandwidth allows, sleeping until the next grant is possible or another chunk is asked for
+        with self.lock:
+            while not self.stopped:
+                delay = self.dispatch()
+                self.wakeup.wait(delay)
+
+    def dispatch(self):
+        # Grant, in order, every waiting chunk that may be sent now. Returns the seconds until another grant could
+        # be possible, or None when nothing is waiting. Called with the lock held.
+        if not self.waiting:
+            return None
+        now = time.monotonic()
+        self.total.refill(now)
+        delay = 1.0
+        waiting = []
+        blocked = False
+        for waiter in self.waiting:
+            if blocked:
+                waiting.append(waiter)
+                continue
+            bucket = self.site_bucket(waiter.site)
+            bucket.refill(now)
+            site_wait = bucket.wait_time(waiter.amount)
+            if site_wait:
+                delay = min(delay, site_wait)
+                waiting.append(waiter)
+                continue
+            total_wait = self.total.wait_time(waiter.amount)
+            if total_wait:
+                # Nobody after this one may go before it
+                delay = min(delay, total_wait)
+                blocked = True
+                waiting.append(waiter)
+                continue
+            bucket.take(waiter.amount)
+            self.total.take(waiter.amount)
+            waiter.granted.set()
+        self.waiting = waiting
+        return delay if waiting else None
+
+    def push(self, ip, site, local_file, remote_file, username, password, checksum=None, blocks=None,
+             algorithm='md5', remote_checksum=None, port=22, progress=None):
+        """ Purpose: Copy a file to a device over SFTP within the bandwidth budget, resuming after dropped
+                     connections and repairing the blocks that do not match.
+            Parameters:
+                ip              -   IP of the device
+                site            -   Site of the device, for the per-site cap
+                local_file      -   Path of the image
+                remote_file     -   Path on the device
+                checksum        -   Checksum of the whole image, compared with what remote_checksum() returns
+                blocks          -   Checksums of each block_size block of the image (ChecksumCache.blocks())
+                algorithm       -   Algorithm of the checksums
+                remote_checksum -   Function returning the checksum of the copy on the device (ie. SW.remote_checksum)
+                progress        -   Optional function called with a message at every 10% of the transfer
+            Returns:
+                The Transfer, with ok True if the copy was verified. The last connection error is raised when every
+                attempt failed.
+        """
+        # Loaded on first use, paramiko takes a while to import
+        import paramiko
+        transfer = Transfer(ip, site, os.path.getsize(local_file))
+        with self.lock:
+            self.transfers[ip] = transfer
+        try:
+            while True:
+                transfer.attempts += 1
+                transfer.error = ''
+                try:
+                    self.attempt(transfer, local_file, remote_file, username, password, port, checksum, blocks,
+                                 algorithm, remote_checksum, progress)
+                    break
+                except (OSError, EOFError, paramiko.SSHException) as err:
+                    transfer.error = str(err)
+                    if transfer.attempts >= self.attempts:
+                        raise
+                    if progress:
+                        progress("{0}: transfer interrupted ({1}), resuming in {2} seconds".format(
+                            remote_file, err, self.retry_delay))
+                    time.sleep(self.retry_delay)
+        finally:
+            transfer.finish = time.time()
+        return transfer
+
+    def attempt(self, transfer, local_file, remote_file, username, password, port, checksum, blocks, algorithm,
+                remote_checksum, progress):
+        # One connection: send whatever is not on the device yet, then verify and repair the copy
+        import paramiko
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            ssh.connect(transfer.ip, port=port, username=username, password=password)
+            sftp = ssh.open_sftp()
+            try:
+                try:
+                    remote_size = sftp.stat(remote_file).st_size
+                except IOError:
+                    remote_size = 0
+                if remote_size > transfer.size:
+                    # Not a partial copy of this image, start over
+                    remote_size = 0
+                # The last block on the device may be incomplete, it is sent again
+                offset = remote_size - remote_size % self.block_size
+                if transfer.resumed is None:
+                    transfer.resumed = offset
+                if offset and progress:
+                    progress("{0}: resuming after {1} bytes already on the device".format(remote_file, offset))
+                self.send(transfer, sftp, local_file, remote_file, offset, transfer.size - offset, remote_size > 0,
+                          progress)
+                self.verify(transfer, sftp, local_file, remote_file, checksum, blocks, algorithm, remote_checksum,
+                            progress)
+            finally:
+                sftp.close()
+        finally:
+            ssh.close()
+
+    def send(self, transfer, sftp, local_file, remote_file, offset, length, exists, progress=None):
+        # Write "length" bytes of the image from "offset", one chunk at a time within the budget
+        with open(local_file, 'rb') as infile, sftp.open(remote_file, 'r+b' if exists else 'wb') as outfile:
+            # Do not wait for each write to be acknowledged, errors are raised on close
+            outfile.set_pipelined(True)
+            infile.seek(offset)
+            outfile.seek(offset)
+            end = offset + length
+            position = offset
+            reported = position * 10 // transfer.size if transfer.size else 10
+            while position < end:
+                chunk = infile.read(min(self.chunk_size, end - position))
+                if not chunk:
+                    break
+                transfer.waited += self.acquire(transfer.site, len(chunk))
+                outfile.write(chunk)
+                transfer.sent += len(chunk)
+                position += len(chunk)
+                if progress and position * 10 // transfer.size > reported:
+                    reported = position * 10 // transfer.size
+                    progress("{0}: {1} of {2} bytes sent ({3}%)".format(remote_file, position, transfer.size,
+                                                                       reported * 10))
+            if position == transfer.size:
+                # Cut off anything left from an older, longer copy
+                outfile.truncate(transfer.size)
+
+    def verify(self, transfer, sftp, local_file, remote_file, checksum, blocks, algorithm, remote_checksum,
+               progress=None):
+        # Check the copy and send the blocks that do not match again, up to "attempts" rounds of repairs. The copy
+        # is checked once more after the last round, so a repair that works in the last round counts.
+        for repair in range(self.attempts + 1):
+            if remote_checksum is None and not blocks:
+                # Nothing to compare with, the size has to do
+                transfer.ok = transfer.verified = sftp.stat(remote_file).st_size == transfer.size
+                return
+            if remote_checksum is not None and remote_checksum() == checksum:
+                transfer.ok = transfer.verified = True
+                return
+            bad = self.bad_blocks(transfer, sftp, remote_file, blocks, algorithm) if blocks else []
+            if not bad:
+                if remote_checksum is None:
+                    transfer.ok = transfer.verified = True
+                    return
+                # The whole file does not match but no block can be blamed, there is nothing to repair
+                break
+            if repair == self.attempts:
+                # Out of repair rounds
+                break
+            transfer.repaired += len(bad)
+            if progress:
+                progress("{0}: {1} blocks do not match, sending them again".format(remote_file, len(bad)))
+            for index in bad:
+                offset = index * self.block_size
+                self.send(transfer, sftp, local_file, remote_file, offset,
+                          min(self.block_size, transfer.size - offset), True)
+        transfer.ok = transfer.verified = False
+        transfer.error = "Checksum of {0} does not match after repairs".format(remote_file)
+
+    def bad_blocks(self, transfer, sftp, remote_file, blocks, algorithm):
+        # Indexes of the blocks of the copy that are missing or do not match. The SFTP check-file extension hashes
+        # the blocks on the device, servers without it have the blocks read back instead, within the same budget
+        # as the transfers.
+        remote_size = sftp.stat(remote_file).st_size
+        with sftp.open(remote_file, 'rb') as remote:
+            try:
+                digests = remote.check(algorithm, 0, 0, self.block_size)
+                size = hashlib.new(algorithm).digest_size
+                remote_blocks = [hexlify(digests[start:start + size]).decode('ascii')
+                                 for start in range(0, len(digests), size)]
+            except IOError:
+                remote_blocks = self.read_blocks(transfer, remote, min(remote_size, len(blocks) * self.block_size),
+                                                 algorithm)
+        bad = []
+        for index, digest in enumerate(blocks):
+            if index * self.block_size >= remote_size or index >= len(remote_blocks) or \
+                    remote_blocks[index] != digest:
+                bad.append(index)
+        return bad
+
+    def read_blocks(self, transfer, remote, length, algorithm):
+        # Checksums of the blocks in the first "length" bytes of the copy, read back one chunk at a time within the
+        # budget of the device's site. Reading back uses the same link as sending, so it is paced the same way.
+        remote_blocks = []
+        position = 0
+        while position < length:
+            digest = hashlib.new(algorithm)
+            end = min(position + self.block_size, length)
+            while position < end:
+                amount = min(self.chunk_size, end - position)
+                transfer.waited += self.acquire(transfer.site, amount)
+                chunk = remote.read(amount)
+                if not chunk:
+                    return remote_blocks + [digest.hexdigest()]
+                digest.update(chunk)
+                position += len(chunk)
+            remote_blocks.append(digest.hexdigest())
+        return remote_blocks
+
+    def summary(self):
+        """ Purpose: Effective throughput of the transfers since the last reset(), by site and overall.
+            Returns:
+                Dictionary of site (and 'TOTAL') to devices, failed, bytes, seconds (first start to last finish)
+                and Mbit/s
+        """
+        with self.lock:
+            transfers = list(self.transfers.values())
+        groups = {}
+        for transfer in transfers:
+            groups.setdefault(transfer.site or '-', []).append(transfer)
+        if transfers:
+            groups['TOTAL'] = transfers
+        result = {}
+        for site, group in groups.items():
+            sent = sum(transfer.sent for transfer in group)
+            finish = max(transfer.finish or time.time() for transfer in group)
+            seconds = finish - min(transfer.start for transfer in group)
+            result[site] = {'devices': len(group), 'failed': len([transfer for transfer in group if not transfer.ok]),
+                            'bytes': sent, 'seconds': round(seconds, 1),
+                            'mbps': round(sent / MBIT / seconds, 2) if seconds > 0 else 0.0}
+        return result
+
+    def reset(self):
+        # Forget the transfers of the last run
+        with self.lock:
+            self.transfers = {}
+
+    def close(self):
+        # Stop the dispatcher, transfers still waiting are let go
+        with self.lock:
+            self.stopped = True
+            for waiter in self.waiting:
+                waiter.granted.set()
+            self.waiting = []
+            self.wakeup.notify()
+
+
+def parse_site_rates(spec):
+    # Site caps from "DC2=50,BR1=5,*=10" (Mbit/s) or a dictionary of site to Mbit/s, returns site to bytes/second
+    if isinstance(spec, dict):
+        items = spec.items()
+    else:
+        items = [item.split('=', 1) for item in spec.split(',') if item.strip()]
+    rates = {}
+    for item in items:
+        if len(item) != 2:
+            raise ValueError("Site caps look like <site>=<Mbit/s>: {0}".format(spec))
+        site, mbps = item
+        rates[site.strip()] = float(mbps) * MBIT
+    return rates
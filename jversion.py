@@ -0,0 +1,55 @@
+# Author: Tyler Jordan
+# File: jversion.py
+# Last Modified: 10/18/2026
+# Description: Comparable keys for Junos versions and the versions of Junos image files.
+
+import re
+
+from functools import lru_cache
+
+# ie. 18.4, 18.4R2, 18.4R2-S3, 18.4R3.3, 15.1X49-D170.4
+JUNOS_VERSION = re.compile(r'(\d+)\.(\d+)(?:([A-Z])(\d+)(?:-([A-Z])(\d+))?(?:\.(\d+))?)?')
+# Internal and beta builds come before the release of the same number, X trains (ie. 15.1X49) after it
+RELEASE_TYPES = {'I': 0, 'B': 1, 'F': 2, 'R': 3, 'X': 4}
+
+
+@lru_cache(maxsize=4096)
+def version_key(version):
+    """ Purpose: Turn a Junos version into a tuple that compares the way the versions do, ie. 18.4R2-S3 is
+                 (18, 4, 3, 2, 'S', 3) and is newer than 18.4R2.3 (18, 4, 3, 2, '', 0, 3). A partial version only
+                 has the parts given, so 18.4 is (18, 4), which sorts before every 18.4 release and is a prefix
+                 of them all. Keys are cached, a rack has few distinct versions.
+        Parameters:
+            version     -   Version string, ie. the running version of a device
+        Returns:
+            The key, or None when the string is not a Junos version
+    """
+    if not version:
+        return None
+    match = JUNOS_VERSION.fullmatch(version.strip().upper())
+    if not match:
+        return None
+    major, minor, rtype, release, stype, service, spin = match.groups()
+    key = (int(major), int(minor))
+    if rtype is None:
+        return key
+    key += (RELEASE_TYPES.get(rtype, 3), int(release))
+    if stype is not None:
+        key += (stype, int(service))
+    elif spin is not None:
+        key += ('', 0)
+    if spin is not None:
+        key += (int(spin),)
+    return key
+
+
+@lru_cache(maxsize=1024)
+def image_version(tar_code):
+    # The Junos version in an image file name, ie. 18.4R3.3 for jinstall-ex-4300-18.4R3.3-signed.tgz, or None
+    if not tar_code:
+        return None
+    for match in JUNOS_VERSION.finditer(tar_code.upper()):
+        # Skip numbers that only look like a version, ie. the 86-64 in x86-64-20.4R3.8
+        if match.group(3) is not None:
+            return match.group(0)
+    return None
@@ -0,0 +1,85 @@
+# Author: Tyler Jordan
+# File: jwatch.py
+# Last Modified: 10/18/2026
+# Description: Tracks rebooted devices until they go down and come back up.
+
+import time
+import asyncio
+
+
+async def probe(ip, port, timeout):
+    # True if a TCP connection to the port can be opened, this is all a probe costs the device
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def watch_device(ip, rebooted_at, port, interval, down_grace, up_timeout, probe_timeout, slots, result):
+    # Probe one device until it has gone down and come back up, or until the timeouts run out
+    async def reachable():
+        async with slots:
+            return await probe(ip, port, probe_timeout)
+
+    # Wait for the device to go down. One still answering after down_grace seconds has not rebooted (or did so
+    # between probes), it is reported as never down instead of being timed as if it had come back.
+    while True:
+        if not await reachable():
+            result['down'] = time.time() - rebooted_at
+            break
+        if time.time() - rebooted_at >= down_grace:
+            result['never_down'] = True
+            return
+        await asyncio.sleep(interval)
+
+    # Wait for the device to come back
+    while time.time() - rebooted_at < up_timeout:
+        if await reachable():
+            result['up'] = time.time() - rebooted_at
+            return
+        await asyncio.sleep(interval)
+
+
+async def watch_all(targets, port, interval, down_grace, up_timeout, probe_timeout, max_probes, progress):
+    slots = asyncio.Semaphore(max_probes)
+    results = {}
+    tasks = []
+    for ip, rebooted_at in targets.items():
+        results[ip] = {'down': None, 'up': None, 'never_down': False}
+        tasks.append(asyncio.ensure_future(watch_device(ip, rebooted_at, port, interval, down_grace, up_timeout,
+                                                        probe_timeout, slots, results[ip])))
+    for done, task in enumerate(asyncio.as_completed(tasks), 1):
+        await task
+        if progress:
+            progress(done, len(tasks))
+    return results
+
+
+def watch_reboots(targets, port=830, interval=5, down_grace=180, up_timeout=1800, probe_timeout=2,
+                  max_probes=200, progress=None):
+    """ Purpose: Watch many rebooted devices at the same time by probing their NETCONF/SSH port. Each device is
+                 probed every "interval" seconds, with at most max_probes connections open at once.
+        Parameters:
+            targets         -   Dictionary of device IP to the time.time() the reboot was requested
+            port            -   TCP port to probe, 830 for NETCONF or 22 for SSH
+            interval        -   Seconds between probes of the same device
+            down_grace      -   Seconds after the reboot to stop waiting for a device that is still answering to go
+                                down, it is then reported as never down
+            up_timeout      -   Seconds after the reboot to stop waiting for the device to come back
+            probe_timeout   -   Seconds a single connection attempt may take
+            max_probes      -   Maximum number of probes in flight
+            progress        -   Optional function called with (finished, total) as each device is done
+        Returns:
+            Dictionary of device IP to {'down': seconds, 'up': seconds, 'never_down': bool}, None where it was not
+            seen
+    """
+    if not targets:
+        return {}
+    return asyncio.run(watch_all(targets, port, interval, down_grace, up_timeout, probe_timeout, max_probes,
+                                 progress))
@@ -0,0 +1,116 @@
+# Author: Tyler Jordan
+# File: test_jinventory.py
+# Last Modified: 10/18/2026
+# Description: Checks of the streaming device list reader, run with python -m unittest.
+
+import os
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+
+from jinventory import InventoryReader, column_name, reject_file_for
+
+
+class InventoryReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.reject_file = os.path.join(self.directory, "rejects.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as outfile:
+            outfile.write(text)
+        return path
+
+    def rejects(self):
+        # (line, reason) of each row in the reject file
+        with open(self.reject_file, newline='') as infile:
+            rows = list(csv.reader(infile))
+        self.assertEqual(rows[0], ['LINE', 'REASON', 'ROW'])
+        return [(int(row[0]), row[1]) for row in rows[1:]]
+
+    def test_csv(self):
+        path = self.write("devices.csv", "IP_ADDR,UPGRADE_IMG,SITE,NOTES\n"
+                                         " 10.0.0.1 ,jinstall-ex-4300-18.4R3.3-signed.tgz,DC1,core\n"
+                                         "10.0.0.2,,DC2,\n")
+        targets = list(InventoryReader(path))
+        self.assertEqual(targets, [
+            {'ip': '10.0.0.1', 'tar_code': 'jinstall-ex-4300-18.4R3.3-signed.tgz', 'site': 'DC1', 'model': None,
+             'line': 2},
+            {'ip': '10.0.0.2', 'tar_code': None, 'site': 'DC2', 'model': None, 'line': 3}])
+
+    def test_bad_and_duplicate_rows(self):
+        path = self.write("devices.csv", "ip,image\n"
+                                         "10.0.0.1,a.tgz\n"
+                                         "10.0.0.300,b.tgz\n"
+                                         "\n"
+                                         ",c.tgz\n"
+                                         "10.0.0.1,d.tgz\n"
+                                         "2001:DB8:0:0::1,e.tgz\n"
+                                         "2001:db8::1,f.tgz\n"
+                                         "10.0.0.2,g.tgz,extra\n"
+                                         "10.0.0.3,h.tgz\n")
+        reader = InventoryReader(path, self.reject_file)
+        self.assertEqual([target['ip'] for target in reader], ['10.0.0.1', '2001:db8::1', '10.0.0.3'])
+        self.assertEqual(reader.rows, 8)
+        self.assertEqual(reader.duplicates, 2)
+        self.assertEqual(reader.bad, 3)
+        # The blank line is skipped but still counted in the line numbers
+        self.assertEqual(self.rejects(), [(3, 'Invalid IP: 10.0.0.300'), (5, 'No IP'),
+                                          (9, '3 fields, the header has 2')])
+        self.assertEqual(reader.errors, self.rejects())
+
+    def test_max_errors(self):
+        path = self.write("devices.csv", "ip\n" + "".join("bad{0}\n".format(n) for n in range(5)))
+        reader = InventoryReader(path, self.reject_file, max_errors=2)
+        self.assertEqual(list(reader), [])
+        self.assertEqual(reader.bad, 5)
+        self.assertEqual([line for line, reason in reader.errors], [2, 3])
+        self.assertEqual([line for line, reason in self.rejects()], [2, 3, 4, 5, 6])
+
+    def test_no_rejects_no_file(self):
+        path = self.write("devices.csv", "ip\n10.0.0.1\n")
+        self.assertEqual(len(list(InventoryReader(path, self.reject_file))), 1)
+        self.assertFalse(os.path.exists(self.reject_file))
+
+    def test_no_ip_column(self):
+        path = self.write("devices.csv", "host,image\nsw1,a.tgz\n")
+        with self.assertRaises(ValueError):
+            list(InventoryReader(path))
+
+    def test_jsonl(self):
+        path = self.write("devices.jsonl", json.dumps({'IP': '10.0.0.1', 'Model': 'EX4300', 'image': 'a.tgz'}) + "\n"
+                                           "\n"
+                                           "{not json\n"
+                                           "[1, 2]\n"
+                                           + json.dumps({'address': '10.0.0.1'}) + "\n"
+                                           + json.dumps({'ip': 'fe80::1', 'site': None}) + "\n")
+        reader = InventoryReader(path, self.reject_file)
+        targets = list(reader)
+        self.assertEqual([(target['ip'], target['model'], target['line']) for target in targets],
+                         [('10.0.0.1', 'EX4300', 1), ('fe80::1', None, 6)])
+        self.assertEqual(reader.duplicates, 1)
+        self.assertEqual([(line, reason.split(':')[0]) for line, reason in self.rejects()],
+                         [(3, 'Not valid JSON'), (4, 'Not a JSON object')])
+
+
+class ColumnTest(unittest.TestCase):
+
+    def test_column_name(self):
+        self.assertEqual(column_name(' IP_ADDR '), 'ip')
+        self.assertEqual(column_name('Upgrade_Img'), 'tar_code')
+        self.assertIsNone(column_name('notes'))
+        self.assertIsNone(column_name(None))
+
+    def test_reject_file_for(self):
+        self.assertEqual(reject_file_for("lists/upgrade.csv", "logs"), os.path.join("logs", "upgrade_rejects.csv"))
+
+
+if __name__ == '__main__':
+    unittest.main()
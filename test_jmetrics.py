@@ -0,0 +1,41 @@
+# Author: Tyler Jordan
+# File: test_jmetrics.py
+# Last Modified: 10/18/2026
+# Description: Checks of the nearest rank quantiles reported for the phase timings, run with python -m unittest.
+
+import unittest
+
+from jmetrics import Phase, nearest_rank
+
+
+class NearestRankTest(unittest.TestCase):
+
+    def test_hundred_samples(self):
+        samples = list(range(1, 101))
+        self.assertEqual(nearest_rank(samples, 0.50), 50)
+        self.assertEqual(nearest_rank(samples, 0.95), 95)
+        self.assertEqual(nearest_rank(samples, 0.99), 99)
+        self.assertEqual(nearest_rank(samples, 1.0), 100)
+        # 0.07 * 100 is 7.000000000000001 in floating point
+        self.assertEqual(nearest_rank(samples, 0.07), 7)
+
+    def test_twenty_samples(self):
+        # p95 of 20 samples is the 19th, not the maximum
+        samples = list(range(1, 21))
+        self.assertEqual(nearest_rank(samples, 0.95), 19)
+        self.assertEqual(nearest_rank(samples, 0.50), 10)
+
+    def test_edges(self):
+        self.assertEqual(nearest_rank([], 0.95), 0.0)
+        self.assertEqual(nearest_rank([7], 0.99), 7)
+        self.assertEqual(nearest_rank([1, 2, 3], 0.0), 1)
+
+    def test_phase_sorts_samples(self):
+        phase = Phase()
+        phase.samples = [float(n) for n in range(100, 0, -1)]
+        self.assertEqual(phase.quantile(0.95), 95.0)
+        self.assertEqual(phase.quantile(0.99), 99.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Author: Tyler Jordan
+# File: test_jpool.py
+# Last Modified: 10/18/2026
+# Description: Checks that closing pooled sessions does not hold up the other workers, run with python -m unittest.
+
+import time
+import threading
+import unittest
+
+from jpool import SessionPool
+
+
+class SimDevice:
+    # Stand-in for jnpr.junos.Device, closing it blocks until "closing" is set (ie. a dead peer)
+
+    def __init__(self, ip, closing=None, **kwargs):
+        self.ip = ip
+        self.closing = closing
+        self.connected = False
+        self.timeout = 30
+
+    def open(self):
+        self.connected = True
+
+    def close(self):
+        if self.closing is not None:
+            self.closing.wait(5)
+        self.connected = False
+
+
+class SlowCloseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.closing = threading.Event()
+        self.pool = SessionPool('user', 'password', max_sessions=1, max_idle=60)
+        self.pool.device_factory = lambda ip, **kwargs: SimDevice(ip, self.closing if ip == '10.0.0.1' else None)
+
+    def tearDown(self):
+        self.closing.set()
+
+    def acquire_while_closing(self, ip):
+        # Start acquire(ip) on another thread, returns the seconds it took or None if it is still blocked
+        done = threading.Event()
+        start = time.monotonic()
+
+        def worker():
+            self.pool.acquire(ip)
+            self.pool.release(ip)
+            done.set()
+        threading.Thread(target=worker, daemon=True).start()
+        if not done.wait(2):
+            return None
+        return time.monotonic() - start
+
+    def test_eviction(self):
+        # Opening 10.0.0.2 evicts 10.0.0.1, whose close hangs, while 10.0.0.3 is still served
+        self.pool.acquire('10.0.0.1')
+        self.pool.release('10.0.0.1')
+        evicting = threading.Thread(target=self.pool.acquire, args=('10.0.0.2',), daemon=True)
+        evicting.start()
+        time.sleep(0.2)
+        self.assertIsNotNone(self.acquire_while_closing('10.0.0.3'))
+        self.closing.set()
+        evicting.join(5)
+        self.assertNotIn('10.0.0.1', self.pool.sessions)
+
+    def test_expiry(self):
+        self.pool.max_sessions = 10
+        self.pool.acquire('10.0.0.1')
+        self.pool.release('10.0.0.1')
+        self.pool.sessions['10.0.0.1'].last_used -= 120
+        expiring = threading.Thread(target=self.pool.acquire, args=('10.0.0.2',), daemon=True)
+        expiring.start()
+        time.sleep(0.2)
+        self.assertIsNotNone(self.acquire_while_closing('10.0.0.3'))
+        self.closing.set()
+        expiring.join(5)
+        self.assertNotIn('10.0.0.1', self.pool.sessions)
+
+
+if __name__ == '__main__':
+    unittest.main()
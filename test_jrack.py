@@ -0,0 +1,52 @@
+# Author: Tyler Jordan
+# File: test_jrack.py
+# Last Modified: 10/18/2026
+# Description: Checks of the rack's value indexes and the device change counter, run with python -m unittest.
+
+import unittest
+
+from jrack import JRack, JDevice
+
+
+class ValueIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rack = JRack()
+        self.rack.new_devices([('10.0.0.1', 'EX4300', '18.4R2-S3', None, 'sw1', 'DC1'),
+                               ('10.0.0.2', 'EX4300', '18.4R2-S3', None, 'sw2', 'DC1'),
+                               ('10.0.0.3', 'EX2300', '18.4R3.3', None, 'sw3', 'DC2')])
+
+    def test_same_value_keeps_the_indexes(self):
+        # A refresh that finds the version the device already runs changes nothing
+        index = self.rack.value_index('curr_code')
+        changes = JDevice.changes
+        for device in self.rack.devices:
+            device.refresh(device.curr_code)
+        self.assertEqual(JDevice.changes, changes)
+        self.assertIs(self.rack.value_index('curr_code'), index)
+
+    def test_new_value_rebuilds_the_indexes(self):
+        self.assertEqual(len(self.rack.filter_devices(curr_code='18.4R2-S3')), 2)
+        changes = JDevice.changes
+        self.rack.get_device('10.0.0.1').refresh('18.4R3.3')
+        self.assertEqual(JDevice.changes, changes + 1)
+        self.assertEqual([device.ip for device in self.rack.filter_devices(curr_code='18.4R3.3')],
+                         ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual([device.ip for device in self.rack.filter_devices(curr_code='18.4R2-S3')], ['10.0.0.2'])
+
+    def test_added_and_removed_devices(self):
+        self.assertEqual(len(self.rack.filter_devices(model='EX4300')), 2)
+        self.rack.new_device('10.0.0.4', 'EX4300', '18.4R3.3', None, 'sw4')
+        self.assertEqual(len(self.rack.filter_devices(model='EX4300')), 3)
+        self.rack.remove_devices(['10.0.0.1'])
+        self.assertEqual([device.ip for device in self.rack.filter_devices(model='EX4300')],
+                         ['10.0.0.2', '10.0.0.4'])
+
+    def test_values_are_interned(self):
+        model = "".join(['EX', '4300'])
+        device = self.rack.new_device('10.0.0.5', model, '18.4R3.3', None, 'sw5')
+        self.assertIs(device.model, self.rack.get_device('10.0.0.1').model)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# Author: Tyler Jordan
+# File: test_jselect.py
+# Last Modified: 10/18/2026
+# Description: Checks of the selector parser and of selecting devices from a small rack, run with python -m unittest.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from jrack import JRack
+from jselect import Selector, tokenize, load_selections, save_selection, delete_selection
+
+IMAGE = "jinstall-ex-4300-{0}-signed.tgz"
+
+
+class ParserTest(unittest.TestCase):
+
+    def test_tokens(self):
+        self.assertEqual(tokenize('model~"EX 4300" AND (version<18.4 or site=\'DC 2\')'), [
+            ('word', 'model'), ('op', '~'), ('quoted', 'EX 4300'), ('word', 'and'), ('paren', '('),
+            ('word', 'version'), ('op', '<'), ('word', '18.4'), ('word', 'or'), ('word', 'site'), ('op', '='),
+            ('quoted', 'DC 2'), ('paren', ')')])
+
+    def test_and_before_or(self):
+        tree = Selector("site=DC1 or site=DC2 and model=EX2300").tree
+        self.assertEqual(tree[0], 'or')
+        self.assertEqual(tree[2][0], 'and')
+
+    def test_parentheses_and_not(self):
+        tree = Selector("not (site=DC1 or site=DC2) and model=EX2300").tree
+        self.assertEqual(tree[0], 'and')
+        self.assertEqual(tree[1][0], 'not')
+        self.assertEqual(tree[1][1][0], 'or')
+
+    def test_double_equals(self):
+        self.assertEqual(Selector("site==DC1").tree[2], '=')
+
+    def test_syntax_errors(self):
+        for expression in ["", "   ", "site", "site=", "=DC1", "site DC1", "(site=DC1", "site=DC1)",
+                           "site=DC1 and", "site=DC1 or or site=DC2", "colour=red", "and=1",
+                           "version<newest", "model~[", "age>soon", "ip=10.0.0.0/33", "ip<10.0.0.300",
+                           'site="DC1']:
+            with self.assertRaises(ValueError, msg=expression):
+                Selector(expression)
+
+
+class SelectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rack = JRack()
+        self.rack.new_devices([
+            ('10.0.0.1', 'EX4300-48P', '18.4R2-S3', IMAGE.format('18.4R3.3'), 'sw1', 'DC1'),
+            ('10.0.0.2', 'EX4300-48P', '18.4R3.3', IMAGE.format('18.4R3.3'), 'sw2', 'DC1'),
+            ('10.0.0.10', 'EX2300-24T', '15.1X49-D170.4', None, 'sw10', 'DC2'),
+            ('10.1.0.1', 'EX2300-24T', '20.4R3.8', IMAGE.format('20.4R3.8'), 'sw11', 'DC 3'),
+            ('2001:db8::1', 'QFX5100', None, None, 'qfx1', '')])
+
+    def select(self, expression):
+        return [device.ip for device in Selector(expression).select(self.rack)]
+
+    def test_equals_ignores_case(self):
+        self.assertEqual(self.select("site=dc1"), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(self.select("host=SW10"), ['10.0.0.10'])
+
+    def test_quoted_value(self):
+        self.assertEqual(self.select('site="DC 3"'), ['10.1.0.1'])
+
+    def test_empty_value(self):
+        self.assertEqual(self.select('site=""'), ['2001:db8::1'])
+        self.assertEqual(self.select('version=""'), ['2001:db8::1'])
+
+    def test_regular_expressions(self):
+        self.assertEqual(self.select("model~^ex4300"), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(self.select("model!~EX"), ['2001:db8::1'])
+
+    def test_precedence(self):
+        # and binds tighter than or, parentheses change it
+        self.assertEqual(self.select("site=DC2 or site=DC1 and version=18.4R3.3"), ['10.0.0.2', '10.0.0.10'])
+        self.assertEqual(self.select("(site=DC2 or site=DC1) and version=18.4R3.3"), ['10.0.0.2'])
+        self.assertEqual(self.select("not site=DC1 and model~EX"), ['10.0.0.10', '10.1.0.1'])
+
+    def test_versions(self):
+        # A version is compared as a Junos version, and equals every release it is the start of
+        self.assertEqual(self.select("version<18.4R3"), ['10.0.0.1', '10.0.0.10'])
+        self.assertEqual(self.select("version>=18.4R3"), ['10.0.0.2', '10.1.0.1'])
+        self.assertEqual(self.select("version=18.4"), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(self.select("version=15.1X49-D170.4"), ['10.0.0.10'])
+        # The target is compared by the version in the image name
+        self.assertEqual(self.select("target>18.4R3.3"), ['10.1.0.1'])
+        # A partial version sorts before every release it is the start of
+        self.assertEqual(self.select("target>18.4"), ['10.0.0.1', '10.0.0.2', '10.1.0.1'])
+        self.assertEqual(self.select("target=18.4R3.3 and version!=18.4R3.3"), ['10.0.0.1'])
+
+    def test_ips(self):
+        self.assertEqual(self.select("ip=10.0.0.0/24"), ['10.0.0.1', '10.0.0.2', '10.0.0.10'])
+        self.assertEqual(self.select("ip=2001:db8::/32"), ['2001:db8::1'])
+        # Addresses are compared as numbers, 10.0.0.10 comes after 10.0.0.2 and IPv6 addresses after IPv4 ones
+        self.assertEqual(self.select("ip>10.0.0.2 and ip<11.0.0.0"), ['10.0.0.10', '10.1.0.1'])
+        self.assertEqual(self.select("ip>255.255.255.255"), ['2001:db8::1'])
+
+    def test_age(self):
+        self.rack.get_device('10.0.0.1').last_refresh = time.time() - 7200
+        self.assertEqual(self.select("age>1h"), ['10.0.0.1'])
+        self.assertEqual(self.select("age<30m and site=DC1"), ['10.0.0.2'])
+
+    def test_index_follows_changes(self):
+        # Interned fields are read from the rack's value index, which has to follow device changes
+        self.assertEqual(self.select("version=20.4R3.8"), ['10.1.0.1'])
+        self.rack.get_device('10.0.0.2').refresh('20.4R3.8')
+        self.assertEqual(self.select("version=20.4R3.8"), ['10.0.0.2', '10.1.0.1'])
+        self.rack.remove_devices(['10.1.0.1'])
+        self.assertEqual(self.select("version=20.4R3.8"), ['10.0.0.2'])
+
+    def test_value_tested_once(self):
+        # Each distinct value is tested once however many devices have it
+        tested = []
+        selector = Selector("model=EX4300-48P")
+        term = selector.tree
+        test = term[4]
+        selector.tree = term[:4] + (lambda value: tested.append(value) or test(value),)
+        self.assertEqual(len(selector.select(self.rack)), 2)
+        self.assertEqual(sorted(tested), ['EX2300-24T', 'EX4300-48P', 'QFX5100'])
+
+    def test_select_all_keeps_rack_order(self):
+        self.assertEqual(self.select("site=DC1 or not site=DC1"), [device.ip for device in self.rack.devices])
+
+
+class SelectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.selections_file = os.path.join(self.directory, "selections.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_delete(self):
+        self.assertEqual(load_selections(self.selections_file), {})
+        save_selection(self.selections_file, "dc1", "site=DC1")
+        save_selection(self.selections_file, "old", "version<18.4")
+        self.assertEqual(load_selections(self.selections_file), {'dc1': 'site=DC1', 'old': 'version<18.4'})
+        self.assertTrue(delete_selection(self.selections_file, "dc1"))
+        self.assertFalse(delete_selection(self.selections_file, "dc1"))
+        self.assertEqual(load_selections(self.selections_file), {'old': 'version<18.4'})
+
+    def test_bad_selector_not_saved(self):
+        with self.assertRaises(ValueError):
+            save_selection(self.selections_file, "bad", "site=")
+        self.assertEqual(load_selections(self.selections_file), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
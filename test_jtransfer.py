@@ -0,0 +1,125 @@
+# Author: Tyler Jordan
+# File: test_jtransfer.py
+# Last Modified: 10/18/2026
+# Description: Checks of the verify and repair rounds of the image transfers, run with python -m unittest.
+
+import os
+import hashlib
+import tempfile
+import unittest
+
+from jtransfer import TransferScheduler, Transfer
+
+BLOCK = 1024
+
+
+class RemoteFile:
+    # File on a simulated device, writes go to the SFTP server's copy
+
+    def __init__(self, server, mode):
+        self.server = server
+        self.position = 0
+        self.corrupt = mode == 'r+b' and server.bad_writes > 0
+        if mode == 'r+b':
+            server.bad_writes -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def seek(self, offset):
+        self.position = offset
+
+    def write(self, data):
+        if self.corrupt:
+            data = bytes(byte ^ 1 for byte in data)
+        self.server.data[self.position:self.position + len(data)] = data
+        self.position += len(data)
+
+    def truncate(self, size):
+        del self.server.data[size:]
+
+    def check(self, algorithm, offset, length, block_size):
+        # Servers without the check-file extension raise IOError
+        raise IOError("check-file not supported")
+
+    def read(self, size):
+        data = bytes(self.server.data[self.position:self.position + size])
+        self.position += len(data)
+        return data
+
+
+class SimSFTP:
+    # SFTP server holding one copy, the first "bad_writes" repairs write corrupted data
+
+    def __init__(self, data, bad_writes=0):
+        self.data = bytearray(data)
+        self.bad_writes = bad_writes
+
+    def stat(self, path):
+        return os.stat_result((0, 0, 0, 0, 0, 0, len(self.data), 0, 0, 0))
+
+    def open(self, path, mode='rb'):
+        return RemoteFile(self, mode)
+
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.image = bytes(range(256)) * 16
+        handle, self.local_file = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as outfile:
+            outfile.write(self.image)
+        self.blocks = [hashlib.md5(self.image[start:start + BLOCK]).hexdigest()
+                       for start in range(0, len(self.image), BLOCK)]
+        self.scheduler = TransferScheduler(chunk_size=256, block_size=BLOCK, attempts=2)
+
+    def tearDown(self):
+        self.scheduler.close()
+        os.remove(self.local_file)
+
+    def verify(self, sftp):
+        transfer = Transfer('192.0.2.1', 'DC1', len(self.image))
+        self.scheduler.verify(transfer, sftp, self.local_file, 'image.tgz', None, self.blocks, 'md5', None)
+        return transfer
+
+    def damaged(self, bad_writes):
+        data = bytearray(self.image)
+        data[BLOCK + 10] ^= 1
+        return SimSFTP(data, bad_writes)
+
+    def test_good_copy(self):
+        transfer = self.verify(SimSFTP(self.image))
+        self.assertTrue(transfer.ok)
+        self.assertEqual(transfer.repaired, 0)
+
+    def test_repaired_in_first_round(self):
+        sftp = self.damaged(0)
+        transfer = self.verify(sftp)
+        self.assertTrue(transfer.ok)
+        self.assertEqual(transfer.repaired, 1)
+        self.assertEqual(bytes(sftp.data), self.image)
+
+    def test_repaired_in_last_round(self):
+        # The first repair goes wrong, the second (and last) one works
+        sftp = self.damaged(1)
+        transfer = self.verify(sftp)
+        self.assertTrue(transfer.ok)
+        self.assertTrue(transfer.verified)
+        self.assertEqual(transfer.repaired, 2)
+        self.assertEqual(transfer.error, '')
+
+    def test_not_repaired(self):
+        transfer = self.verify(self.damaged(2))
+        self.assertFalse(transfer.ok)
+        self.assertEqual(transfer.repaired, 2)
+        self.assertIn("does not match after repairs", transfer.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
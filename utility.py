@@ -4,23 +4,22 @@
 # Purpose: Assist CBP engineers with Juniper configuration tasks
 
 import sys, re, os
+import csv
+import io
+import codecs
 import fileinput
 import glob
 import code
-import paramiko  # https://github.com/paramiko/paramiko for -c -mc -put -get
 import logging
+import time
+import random
+import threading
 
 from os import listdir
 from os.path import isfile, join, exists
-from jnpr.junos import Device
-from jnpr.junos.utils.config import Config
-from jnpr.junos.exception import ConnectError
-from jnpr.junos.exception import LockError
-from jnpr.junos.exception import UnlockError
-from jnpr.junos.exception import ConfigLoadError
-from jnpr.junos.exception import CommitError
-from ncclient import manager  # https://github.com/ncclient/ncclient
-from ncclient.transport import errors
+from contextlib import contextmanager
+from jpool import SessionPool
+from jmetrics import metrics
 
 #--------------------------------------
 # ANSWER METHODS
@@ -214,44 +213,62 @@ def chooseDevices():
 
 # Converts listDict to CSV file
 def listDictCSV(myListDict, filePathName, keys):
-    addKeys = True
-    if (os.path.isfile(filePathName)):
-        addKeys = False
+    # Append rows to a CSV file, quoted by the csv module. The rows are written in the columns of the file, a file
+    # missing some of the keys is first rewritten once with them added as blank columns. Returns the file written.
+    fieldnames = keys
+    if os.path.isfile(filePathName):
+        with open(filePathName, newline='') as myfile:
+            header = next(csv.reader(myfile), None)
+        if header:
+            missing = [key for key in keys if key not in header]
+            if missing:
+                header = migrateCSVHeader(filePathName, header, keys)
+            fieldnames = header
+    addKeys = not os.path.isfile(filePathName) or os.path.getsize(filePathName) == 0
     try:
-        f = open(filePathName, 'a')
+        f = open(filePathName, 'a', newline='')
     except Exception as err:
         print("Failure opening file in append mode - ERROR: {0}".format(err))
         print("Be sure {0} isn't open in another program.".format(filePathName))
     else:
-        if addKeys:
-            #Write all the headings in the CSV
-            for akey in keys[:-1]:							# Runs for every element, except the last
-                f.write(akey + ",")							# Writes most elements
-            f.write(keys[-1])								# Writes last element
-            f.write("\n")
-
-        for part in myListDict:
-            for bkey in keys[:-1]:
-                #print "Key: " + bkey + "  Value: " + str(part[bkey])
-                f.write(str(part[bkey]) + ",")
-            f.write(str(part[keys[-1]]))
-            f.write("\n")
-        f.close()
+        with f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, restval='', extrasaction='ignore')
+            if addKeys:
+                #Write all the headings in the CSV
+                writer.writeheader()
+            for part in myListDict:
+                writer.writerow(part)
         print("\nCompleted appending to CSV.")
-
-# Converts CSV file to listDict
+    return filePathName
+
+# Rewrites a CSV file with the keys as its columns, followed by any old columns that are not keys. Old rows get
+# blanks in the new columns. The file is replaced in one step. Returns the new header.
+def migrateCSVHeader(filePathName, header, keys):
+    newHeader = keys + [key for key in header if key not in keys]
+    tempPathName = filePathName + ".tmp"
+    with open(filePathName, newline='') as infile, open(tempPathName, 'w', newline='') as outfile:
+        reader = csv.DictReader(infile)
+        writer = csv.DictWriter(outfile, fieldnames=newHeader, restval='', extrasaction='ignore')
+        writer.writeheader()
+        for row in reader:
+            writer.writerow(row)
+    os.replace(tempPathName, filePathName)
+    print("Added columns {0} to {1}".format(", ".join(key for key in keys if key not in header), filePathName))
+    return newHeader
+
+# Converts CSV file to listDict, whitespace is removed from the keys and values and missing values are blank. Device
+# lists are read with jinventory instead, which streams the rows.
 def csvListDict(fileName):
     myListDict = []
     try:
-        with open(fileName) as myfile:
-            firstline = True
-            for line in myfile:
-                if firstline:
-                    mykeys = "".join(line.split()).split(',')
-                    firstline = False
-                else:
-                    values = "".join(line.split()).split(',')
-                    a.append({mykeys[n]:values[n] for n in range(0,len(mykeys))})
+        with open(fileName, newline='') as myfile:
+            reader = csv.reader(myfile)
+            mykeys = ["".join(key.split()) for key in next(reader, [])]
+            for values in reader:
+                if not values:
+                    continue
+                values = ["".join(value.split()) for value in values]
+                myListDict.append({mykeys[n]: values[n] if n < len(values) else '' for n in range(0, len(mykeys))})
     except Exception as err:
         print("Failure converting CSV to listDict - ERROR: {0}".format(err))
     return myListDict
@@ -317,24 +334,62 @@ def tabulateRebootResults(listDict):
     return statusDict
 
 # Get fact
-def get_fact(ip, username, password, fact):
+def get_fact(ip, username, password, fact, pool=None):
     """ Purpose: For collecting a single fact from the target system. The 'fact' must be one of the predefined ones.
         Examples:
             model, version, hostname, serialnumber,
             switch_style, last_reboot_reason, uptime,
             personality
         Parameters:
+            pool        -   SessionPool to reuse an open session from, a one-off session is used when None
     """
-    dev = Device(ip, user=username, password=password)
+    if pool is None:
+        pool = SessionPool(username, password, max_sessions=0)
     try:
-        dev.open()
+        dev = pool.acquire(ip)
     except Exception as err:
         print("Unable to open connection to: {0} | ERROR: {1}".format(ip, err))
     else:
-        myfact = dev.facts[fact]
-        dev.close()
+        try:
+            myfact = dev.facts[fact]
+        finally:
+            pool.release(ip)
         return myfact
 
+# Get the running Junos version with one RPC
+def get_junos_version(dev):
+    """ Purpose: Returns the Junos version running on the device using a single get-software-information RPC,
+                 without gathering the PyEZ facts.
+        Parameters:
+            dev         -   An open PyEZ Device
+    """
+    rsp = dev.rpc.get_software_information()
+    version = rsp.findtext('.//junos-version')
+    if version:
+        return version.strip()
+    # Older releases only list the version in the package comments, ie. "JUNOS Base OS boot [12.3R12.4]"
+    for comment in rsp.findall('.//package-information/comment'):
+        match = re.search(r'\[(.+?)\]', comment.text or '')
+        if match:
+            return match.group(1)
+    return None
+
+# Get the size of a file on the device
+def remote_file_size(dev, remote_file):
+    """ Purpose: Returns the size in bytes of a file on the device, or None if the file does not exist.
+        Parameters:
+            dev         -   An open PyEZ Device
+            remote_file -   Full path of the file on the device
+    """
+    try:
+        rsp = dev.rpc.file_list(detail=True, path=remote_file)
+    except Exception:
+        return None
+    size = rsp.findtext('.//file-size')
+    if size is None:
+        return None
+    return int(size.strip())
+
 # Run a single non-edit command and get the output returned
 def op_command(ip, host_name, command, username, password, port=22):
     """ Purpose: For the -c flag, this function is called. It will connect to a device, run the single specified command, and return the output.
@@ -346,93 +401,174 @@ def op_command(ip, host_name, command, username, password, port=22):
             username    -   Username used to log into the device
             password    -   Password is needed because we are using paramiko for this.
     """
+    return op_commands(ip, host_name, [command], username, password, port)
+
+# Run several non-edit commands over one connection and get the output returned
+def op_commands(ip, host_name, command_list, username, password, port=22, out=None):
+    """ Purpose: Connect to a device once and run every command in command_list over that connection. Each command
+                 runs in its own channel of the same SSH session. Output is read in chunks as it arrives and written
+                 to "out", so memory use does not depend on the size of the output.
+        Parameters:
+            ip              -   String containing the IP of the remote device, used for logging purposes.
+            host_name       -   The device host-name for output purposes.
+            command_list    -   List of command strings to be sent to the device.
+            username        -   Username used to log into the device
+            password        -   Password is needed because we are using paramiko for this.
+            out             -   Writable text file for the output. When None, the output is returned as a string.
+    """
+    if out is None:
+        out = io.StringIO()
+        op_commands(ip, host_name, command_list, username, password, port, out)
+        return out.getvalue()
+
+    # Loaded on first use, paramiko takes a while to import
+    import paramiko  # https://github.com/paramiko/paramiko for -c -mc -put -get
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    device = '*' * 80 + '\n[{0} at {1}] - Command: {2}\n'.format(host_name, ip, command)
-    print("Device: {0}").format(device)
-    command = command.strip() + ' | no-more\n'
-    output = ''
     try:
         ssh.connect(ip, port=port, username=username, password=password)
-        stdin, stdout, stderr = ssh.exec_command(command=command, timeout=900)
-        stdin.close()
-        # read normal output
-        while not stdout.channel.exit_status_ready():
-            output += stdout.read()
-        stdout.close()
-        # read errors
-        while not stderr.channel.exit_status_ready():
-            output += stderr.read()
-        stderr.close()
-        output = '{0}\n{1}'.format(device, output)
-        return output
+        for command in command_list:
+            out.write('*' * 80 + '\n[{0} at {1}] - Command: {2}\n\n'.format(host_name, ip, command))
+            channel = ssh.get_transport().open_session()
+            # Errors come back in the same stream, so neither stream can fill up while the other is read
+            channel.set_combine_stderr(True)
+            channel.settimeout(900)
+            channel.exec_command(command.strip() + ' | no-more\n')
+            channel.shutdown_write()
+            # recv() blocks until data arrives and returns nothing once the command has finished
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            while True:
+                chunk = channel.recv(32768)
+                if not chunk:
+                    break
+                out.write(decoder.decode(chunk))
+            out.write(decoder.decode(b'', final=True))
+            channel.close()
     except paramiko.AuthenticationException:
-        output = '*' * 45 + '\n\nBad username or password for device: {0}\n'.format(ip)
-        return output
-
-def set_command(ip, username, password, port, log_file, command_list):
+        out.write('*' * 45 + '\n\nBad username or password for device: {0}\n'.format(ip))
+    finally:
+        ssh.close()
+    return out
+
+# Copy a file to the screen and optionally a log file, a block at a time. The file is written under the same lock and
+# through the same log handles as screen_and_log(), so output of other workers cannot land in the middle of it.
+def copy_to_screen_and_log(path, log_file=None, block_size=65536):
+    with open(path, 'r') as infile, output_lock, _log_handle(log_file) as logfile:
+        for block in iter(lambda: infile.read(block_size), ''):
+            if logfile is not None:
+                logfile.write(block)
+            sys.stdout.write(block)
+
+def set_command(ip, username, password, port, log_file, command_list, hostname=None, lock_retries=0, lock_backoff=5,
+                progress=True):
     """ Purpose: This is the function for the -s or -sl flags. it will send set command(s) to a device, and commit the change.
         Parameters:
-            connection  -   The NCClient manager connection to the remote device.
-            ip          -   String containing the IP of the remote device, used for logging purposes.
-            host_name   -   The device host-name for output purposes.
-            commands    -   String containing the set command to be sent to the device, or a list of strings of multiple set commands.
-                            Either way, the device will respond accordingly, and only one commit will take place.
+            ip              -   String containing the IP of the remote device, used for logging purposes.
+            log_file        -   The log file name, including path and filename
+            command_list    -   String containing the set command to be sent to the device, or a list of strings of multiple set commands.
+                                Either way, the device will respond accordingly, and only one commit will take place.
+            hostname        -   The device host-name for output purposes, read from the device when None.
+            lock_retries    -   How many more times to try locking a configuration that is locked by someone else.
+            lock_backoff    -   Seconds to wait before the first lock retry, doubled for every retry after that.
+            progress        -   Display progress dots, turn off when several devices are loaded at the same time.
+        Returns:
+            Dictionary with the 'Result' ('Committed' or 'Failed'), lock 'Attempts', 'Seconds' and 'Comments'
     """
-    dot = "."
-
-    try:
-        connection = run(ip, username, password, port)
-    except Exception as err:
-        screen_and_log(("Connection Error with {0}: Aborting Set Operation".format(ip)), log_file)
-    else:
-        software_info = connection.get_software_information(format='xml')
-        hostname = software_info.xpath('//software-information/host-name')[0].text
+    dot = "." if progress else ""
+    outcome = {'IP': ip, 'Host': hostname, 'Result': 'Failed', 'Attempts': 0, 'Seconds': 0.0, 'Comments': ''}
+    start = time.time()
 
-        screen_and_log(("Applying configuration on {0} ({1}) ".format(hostname, ip)), log_file)
-        screen_and_log(dot, log_file)
+    with metrics.timer('set', 'connect') as timing:
+        error = None
         try:
-            connection.lock()
+            connection = run(ip, username, password, port)
         except Exception as err:
-            screen_and_log(("{0}: Unable to Lock configuration : {1}".format(ip, err)), log_file)
-            return
-        screen_and_log(dot, log_file)
-        # Load configuration block
+            connection = None
+            error = err
+        timing.ok = connection is not None
+    if connection is None:
+        screen_and_log(("Connection Error with {0}: Aborting Set Operation {1}\n".format(ip, error or '')), log_file)
+        outcome['Comments'] = 'Connection error: {0}'.format(error) if error else 'Connection error'
+        return outcome
+
+    try:
+        _set_configuration(connection, ip, log_file, command_list, lock_retries, lock_backoff, dot, outcome)
+    finally:
         try:
-            connection.load_configuration(action='set', config=command_list)
-        except (ConfigLoadError, Exception) as err:
-            if 'statement not found' in err.message:
-                #print "Bypassing warning through message"
-                pass
-            #elif err.rpc_error['severity'] == 'warning':
-            #    print "Bypassing warning through severity"
-            #    pass
+            connection.close_session()
+        except Exception:
+            pass
+        outcome['Seconds'] = round(time.time() - start, 1)
+        metrics.observe('set', 'total', time.time() - start, outcome['Result'] == 'Committed')
+    return outcome
+
+def _set_configuration(connection, ip, log_file, command_list, lock_retries, lock_backoff, dot, outcome):
+    # Lock, load, commit and unlock the configuration for set_command(), filling in "outcome"
+    if not outcome['Host']:
+        software_info = connection.get_software_information(format='xml')
+        outcome['Host'] = software_info.xpath('//software-information/host-name')[0].text
+    hostname = outcome['Host']
+
+    screen_and_log(("Applying configuration on {0} ({1}) ".format(hostname, ip)), log_file)
+    screen_and_log(dot, log_file)
+    # Lock configuration block, someone else may be holding the lock so try again after a while
+    with metrics.timer('set', 'lock') as timing:
+        while True:
+            outcome['Attempts'] += 1
+            try:
+                connection.lock()
+            except Exception as err:
+                if outcome['Attempts'] > lock_retries:
+                    screen_and_log(("{0}: Unable to Lock configuration : {1}\n".format(ip, err)), log_file)
+                    outcome['Comments'] = 'Unable to lock configuration'
+                    timing.ok = False
+                    return
+                delay = lock_backoff * 2 ** (outcome['Attempts'] - 1) * random.uniform(1, 1.5)
+                screen_and_log(("{0}: Configuration locked, retrying in {1:.0f} seconds\n".format(ip, delay)), log_file)
+                time.sleep(delay)
             else:
-                screen_and_log(("{0}: Unable to Load the configuration : {1}".format(ip, err)), log_file)
-                screen_and_log(("{0}: Unlocking the configuration".format(ip)), log_file)
-                try:
-                    connection.unlock()
-                except Exception as err:
-                    screen_and_log(("{0}: Unable to Unlock the configuration : {1}".format(ip, err)), log_file)
-                connection.close_session()
-                return
-        screen_and_log(dot, log_file)
-        # Commit configuration block
-        try:
-            connection.commit()
-        except Exception as err:
-            screen_and_log(("{0}: Commit fails : {1}".format(ip, err)), log_file)
+                break
+    screen_and_log(dot, log_file)
+    # Load configuration block
+    try:
+        with metrics.timer('set', 'load'):
+            connection.load_configuration(action='set', config=command_list)
+    except Exception as err:
+        if 'statement not found' in str(getattr(err, 'message', err)):
+            #print "Bypassing warning through message"
+            pass
+        #elif err.rpc_error['severity'] == 'warning':
+        #    print "Bypassing warning through severity"
+        #    pass
+        else:
+            screen_and_log(("{0}: Unable to Load the configuration : {1}\n".format(ip, err)), log_file)
+            screen_and_log(("{0}: Unlocking the configuration\n".format(ip)), log_file)
+            outcome['Comments'] = 'Unable to load configuration'
+            try:
+                connection.unlock()
+            except Exception as err:
+                screen_and_log(("{0}: Unable to Unlock the configuration : {1}\n".format(ip, err)), log_file)
             return
-        screen_and_log(dot, log_file)
-        # Unlock configuration block
-        try:
+    screen_and_log(dot, log_file)
+    # Commit configuration block
+    try:
+        with metrics.timer('set', 'commit'):
+            connection.commit()
+    except Exception as err:
+        screen_and_log(("{0}: Commit fails : {1}\n".format(ip, err)), log_file)
+        outcome['Comments'] = 'Commit failed'
+        return
+    outcome['Result'] = 'Committed'
+    screen_and_log(dot, log_file)
+    # Unlock configuration block
+    try:
+        with metrics.timer('set', 'unlock'):
             connection.unlock()
-        except Exception as err:
-            screen_and_log(("{0}: Unable to Unlock the configuration : {1}".format(ip, err)), log_file)
-            connection.close_session()
-            return
-        connection.close_session()
-        screen_and_log(" Completed!\n", log_file)
+    except Exception as err:
+        screen_and_log(("{0}: Unable to Unlock the configuration : {1}\n".format(ip, err)), log_file)
+        outcome['Comments'] = 'Unable to unlock configuration'
+        return
+    screen_and_log(" Completed!\n", log_file)
 
 def enable_netconf(ip, username, password, port, log_file=None):
     """ Purpose: To enable the netconf ssh service on a device that does not have it.
@@ -440,8 +576,10 @@ def enable_netconf(ip, username, password, port, log_file=None):
     netconf_command = "set system services netconf ssh"
     print("Trying to enable NETCONF on {0}".format(ip))
     try:
-        set_command(ip, username, password, port, log_file, netconf_command)
+        outcome = set_command(ip, username, password, port, log_file, netconf_command)
     except Exception as err:
+        outcome = {'Result': 'Failed'}
+    if outcome['Result'] != 'Committed':
         print("Failed to enable NETCONF.")
         return False
     else:
@@ -455,6 +593,8 @@ def run(ip, username, password, port):
             username    -   The string username used to connect to the device.
             password    -   The string password used to connect to the device.
     """
+    from ncclient import manager  # https://github.com/ncclient/ncclient
+    from ncclient.transport import errors
     output = ''
     try:
         #print "{0}: Establishing connection...".format(ip)
@@ -475,7 +615,7 @@ def run(ip, username, password, port):
     else:
         return connection
 
-def load_with_pyez(merge_opt, overwrite_opt, format_opt, conf_file, log_file, ip, hostname, username, password):
+def load_with_pyez(merge_opt, overwrite_opt, format_opt, conf_file, log_file, ip, hostname, username, password, pool=None):
     """ Purpose: Perform the actual loading of the config file. Catch any errors.
         Parameters:
             format_opt      -   defines the format of input "set" or "hierarchical"
@@ -487,34 +627,51 @@ def load_with_pyez(merge_opt, overwrite_opt, format_opt, conf_file, log_file, ip
             hostname        -   device hostname
             username        -   username for logging in
             password        -   password for username
+            pool            -   SessionPool to reuse an open session from, a one-off session is used when None
+        Returns:
+            True if the configuration was committed and unlocked
     """
+    from jnpr.junos.utils.config import Config
+    from jnpr.junos.exception import ConnectError
     dot = "."
     screen_and_log(("Applying configuration on {0} ({1}) ".format(hostname, ip)), log_file)
     screen_and_log(dot, log_file)
-    dev = Device(ip, user=username, password=password)
+    if pool is None:
+        pool = SessionPool(username, password, max_sessions=0)
     try:
-        dev.open()
+        dev = pool.acquire(ip)
     except ConnectError as err:
         screen_and_log(("{0}: Cannot connect to device : {1}".format(ip, err)), log_file)
-        return
-    dev.bind(cu=Config)
+        return False
+    completed = False
+    try:
+        completed = _load_config(Config(dev), merge_opt, overwrite_opt, format_opt, conf_file, log_file, ip)
+    finally:
+        # Give the session back to the pool. After a failure it may still hold the configuration lock or be broken,
+        # so it is closed instead of being handed to the next caller.
+        pool.release(ip, discard=not completed)
+    return completed
+
+def _load_config(cu, merge_opt, overwrite_opt, format_opt, conf_file, log_file, ip):
+    # Lock, load, commit and unlock the configuration for load_with_pyez(), returns True when all of them worked
+    from jnpr.junos.exception import LockError, UnlockError, ConfigLoadError, CommitError
+    dot = "."
 
     #print("Try locking the configuration...")
     screen_and_log(dot, log_file)
     try:
-        dev.cu.lock()
+        cu.lock()
     except LockError as err:
         screen_and_log(("{0}: Unable to lock configuration : {1}".format(ip, err)), log_file)
-        dev.close()
-        return
+        return False
 
     #print("Try loading configuration changes...")
     screen_and_log(dot, log_file)
     try:
-        if format is None:
-            dev.cu.load(path=conf_file, merge=merge_opt, overwrite=overwrite_opt)
+        if format_opt is None:
+            cu.load(path=conf_file, merge=merge_opt, overwrite=overwrite_opt)
         else:
-            dev.cu.load(path=conf_file, merge=merge_opt, format="set")
+            cu.load(path=conf_file, merge=merge_opt, format="set")
     except (ConfigLoadError, Exception) as err:
         if err.rpc_error['severity'] == 'warning':
             pass
@@ -524,42 +681,91 @@ def load_with_pyez(merge_opt, overwrite_opt, format_opt, conf_file, log_file, ip
             screen_and_log(("{0}: Unable to load configuration changes : {1}".format(ip, err)), log_file)
             screen_and_log(("{0}: Unlocking the configuration".format(ip)), log_file)
             try:
-                dev.cu.unlock()
+                cu.unlock()
             except UnlockError as err:
                 screen_and_log(("{0}: Unable to unlock configuration : {1}".format(ip, err)), log_file)
-            dev.close()
-            return
+            return False
 
     #print("Try committing the configuration...")
     screen_and_log(dot, log_file)
     try:
-        dev.cu.commit()
+        cu.commit()
     except CommitError as err:
         screen_and_log(("{0}: Unable to commit configuration : {1}".format(ip, err)), log_file)
         screen_and_log(("{0}: Unlocking the configuration".format(ip)), log_file)
         try:
-            dev.cu.unlock()
+            cu.unlock()
         except UnlockError as err:
             screen_and_log(("{0}: Unable to unlock configuration : {1}".format(ip, err)), log_file)
-        dev.close()
-        return
+        return False
 
     #print("Try Unlocking the configuration...")
     screen_and_log(dot, log_file)
     try:
-        dev.cu.unlock()
+        cu.unlock()
     except UnlockError as err:
         screen_and_log(("{0}: Unable to unlock configuration : {1}".format(ip, err)), log_file)
-        dev.close()
-        return
+        return False
 
-    # End the NETCONF session and close the connection
-    dev.close()
     screen_and_log((" Completed!\n"), log_file)
+    return True
+
+# Builds a table for display, prettytable is only imported when the first table is built
+def PrettyTable(field_names=None, **kwargs):
+    from prettytable import PrettyTable as Table
+    return Table(field_names, **kwargs)
+
+# Keeps output from parallel workers from being mixed together
+output_lock = threading.Lock()
+# Output files of the operations running now, with the number of log_scope() blocks using each, see log_scope()
+open_logs = {}
 
 # Prints output to a log file and the screen
 def screen_and_log(output, log_file=None):
-    if log_file is not None:
-        with open(log_file, 'a') as myfile:
+    with output_lock, _log_handle(log_file) as myfile:
+        if myfile is not None:
             myfile.write(output)
-    sys.stdout.write(output)
\ No newline at end of file
+        sys.stdout.write(output)
+
+# Keeps an output file open while an operation writes to it, instead of reopening it for every line. The file is
+# closed when the last block using it ends, so nothing is held open between operations. A None log_file does nothing.
+@contextmanager
+def log_scope(log_file):
+    if log_file is None:
+        yield
+        return
+    with output_lock:
+        if log_file in open_logs:
+            open_logs[log_file][1] += 1
+        else:
+            open_logs[log_file] = [open(log_file, 'a'), 1]
+    try:
+        yield
+    finally:
+        with output_lock:
+            entry = open_logs[log_file]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del open_logs[log_file]
+                entry[0].close()
+
+# The handle of an output file, call with output_lock held. Files in a log_scope() are flushed and stay open, others
+# are opened for this write only. None when there is no log_file.
+@contextmanager
+def _log_handle(log_file):
+    if log_file is None:
+        yield None
+    elif log_file in open_logs:
+        myfile = open_logs[log_file][0]
+        yield myfile
+        myfile.flush()
+    else:
+        with open(log_file, 'a') as myfile:
+            yield myfile
+
+# Close any output files still open, ie. of an operation that was interrupted
+def close_logs():
+    with output_lock:
+        for myfile, users in open_logs.values():
+            myfile.close()
+        open_logs.clear()
\ No newline at end of file